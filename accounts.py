@@ -0,0 +1,323 @@
+"""Many trading accounts evaluated together against one shared price cache.
+
+``AccountPool`` keeps the state of every account in columnar arrays (cash
+vector, positions and cost-basis matrices indexed by [account, code]) so
+that a date step for hundreds of accounts is a handful of NumPy operations.
+All accounts read prices through a single ``StockDataManager``; each price
+vector is built once per date and shared.
+
+Per-account trade logs are ``TradeStore`` instances, and cost/risk settings
+(fee_rate, min_fee, slippage_per_share, spread_bps, impact_coef,
+stop_loss_pct, scale_step_pct, scale_fraction_pct) are per-account vectors
+with the same meaning as on ``TradeManager``. Fills are priced by
+``costs.CostModel`` (commission tiers are not per-account and not used here).
+"""
+import datetime
+import json
+
+import numpy as np
+
+from costs import CostModel
+from trade_store import TRADE_DTYPE, TradeStore
+
+SETTING_DEFAULTS = {
+    "fee_rate": 0.0001,
+    "min_fee": 1.0,
+    "slippage_per_share": 0.0,
+    "spread_bps": 0.0,
+    "impact_coef": 0.0,
+    "stop_loss_pct": 0.0,
+    "scale_step_pct": 0.0,
+    "scale_fraction_pct": 0.0,
+}
+
+
+class AccountPool:
+    def __init__(self, data_manager, codes=None, capacity=16, price_cache=None):
+        """``price_cache`` ({date_str: price vector}) can be shared between pools over the same codes.
+
+        ``data_manager`` may be None when ``codes`` is given and ``price_cache`` covers every stepped date.
+        """
+        self.data_manager = data_manager
+        self.codes = list(codes if codes is not None else data_manager.get_stock_list())
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.names = []
+        self.index = {}
+        self.logs = []
+        n_codes = len(self.codes)
+        self._capacity = max(1, capacity)
+        self._cash = np.zeros(self._capacity)
+        self._initial_cash = np.zeros(self._capacity)
+        self._realized = np.zeros(self._capacity)
+        self._positions = np.zeros((self._capacity, n_codes), dtype=np.int64)
+        self._cost = np.zeros((self._capacity, n_codes))
+        self._settings = {key: np.full(self._capacity, value) for key, value in SETTING_DEFAULTS.items()}
+        self._price_cache = price_cache if price_cache is not None else {}
+        self.last_prices = np.full(n_codes, np.nan)
+        self.equity_dates = []
+        self.equity_history = []
+
+    # ----------------------- Accounts -----------------------
+    def __len__(self):
+        return len(self.names)
+
+    def _grow(self):
+        new_cap = self._capacity * 2
+
+        def grow(arr, fill=0.0):
+            out = np.full((new_cap,) + arr.shape[1:], fill, dtype=arr.dtype)
+            out[:self._capacity] = arr
+            return out
+        self._cash = grow(self._cash)
+        self._initial_cash = grow(self._initial_cash)
+        self._realized = grow(self._realized)
+        self._positions = grow(self._positions, 0)
+        self._cost = grow(self._cost)
+        self._settings = {key: grow(arr, SETTING_DEFAULTS[key]) for key, arr in self._settings.items()}
+        self._capacity = new_cap
+
+    def add_account(self, name, initial_cash=100000.0, **settings):
+        """Register an account and return its row index."""
+        if name in self.index:
+            raise ValueError(f"Account {name!r} already exists")
+        unknown = set(settings) - set(SETTING_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown account settings: {sorted(unknown)}")
+        if len(self.names) == self._capacity:
+            self._grow()
+        i = len(self.names)
+        self.names.append(name)
+        self.index[name] = i
+        self.logs.append(TradeStore())
+        self._cash[i] = self._initial_cash[i] = float(initial_cash)
+        for key, value in settings.items():
+            self._settings[key][i] = float(value)
+        return i
+
+    @classmethod
+    def from_trade_managers(cls, data_manager, managers, codes=None):
+        """Build a pool from {name: TradeManager}, copying cash, positions, settings and trades."""
+        pool = cls(data_manager, codes=codes, capacity=len(managers))
+        for name, tm in managers.items():
+            i = pool.add_account(
+                name, tm.initial_cash, **{key: getattr(tm, key) for key in SETTING_DEFAULTS}
+            )
+            pool._cash[i] = tm.cash
+            for code, info in tm.get_portfolio().items():
+                j = pool.code_index.get(code)
+                if j is not None:
+                    pool._positions[i, j] = info['shares']
+                    pool._cost[i, j] = info['total_cost']
+            pool.logs[i] = TradeStore.from_records(tm.get_trade_records().to_records())
+        return pool
+
+    # Views over the live rows
+    @property
+    def cash(self):
+        return self._cash[:len(self.names)]
+
+    @property
+    def initial_cash(self):
+        return self._initial_cash[:len(self.names)]
+
+    @property
+    def realized(self):
+        return self._realized[:len(self.names)]
+
+    @property
+    def positions(self):
+        return self._positions[:len(self.names)]
+
+    @property
+    def cost(self):
+        return self._cost[:len(self.names)]
+
+    def setting(self, key):
+        return self._settings[key][:len(self.names)]
+
+    def portfolio(self, name):
+        """Portfolio of one account in the TradeManager layout."""
+        i = self.index[name]
+        held = np.nonzero(self._positions[i])[0]
+        return {
+            self.codes[j]: {'shares': int(self._positions[i, j]), 'total_cost': float(self._cost[i, j])}
+            for j in held.tolist()
+        }
+
+    # ----------------------- Prices -----------------------
+    def price_vector(self, date):
+        """Closing prices of the universe on ``date`` (shared across accounts, cached per date).
+
+        Codes without a price carry their last known price (NaN if never seen).
+        """
+        date_str = date.strftime("%Y-%m-%d")
+        cached = self._price_cache.get(date_str)
+        if cached is not None:
+            return cached
+        day = self.data_manager.get_cached_day(date_str)
+        prices = np.empty(len(self.codes))
+        for j, code in enumerate(self.codes):
+            entry = day.get(code)
+            if entry is None:
+                entry = self.data_manager.get_stock_data(code, date)
+            prices[j] = entry["price"] if entry is not None else np.nan
+        missing = np.isnan(prices)
+        prices[missing] = self.last_prices[missing]
+        self.last_prices = np.where(np.isnan(prices), self.last_prices, prices)
+        self._price_cache[date_str] = prices
+        return prices
+
+    def clear_price_cache(self):
+        self._price_cache.clear()
+
+    # ----------------------- Evaluation -----------------------
+    def market_value(self, prices):
+        return self.positions @ np.nan_to_num(prices)
+
+    def equity(self, prices):
+        return self.cash + self.market_value(prices)
+
+    def cost_model(self):
+        """CostModel with each account's cost settings as a column vector."""
+        return CostModel(**{key: self.setting(key)[:, None] for key in
+                            ("fee_rate", "min_fee", "slippage_per_share", "spread_bps", "impact_coef")})
+
+    def execute(self, date, orders, prices, volume=None):
+        """Fill a [account, code] matrix of signed share orders at ``prices``.
+
+        Sells are clipped to the shares held and filled first; an account's buys
+        are skipped for the step if cash after sells cannot cover them and
+        their fees. Costs follow TradeManager.calculate_trade_costs
+        (``volume``: bar volume per code, for market impact). Returns the
+        matrix of filled signed shares.
+        """
+        n = len(self.names)
+        orders = np.asarray(orders, dtype=np.int64)[:n]
+        valid = ~np.isnan(prices)
+        orders = np.where(valid, orders, 0)
+        sells = np.minimum(np.maximum(-orders, 0), self.positions)
+        buys = np.maximum(orders, 0)
+
+        model = self.cost_model()
+        px = np.nan_to_num(prices)[None, :]
+        vol = None if volume is None else np.asarray(volume, dtype=float)[None, :]
+        sell_px, sell_gross, sell_fee = model.price(px, sells, -1, vol)
+        buy_px, buy_gross, buy_fee = model.price(px, buys, 1, vol)
+
+        cash_after_sells = self.cash + (sell_gross - sell_fee).sum(axis=1)
+        affordable = (buy_gross + buy_fee).sum(axis=1) <= cash_after_sells
+        buys = np.where(affordable[:, None], buys, 0)
+        buy_gross = np.where(affordable[:, None], buy_gross, 0.0)
+        buy_fee = np.where(affordable[:, None], buy_fee, 0.0)
+
+        # Average-cost basis: sells release cost proportionally
+        positions = self.positions
+        cost = self.cost
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg = np.where(positions > 0, cost / positions, 0.0)
+        released = avg * sells
+        self.realized[:] += (sell_gross - released).sum(axis=1)
+        cost -= released
+        cost += buy_gross
+        positions += buys - sells
+        cost[positions == 0] = 0.0
+        self.cash[:] = cash_after_sells - (buy_gross + buy_fee).sum(axis=1)
+
+        filled = buys - sells
+        self._log_fills(date, filled, sell_px, buy_px, sell_gross, buy_gross)
+        return filled
+
+    def _log_fills(self, date, filled, sell_px, buy_px, sell_gross, buy_gross):
+        date_str = date.strftime("%Y-%m-%d")
+        rows, cols = np.nonzero(filled)
+        if len(rows) == 0:
+            return
+        names = self.data_manager.get_stock_list() if self.data_manager is not None else {}
+        for i, j, qty in zip(rows.tolist(), cols.tolist(), filled[rows, cols].tolist()):
+            code = self.codes[j]
+            if qty > 0:
+                self.logs[i].add(date_str, code, names.get(code, code), 'Buy', qty,
+                                 float(buy_px[i, j]), float(buy_gross[i, j]))
+            else:
+                self.logs[i].add(date_str, code, names.get(code, code), 'Sell', -qty,
+                                 float(sell_px[i, j]), float(sell_gross[i, j]))
+
+    def step(self, date, strategy=None):
+        """Advance all accounts by one date.
+
+        ``strategy(pool, date, prices)`` returns an [account, code] order matrix
+        (or None for no trades). Returns the equity vector after the fills.
+        """
+        prices = self.price_vector(date)
+        if strategy is not None:
+            orders = strategy(self, date, prices)
+            if orders is not None:
+                self.execute(date, orders, prices)
+        equity = self.equity(prices)
+        self.equity_dates.append(date)
+        self.equity_history.append(equity.copy())
+        return equity
+
+    def run(self, dates, strategy=None):
+        """Step through ``dates``; returns the [date, account] equity matrix."""
+        for date in dates:
+            self.step(date, strategy)
+        return self.equity_matrix()
+
+    def equity_matrix(self):
+        if not self.equity_history:
+            return np.zeros((0, len(self.names)))
+        return np.vstack(self.equity_history)
+
+    # ----------------------- Persistence -----------------------
+    def save(self, path):
+        """Write all accounts to one compressed .npz file."""
+        log_rows = [log.array for log in self.logs]
+        owner = np.concatenate([np.full(len(rows), i, dtype=np.int32) for i, rows in enumerate(log_rows)]) \
+            if log_rows else np.zeros(0, dtype=np.int32)
+        meta = {
+            "names": self.names,
+            "codes": self.codes,
+            "log_codes": [log.codes.strings for log in self.logs],
+            "log_names": [log.names.strings for log in self.logs],
+            "log_bad_dates": [log.bad_dates.strings for log in self.logs],
+            "equity_dates": [d.strftime("%Y-%m-%d") for d in self.equity_dates],
+        }
+        np.savez_compressed(
+            path,
+            meta=np.array(json.dumps(meta)),
+            cash=self.cash,
+            initial_cash=self.initial_cash,
+            realized=self.realized,
+            positions=self.positions,
+            cost=self.cost,
+            equity=self.equity_matrix(),
+            trades=np.concatenate(log_rows) if log_rows else np.zeros(0, dtype=TRADE_DTYPE),
+            trade_owner=owner,
+            **{f"setting_{key}": self.setting(key) for key in SETTING_DEFAULTS}
+        )
+
+    @classmethod
+    def load(cls, path, data_manager):
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f["meta"]))
+            pool = cls(data_manager, codes=meta["codes"], capacity=len(meta["names"]))
+            for i, name in enumerate(meta["names"]):
+                # Files saved before a setting existed get its default
+                pool.add_account(name, float(f["initial_cash"][i]),
+                                 **{key: float(f[f"setting_{key}"][i]) for key in SETTING_DEFAULTS
+                                    if f"setting_{key}" in f.files})
+            pool.cash[:] = f["cash"]
+            pool.realized[:] = f["realized"]
+            pool.positions[:] = f["positions"]
+            pool.cost[:] = f["cost"]
+            trades = f["trades"]
+            owner = f["trade_owner"]
+            for i in range(len(pool.logs)):
+                pool.logs[i] = TradeStore.from_array(
+                    trades[owner == i], meta["log_codes"][i], meta["log_names"][i], meta["log_bad_dates"][i]
+                )
+            equity = f["equity"]
+            pool.equity_dates = [datetime.date.fromisoformat(d) for d in meta["equity_dates"]]
+            pool.equity_history = [row.copy() for row in equity]
+        return pool
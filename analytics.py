@@ -0,0 +1,377 @@
+"""Performance analytics on NumPy arrays.
+
+All functions take plain arrays (equity values, ordinal dates, trade columns)
+so they can be used by the GUI performance panel as well as by headless
+backtests working on large trade logs. ``RunningStats`` offers the same
+curve metrics in incremental form for callers that append one equity point
+at a time.
+"""
+from collections import deque
+
+import numpy as np
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def _as_float_array(values):
+    return np.asarray(values, dtype=float)
+
+
+def buy_mask(sides):
+    """Return a boolean mask of buy rows.
+
+    ``sides`` may hold 'Buy'/'Sell' strings or signed integers (+1 buy, -1 sell).
+    """
+    sides = np.asarray(sides)
+    if sides.dtype.kind in "USO":
+        return sides == "Buy"
+    return sides > 0
+
+
+def simple_returns(values):
+    """Period-over-period simple returns of an equity series."""
+    values = _as_float_array(values)
+    if len(values) < 2:
+        return np.empty(0, dtype=float)
+    return np.diff(values) / values[:-1]
+
+
+def sharpe_ratio(returns, periods_per_year=TRADING_DAYS_PER_YEAR, risk_free=0.0):
+    """Annualized Sharpe ratio (sample std, ddof=1)."""
+    returns = _as_float_array(returns) - risk_free / periods_per_year
+    if len(returns) < 2:
+        return 0.0
+    vol = returns.std(ddof=1)
+    if vol <= 1e-9:
+        return 0.0
+    return float(returns.mean() / vol * np.sqrt(periods_per_year))
+
+
+def sortino_ratio(returns, periods_per_year=TRADING_DAYS_PER_YEAR, risk_free=0.0):
+    """Annualized Sortino ratio using downside deviation below ``risk_free``."""
+    returns = _as_float_array(returns) - risk_free / periods_per_year
+    if len(returns) < 2:
+        return 0.0
+    downside = np.minimum(returns, 0.0)
+    downside_dev = np.sqrt(np.mean(downside * downside))
+    if downside_dev <= 1e-9:
+        return 0.0
+    return float(returns.mean() / downside_dev * np.sqrt(periods_per_year))
+
+
+def drawdown_series(values):
+    """Fractional drawdown from the running peak at each point."""
+    values = _as_float_array(values)
+    if len(values) == 0:
+        return values
+    cum_max = np.maximum.accumulate(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dd = np.where(cum_max > 0, (cum_max - values) / cum_max, 0.0)
+    return dd
+
+
+def max_drawdown(values):
+    dd = drawdown_series(values)
+    return float(dd.max()) if len(dd) else 0.0
+
+
+def drawdown_durations(values, dates=None):
+    """Return (longest, current) time spent below the running peak.
+
+    Durations are measured in ``dates`` units (e.g. ordinal days) when given,
+    otherwise in number of periods.
+    """
+    values = _as_float_array(values)
+    n = len(values)
+    if n == 0:
+        return 0, 0
+    axis = np.arange(n) if dates is None else np.asarray(dates)
+    cum_max = np.maximum.accumulate(values)
+    at_peak = values >= cum_max
+    peak_idx = np.maximum.accumulate(np.where(at_peak, np.arange(n), 0))
+    durations = axis - axis[peak_idx]
+    return int(durations.max()), int(durations[-1])
+
+
+def cagr(values, span_days):
+    """Compound annual growth rate over ``span_days`` calendar days."""
+    values = _as_float_array(values)
+    if len(values) == 0 or values[0] <= 0:
+        return 0.0
+    span_days = max(1, span_days or 1)
+    return float((values[-1] / values[0]) ** (365 / span_days) - 1)
+
+
+def calmar_ratio(annual_return, max_dd):
+    """CAGR divided by maximum drawdown (0 when there is no drawdown)."""
+    if max_dd <= 1e-12:
+        return 0.0
+    return float(annual_return / max_dd)
+
+
+def rolling_mean_std(returns, window):
+    """Rolling mean and sample std over ``window`` points using cumulative sums.
+
+    The first ``window - 1`` entries are NaN.
+    """
+    returns = _as_float_array(returns)
+    n = len(returns)
+    mean = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    if window < 2 or n < window:
+        return mean, std
+    # Center on the overall mean to keep the sum-of-squares numerically stable
+    shift = returns.mean()
+    x = returns - shift
+    c1 = np.concatenate(([0.0], np.cumsum(x)))
+    c2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    s1 = c1[window:] - c1[:-window]
+    s2 = c2[window:] - c2[:-window]
+    m = s1 / window
+    var = np.maximum((s2 - window * m * m) / (window - 1), 0.0)
+    mean[window - 1:] = m + shift
+    std[window - 1:] = np.sqrt(var)
+    return mean, std
+
+
+def rolling_volatility(returns, window, periods_per_year=TRADING_DAYS_PER_YEAR):
+    """Annualized rolling volatility."""
+    _, std = rolling_mean_std(returns, window)
+    return std * np.sqrt(periods_per_year)
+
+
+def rolling_sharpe(returns, window, periods_per_year=TRADING_DAYS_PER_YEAR):
+    """Annualized rolling Sharpe ratio (NaN where volatility is ~0)."""
+    mean, std = rolling_mean_std(returns, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(std > 1e-9, mean / std * np.sqrt(periods_per_year), np.nan)
+    return out
+
+
+def turnover(trade_amounts, equity):
+    """Total traded notional divided by average equity."""
+    trade_amounts = _as_float_array(trade_amounts)
+    equity = _as_float_array(equity)
+    if len(equity) == 0:
+        return 0.0
+    avg_equity = equity.mean()
+    if avg_equity <= 0:
+        return 0.0
+    return float(np.abs(trade_amounts).sum() / avg_equity)
+
+
+def exposure(market_values, equity):
+    """Fraction of equity invested at each point."""
+    market_values = _as_float_array(market_values)
+    equity = _as_float_array(equity)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(equity > 0, market_values / equity, 0.0)
+
+
+def realized_pnl(codes, sides, shares, prices, method="average"):
+    """Realized P&L per trade row.
+
+    method: 'average' (average cost) or 'fifo' (first-in-first-out lots).
+
+    Returns (pnl, closed): ``pnl`` is 0 on buy rows; ``closed`` marks sell rows
+    that were matched against an open position. Rows are processed in the
+    order given.
+    """
+    if method not in ("average", "fifo"):
+        raise ValueError(f"Unknown cost method: {method}")
+    codes = np.asarray(codes)
+    n = len(codes)
+    pnl = np.zeros(n, dtype=float)
+    closed = np.zeros(n, dtype=bool)
+    if n == 0:
+        return pnl, closed
+    _, code_ids = np.unique(codes, return_inverse=True)
+    n_codes = int(code_ids.max()) + 1
+    ids = code_ids.tolist()
+    buys = buy_mask(sides).tolist()
+    qty = np.asarray(shares, dtype=float).tolist()
+    px = np.asarray(prices, dtype=float).tolist()
+
+    if method == "average":
+        held = [0.0] * n_codes
+        avg = [0.0] * n_codes
+        for i in range(n):
+            c = ids[i]
+            q = qty[i]
+            if buys[i]:
+                new_held = held[c] + q
+                avg[c] = (avg[c] * held[c] + q * px[i]) / new_held if new_held > 0 else 0.0
+                held[c] = new_held
+            else:
+                if held[c] <= 0:
+                    continue
+                pnl[i] = (px[i] - avg[c]) * q
+                closed[i] = True
+                held[c] -= q
+                if held[c] <= 0:
+                    held[c] = 0.0
+                    avg[c] = 0.0
+        return pnl, closed
+
+    lots = [deque() for _ in range(n_codes)]
+    for i in range(n):
+        c = ids[i]
+        if buys[i]:
+            lots[c].append([qty[i], px[i]])
+            continue
+        book = lots[c]
+        if not book:
+            continue
+        remaining = qty[i]
+        realized = 0.0
+        while remaining > 0 and book:
+            lot = book[0]
+            take = lot[0] if lot[0] <= remaining else remaining
+            realized += (px[i] - lot[1]) * take
+            lot[0] -= take
+            remaining -= take
+            if lot[0] <= 0:
+                book.popleft()
+        pnl[i] = realized
+        closed[i] = True
+    return pnl, closed
+
+
+def trade_stats(pnl, closed):
+    """Win rate (%) and profit factor over closed trades."""
+    realized = _as_float_array(pnl)[np.asarray(closed, dtype=bool)]
+    if len(realized) == 0:
+        return {"win_rate": 0.0, "profit_factor": 0.0, "closed_trades": 0}
+    wins = realized >= 0
+    profit_sum = realized[wins].sum()
+    loss_sum = realized[~wins].sum()
+    win_rate = wins.mean() * 100
+    if loss_sum < 0:
+        profit_factor = profit_sum / abs(loss_sum)
+    else:
+        profit_factor = profit_sum if profit_sum > 0 else 0.0
+    return {
+        "win_rate": float(win_rate),
+        "profit_factor": float(profit_factor),
+        "closed_trades": int(len(realized))
+    }
+
+
+def performance_summary(dates, values, periods_per_year=TRADING_DAYS_PER_YEAR):
+    """Curve metrics for an equity series.
+
+    dates: ordinal days (``date.toordinal()``), sorted ascending.
+    values: equity at each date.
+    """
+    dates = np.asarray(dates)
+    values = _as_float_array(values)
+    if len(values) == 0:
+        return {}
+
+    total_return = values[-1] / values[0] - 1 if values[0] != 0 else 0.0
+    if len(values) > 1 and np.all(values[:-1] > 0):
+        rets = simple_returns(values)
+        sharpe = sharpe_ratio(rets, periods_per_year)
+        sortino = sortino_ratio(rets, periods_per_year)
+        volatility = float(rets.std(ddof=1) * np.sqrt(periods_per_year)) if len(rets) > 1 else 0.0
+    else:
+        sharpe = sortino = volatility = 0.0
+
+    max_dd = max_drawdown(values)
+    longest_dd, current_dd = drawdown_durations(values, dates)
+    growth = cagr(values, int(dates[-1] - dates[0]))
+    return {
+        "total_return": float(total_return),
+        "cagr": growth,
+        "sharpe": sharpe,
+        "sortino": sortino,
+        "calmar": calmar_ratio(growth, max_dd),
+        "volatility": volatility,
+        "max_dd": max_dd,
+        "max_dd_duration": longest_dd,
+        "current_dd_duration": current_dd
+    }
+
+
+class RunningStats:
+    """Incremental equity-curve statistics, O(1) per appended point.
+
+    Mirrors the curve part of ``performance_summary`` for streaming use
+    (e.g. a backtest loop that does not keep the whole equity history).
+    """
+
+    def __init__(self, periods_per_year=TRADING_DAYS_PER_YEAR):
+        self.periods_per_year = periods_per_year
+        self.count = 0
+        self.first_value = None
+        self.first_date = None
+        self.last_value = None
+        self.last_date = None
+        # Welford accumulators over returns
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._downside_sq = 0.0
+        self._all_positive = True
+        self.peak = None
+        self.peak_date = None
+        self.max_dd = 0.0
+        self.max_dd_duration = 0
+
+    def update(self, date, value):
+        """Append one (ordinal date, equity) point."""
+        value = float(value)
+        if self.count == 0:
+            self.first_value = value
+            self.first_date = date
+            self.peak = value
+            self.peak_date = date
+        else:
+            prev = self.last_value
+            if prev > 0:
+                r = value / prev - 1
+                self._n += 1
+                delta = r - self._mean
+                self._mean += delta / self._n
+                self._m2 += delta * (r - self._mean)
+                if r < 0:
+                    self._downside_sq += r * r
+            else:
+                self._all_positive = False
+        if value >= self.peak:
+            self.peak = value
+            self.peak_date = date
+        elif self.peak > 0:
+            self.max_dd = max(self.max_dd, (self.peak - value) / self.peak)
+        self.max_dd_duration = max(self.max_dd_duration, int(date - self.peak_date))
+        self.count += 1
+        self.last_value = value
+        self.last_date = date
+
+    def summary(self):
+        if self.count == 0:
+            return {}
+        first, last = self.first_value, self.last_value
+        total_return = last / first - 1 if first != 0 else 0.0
+        scale = np.sqrt(self.periods_per_year)
+        sharpe = sortino = volatility = 0.0
+        if self._all_positive and self._n > 1:
+            std = np.sqrt(self._m2 / (self._n - 1))
+            volatility = float(std * scale)
+            if std > 1e-9:
+                sharpe = float(self._mean / std * scale)
+            downside_dev = np.sqrt(self._downside_sq / self._n)
+            if downside_dev > 1e-9:
+                sortino = float(self._mean / downside_dev * scale)
+        growth = cagr([first, last], int(self.last_date - self.first_date))
+        return {
+            "total_return": float(total_return),
+            "cagr": growth,
+            "sharpe": sharpe,
+            "sortino": sortino,
+            "calmar": calmar_ratio(growth, self.max_dd),
+            "volatility": volatility,
+            "max_dd": self.max_dd,
+            "max_dd_duration": self.max_dd_duration,
+            "current_dd_duration": int(self.last_date - self.peak_date)
+        }
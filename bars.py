@@ -0,0 +1,149 @@
+"""Compact per-stock cache of real daily OHLCV bars.
+
+Bars come from akshare's full-history fetch or a bulk import
+(price_import.py). Each stock's bars are one NumPy structured array sorted
+by date: an int32 date ordinal, float64 open/high/low/close and an int64
+volume, 44 bytes per bar. Point and window lookups use ``np.searchsorted``.
+
+The arrays are persisted in binary form: concatenated into one ``.npz``
+file next to the JSON price file (with a code/offset index), or as one BLOB
+row per code in the SQLite store's ``bars`` table, where only the codes that
+changed are rewritten.
+"""
+import datetime
+import os
+import threading
+
+import numpy as np
+
+BAR_DTYPE = np.dtype([
+    ("date", "<i4"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<i8"),
+])
+_EMPTY = np.empty(0, dtype=BAR_DTYPE)
+
+
+def bars_from_frame(frame):
+    """Structured bar array from a DataFrame with date/open/high/low/close[/volume] columns."""
+    import pandas as pd
+    dates = pd.to_datetime(frame["date"])
+    close = frame["close"].to_numpy(dtype=float)
+    bars = np.empty(len(frame), dtype=BAR_DTYPE)
+    # datetime64[D] counts days from 1970-01-01; shift to date.toordinal()
+    bars["date"] = dates.to_numpy(dtype="datetime64[D]").astype(np.int64) + datetime.date(1970, 1, 1).toordinal()
+    for col in ("open", "high", "low"):
+        bars[col] = frame[col].to_numpy(dtype=float) if col in frame else close
+    bars["close"] = close
+    bars["volume"] = frame["volume"].to_numpy(dtype=np.int64) if "volume" in frame else 0
+    return merge_bars(bars, _EMPTY)
+
+
+def merge_bars(new, old):
+    """Union of two bar arrays sorted by date; ``new`` wins on equal dates."""
+    combined = np.concatenate([new, old]) if len(old) else new
+    # np.unique keeps the first occurrence of each date, i.e. the one from ``new``
+    _, idx = np.unique(combined["date"], return_index=True)
+    return combined[idx]
+
+
+def bar_dict(row):
+    return {
+        "date": datetime.date.fromordinal(int(row["date"])).strftime("%Y-%m-%d"),
+        "open": float(row["open"]),
+        "high": float(row["high"]),
+        "low": float(row["low"]),
+        "close": float(row["close"]),
+        "volume": int(row["volume"]),
+    }
+
+
+class BarCache:
+    """{code: bar array}, loaded lazily from an npz file or a SQLiteStore."""
+
+    def __init__(self, path=None, store=None):
+        self.path = path
+        self.store = store
+        self._bars = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _all(self):
+        if self._bars is None:
+            with self._lock:
+                if self._bars is None:
+                    self._bars = self._load()
+        return self._bars
+
+    def _load(self):
+        if self.store is not None or not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with np.load(self.path, allow_pickle=False) as npz:
+                codes, offsets, bars = npz["codes"], npz["offsets"], npz["bars"]
+            return {str(code): bars[offsets[i]:offsets[i + 1]] for i, code in enumerate(codes)}
+        except Exception as e:
+            print(f"Failed to load bar cache {self.path}: {e}")
+            return {}
+
+    def get(self, code):
+        """All cached bars of ``code`` (empty array if none)."""
+        bars = self._all()
+        cached = bars.get(code)
+        if cached is None and self.store is not None:
+            blob = self.store.load_bars(code)
+            cached = np.frombuffer(blob, dtype=BAR_DTYPE) if blob else _EMPTY
+            bars[code] = cached
+        return cached if cached is not None else _EMPTY
+
+    def codes(self):
+        """Codes with cached bars."""
+        if self.store is not None:
+            return self.store.bar_codes()
+        return [code for code, bars in self._all().items() if len(bars)]
+
+    def has(self, code):
+        return len(self.get(code)) > 0
+
+    def put(self, code, bars):
+        """Merge ``bars`` into the cached bars of ``code``."""
+        merged = merge_bars(bars, self.get(code))
+        with self._lock:
+            self._all()[code] = merged
+            self._dirty.add(code)
+
+    def lookup(self, code, ordinals):
+        """(found, rows): which of ``ordinals`` have a bar, and the bar rows (valid where found)."""
+        bars = self.get(code)
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if not len(bars):
+            return np.zeros(len(ordinals), dtype=bool), np.empty(len(ordinals), dtype=BAR_DTYPE)
+        idx = np.minimum(np.searchsorted(bars["date"], ordinals), len(bars) - 1)
+        rows = bars[idx]
+        return rows["date"] == ordinals, rows
+
+    def bar(self, code, date):
+        """The bar of ``code`` on ``date`` as a dict, or None."""
+        found, rows = self.lookup(code, [date.toordinal()])
+        return bar_dict(rows[0]) if found[0] else None
+
+    def save(self):
+        """Persist codes changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            bars = dict(self._bars)
+        try:
+            if self.store is not None:
+                self.store.put_bars([(code, bars[code].tobytes()) for code in sorted(dirty)])
+            else:
+                codes = sorted(bars)
+                offsets = np.cumsum([0] + [len(bars[c]) for c in codes])
+                all_bars = np.concatenate([bars[c] for c in codes]) if codes else _EMPTY
+                np.savez(self.path, codes=np.array(codes, dtype=str), offsets=offsets, bars=all_bars)
+        except Exception as e:
+            print(f"Failed to save bar cache: {e}")
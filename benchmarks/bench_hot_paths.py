@@ -0,0 +1,469 @@
+"""Benchmarks for the simulator's data, accounting and rendering hot paths.
+
+Runs headless: Tk widgets are never created, UI refresh methods on the
+simulator are replaced with no-ops and the K-line chart renders to a
+matplotlib Agg canvas. All files are written to a temporary directory.
+
+Usage:
+    python benchmarks/bench_hot_paths.py                  # full size
+    python benchmarks/bench_hot_paths.py --scale 0.1      # quick run
+    python benchmarks/bench_hot_paths.py --only equity    # name filter
+    python benchmarks/bench_hot_paths.py --compare benchmarks/results/abc1234.json
+
+Full-size fixtures: 500 tickers x 5 years of daily prices, 100k trades and
+10k pending orders. Results are written as JSON (one file per commit by
+default) so runs can be compared across commits.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mock  # noqa: E402
+import analytics  # noqa: E402
+from trade_store import TradeStore  # noqa: E402
+from oplog import OperationLog  # noqa: E402
+
+START_DATE = datetime.date(2019, 1, 2)
+
+
+# ----------------------- Fixtures -----------------------
+def make_universe(n_tickers):
+    return {f"T{i:04d}": f"Ticker {i}" for i in range(n_tickers)}
+
+
+def make_business_days(n_days, start=START_DATE):
+    days = []
+    d = start
+    while len(days) < n_days:
+        if d.weekday() < 5:
+            days.append(d)
+        d += datetime.timedelta(days=1)
+    return days
+
+
+def make_price_panel(codes, days, seed=7):
+    """Random-walk closes in the stock_data.json layout {date: {code: {...}}}."""
+    rng = np.random.default_rng(seed)
+    rets = rng.normal(0.0003, 0.02, size=(len(days), len(codes)))
+    prices = np.round(100 * np.exp(np.cumsum(rets, axis=0)), 2)
+    change = np.round(rets * 100, 2)
+    data = {}
+    for i, d in enumerate(days):
+        row_p = prices[i].tolist()
+        row_c = change[i].tolist()
+        data[d.strftime("%Y-%m-%d")] = {
+            code: {"price": row_p[j], "change_percent": row_c[j]} for j, code in enumerate(codes)
+        }
+    return data
+
+
+def make_trade_records(codes, days, n_trades, seed=11):
+    """Buy/sell records that never sell more than is held."""
+    rng = np.random.default_rng(seed)
+    day_idx = np.sort(rng.integers(0, len(days), n_trades))
+    code_idx = rng.integers(0, len(codes), n_trades)
+    shares = rng.integers(1, 50, n_trades) * 10
+    prices = np.round(rng.uniform(20, 400, n_trades), 2)
+    held = {}
+    records = []
+    for i in range(n_trades):
+        code = codes[code_idx[i]]
+        qty = int(shares[i])
+        side = "Buy"
+        if held.get(code, 0) >= qty and i % 2:
+            side = "Sell"
+        held[code] = held.get(code, 0) + (qty if side == "Buy" else -qty)
+        price = float(prices[i])
+        records.append({
+            "date": days[day_idx[i]].strftime("%Y-%m-%d"),
+            "stock_code": code,
+            "stock_name": code,
+            "trade_type": side,
+            "shares": qty,
+            "price": price,
+            "total_amount": round(price * qty, 2)
+        })
+    return records, held
+
+
+def make_pending_orders(codes, stocks, n_orders, trigger_fraction=0.01, seed=13):
+    """Limit buy orders; roughly ``trigger_fraction`` of them are marketable."""
+    rng = np.random.default_rng(seed)
+    orders = []
+    for i in range(n_orders):
+        code = codes[int(rng.integers(0, len(codes)))]
+        px = stocks[code]["price"]
+        marketable = rng.random() < trigger_fraction
+        orders.append({
+            "id": str(i),
+            "code": code,
+            "name": code,
+            "side": "Buy",
+            "type": "limit",
+            "price": round(px * (1.01 if marketable else 0.5), 2),
+            "shares": 10,
+            "status": "open",
+            "created_at": "2024-01-01 00:00:00"
+        })
+    return orders
+
+
+def make_headless_simulator(data_manager, trade_manager, current_date):
+    """StockTradeSimulator without Tk: only the non-widget state is set up."""
+    sim = mock.StockTradeSimulator.__new__(mock.StockTradeSimulator)
+    sim.data_manager = data_manager
+    sim.trade_manager = trade_manager
+    sim.use_mock_data = data_manager.use_mock_data
+    sim.cash = trade_manager.get_cash()
+    sim.portfolio = trade_manager.get_portfolio()
+    sim.pending_orders = trade_manager.get_pending_orders()
+    sim.current_date = current_date
+    sim.stocks = {}
+    sim.custom_strategies = []
+    sim.accent_color = "#2563EB"
+    sim.screener = None
+    sim.oplog = OperationLog()
+    for name in ("update_assets", "load_trade_records", "update_portfolio_table", "refresh_pending_orders_table",
+                 "_update_history_buttons"):
+        setattr(sim, name, lambda *a, **k: None)
+    return sim
+
+
+def attach_agg_chart(sim):
+    """Give the simulator an off-screen K-line figure (returns False without matplotlib)."""
+    try:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+    except Exception:
+        return False
+    fig = Figure(figsize=(6, 4), dpi=100)
+    gs = fig.add_gridspec(4, 1, hspace=0.05)
+    sim.kline_figure = fig
+    sim.kline_ax = fig.add_subplot(gs[:3, 0])
+    sim.volume_ax = fig.add_subplot(gs[3, 0], sharex=sim.kline_ax)
+    sim.kline_canvas = FigureCanvasAgg(fig)
+    return True
+
+
+# ----------------------- Harness -----------------------
+class Runner:
+    def __init__(self, only=None, rounds=5):
+        self.only = only
+        self.rounds = rounds
+        self.results = {}
+
+    def bench(self, name, func, setup=None, rounds=None, warmup=1):
+        """Time ``func(state)`` where ``state = setup()`` is rebuilt before every round."""
+        if self.only and not any(pat in name for pat in self.only):
+            return
+        rounds = rounds or self.rounds
+        times = []
+        for i in range(warmup + rounds):
+            state = setup() if setup else None
+            start = time.perf_counter()
+            func(state)
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                times.append(elapsed)
+        self.results[name] = {
+            "rounds": rounds,
+            "min_s": min(times),
+            "median_s": statistics.median(times),
+            "mean_s": statistics.fmean(times),
+            "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0
+        }
+        print(f"{name:<40}{self.results[name]['median_s'] * 1e3:>12.2f} ms (min {min(times) * 1e3:.2f})")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparison against {baseline.get('commit', '?')} (median, ratio < 1 is faster):")
+    for name, res in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            print(f"{name:<40}{'new':>12}")
+            continue
+        ratio = res["median_s"] / old["median_s"] if old["median_s"] > 0 else float("inf")
+        print(f"{name:<40}{old['median_s'] * 1e3:>12.2f} -> {res['median_s'] * 1e3:>10.2f} ms  x{ratio:.2f}")
+
+
+# ----------------------- Benchmarks -----------------------
+def run_all(runner, scale, workdir):
+    n_tickers = max(10, int(500 * scale))
+    n_days = max(60, int(5 * 252 * scale))
+    n_trades = max(1000, int(100_000 * scale))
+    n_orders = max(100, int(10_000 * scale))
+
+    codes = list(make_universe(n_tickers))
+    days = make_business_days(n_days)
+    panel = make_price_panel(codes, days)
+    records, held = make_trade_records(codes, days, n_trades)
+    last_date = days[-1]
+    last_prices = panel[last_date.strftime("%Y-%m-%d")]
+
+    price_file = os.path.join(workdir, "stock_data.json")
+    trade_file = os.path.join(workdir, "trade_data.json")
+
+    dm = mock.StockDataManager(data_file=price_file, use_mock_data=True, storage="json")
+    dm.stock_list = make_universe(n_tickers)
+    dm.data = panel
+
+    # Cold start: module import in a fresh interpreter, and data manager
+    # construction against a full price file (parsed lazily on first access)
+    import_cmd = [sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); import mock", ROOT]
+    runner.bench("startup.python_baseline", lambda _: subprocess.run([sys.executable, "-c", "pass"], check=True))
+    runner.bench("startup.import_mock", lambda _: subprocess.run(import_cmd, check=True))
+    dm._save_data()
+    runner.bench(
+        "startup.data_manager_init",
+        lambda _: mock.StockDataManager(data_file=price_file, use_mock_data=True)
+    )
+    runner.bench(
+        "startup.data_manager_first_access",
+        lambda m: m.data,
+        setup=lambda: mock.StockDataManager(data_file=price_file, use_mock_data=True),
+        rounds=3
+    )
+
+    # JSON persistence
+    runner.bench("persist.stock_data_save", lambda _: dm._save_data(), rounds=3)
+    runner.bench("persist.stock_data_load", lambda _: dm._load_data(), rounds=3)
+
+    def trade_manager_with_records():
+        tm = mock.TradeManager(initial_cash=1e9, data_file=trade_file)
+        tm.trade_records = TradeStore.from_records(records)
+        tm.portfolio = {c: {"shares": s, "total_cost": s * 100.0} for c, s in held.items() if s > 0}
+        tm.pending_orders = make_pending_orders(codes, last_prices, n_orders)
+        return tm
+
+    tm = trade_manager_with_records()
+    runner.bench("persist.trade_data_save", lambda _: tm.save_data(), rounds=3)
+    runner.bench("persist.trade_data_load", lambda _: tm.load_data(), rounds=3)
+
+    # Appending one trade: full JSON rewrite vs one SQLite row
+    def append_trade(manager):
+        manager.add_trade_record(last_date.strftime("%Y-%m-%d"), codes[0], codes[0], "Buy", 1, 100.0, 100.0)
+
+    runner.bench("persist.trade_append_json", lambda _: append_trade(tm), rounds=3)
+    from storage import SQLiteStore
+    store = SQLiteStore(os.path.join(workdir, "bench.db"))
+    stm = mock.TradeManager(initial_cash=1e9, data_file=trade_file, storage=store)
+    runner.bench("persist.trade_append_sqlite", lambda _: append_trade(stm))
+    sdm = mock.StockDataManager(data_file=price_file, use_mock_data=True, storage=store)
+    probe = iter(range(10 ** 6))
+    runner.bench(
+        "persist.price_insert_sqlite",
+        lambda _: sdm._cache_stock_data(f"2100-01-{next(probe) % 28 + 1:02d}", f"Z{next(probe)}",
+                                        {"price": 1.0, "change_percent": 0.0})
+    )
+    runner.bench("persist.price_day_read_sqlite", lambda _: sdm.get_cached_day(days[-1].strftime("%Y-%m-%d")))
+
+    # Mock generation (uncached, no persistence)
+    gen_days = days[:20]
+
+    def generate(_):
+        for d in gen_days:
+            for code in codes:
+                dm._generate_mock_stock_data(code, d)
+    runner.bench("mock.generate_day_universe_x20", generate, rounds=3)
+
+    # Correlated path simulation of the whole universe (market_sim.py)
+    from market_sim import MarketSimulator
+    sim_end = days[-1]
+    runner.bench(
+        "mock.gbm_panel",
+        lambda _: MarketSimulator(codes, dm.calendar, model="gbm", start=days[0], end=sim_end),
+        rounds=3
+    )
+    runner.bench(
+        "mock.garch_panel",
+        lambda _: MarketSimulator(codes, dm.calendar, model="garch", start=days[0], end=sim_end),
+        rounds=3
+    )
+
+    # History windows from a warm cache (fill weekend days in the window so no
+    # lookup falls through to generation + a full JSON rewrite)
+    hist_codes = codes[:50]
+    end = datetime.datetime.combine(last_date, datetime.time())
+    for i in range(1, 61):
+        d = last_date - datetime.timedelta(days=i)
+        day = panel.setdefault(d.strftime("%Y-%m-%d"), {})
+        for code in hist_codes:
+            day.setdefault(code, {"price": 100.0, "change_percent": 0.0})
+
+    def histories(_):
+        for code in hist_codes:
+            dm.get_stock_history(code, end, window_days=60)
+    runner.bench("history.get_stock_history_x50", histories)
+
+    # Cross-sectional screens over the whole universe (screener.py); panel rows are warmed once
+    from screener import Screener
+    screener = Screener(dm)
+    screener.screen("ret_20 > 0", end)
+    runner.bench(
+        "screener.screen_warm",
+        lambda _: screener.screen("from_high_60 > -2 and ret_20 > 0", end, rank_by="ret_20")
+    )
+
+    # Equity replay and stats
+    sim = make_headless_simulator(dm, tm, last_date)
+    sim.stocks = {c: {"name": c, "price": last_prices[c]["price"], "change_percent": 0.0} for c in codes}
+    runner.bench("equity.build_curve", lambda _: sim._build_equity_curve(include_current=True))
+    curve = sim._build_equity_curve(include_current=True)
+    runner.bench("equity.performance_stats", lambda _: sim._compute_performance_stats(curve))
+
+    # Portfolio as of a past date from the nearest checkpoint (checkpoints.py)
+    from checkpoints import CheckpointIndex
+    index = CheckpointIndex(tm)
+    runner.bench("equity.checkpoint_build", lambda _: CheckpointIndex(tm).sync(), rounds=3)
+    index.sync()
+    mid_date = days[len(days) // 2]
+    runner.bench("equity.state_as_of_date", lambda _: index.state_at(mid_date))
+
+    # Whole-session replay under 8 cost variants at once (oplog.py)
+    from oplog import replay
+    session = [{"type": "session", "cash": 1e9, "initial_cash": 1e9, "portfolio": {}}] + [
+        {"type": "fill", "date": r["date"], "code": r["stock_code"], "name": r["stock_name"],
+         "side": r["trade_type"], "shares": r["shares"], "quote": r["price"]}
+        for r in records
+    ]
+    variants = [{"fee_rate": f, "slippage_per_share": s} for f in (0.0001, 0.0005, 0.001, 0.003) for s in (0.0, 0.02)]
+    runner.bench("oplog.replay_8_variants", lambda _: replay(session, variants), rounds=3)
+
+    # Tiered commission + spread + square-root impact for 1M fills in one call (costs.py)
+    from costs import CostModel
+    rng = np.random.default_rng(5)
+    fill_px = rng.uniform(5, 500, 1_000_000)
+    fill_qty = rng.integers(1, 10_000, 1_000_000)
+    fill_side = rng.choice([1, -1], 1_000_000)
+    fill_vol = rng.uniform(1e5, 1e7, 1_000_000)
+    cost_model = CostModel(commission_tiers=[(0, 0.0005), (10_000, 0.0003), (100_000, 0.0001)],
+                           spread_bps=5.0, impact_coef=0.5)
+    runner.bench("costs.price_1m_fills", lambda _: cost_model.price(fill_px, fill_qty, fill_side, fill_vol), rounds=3)
+
+    cols = (
+        [r["stock_code"] for r in records],
+        [r["trade_type"] for r in records],
+        np.array([r["shares"] for r in records], dtype=float),
+        np.array([r["price"] for r in records], dtype=float),
+    )
+    runner.bench("analytics.realized_pnl_fifo", lambda _: analytics.realized_pnl(*cols, method="fifo"))
+
+    # Auto-trading rules over a 1000-ticker universe with every code held
+    import strategies
+    rng = np.random.default_rng(17)
+    n_rule = max(1000, n_tickers)
+    rule_ctx = strategies.StrategyContext(
+        last_date, [f"R{i:04d}" for i in range(n_rule)],
+        rng.uniform(10, 500, n_rule), rng.integers(1, 1000, n_rule), rng.uniform(5_000, 400_000, n_rule)
+    )
+    engine = strategies.default_engine(10.0, 5.0, 20.0)
+    runner.bench("rules.evaluate_1000", lambda _: engine.evaluate(rule_ctx))
+
+    # Order matching: fresh account, ~1% of resting orders marketable
+    original_showinfo = mock.messagebox.showinfo
+    mock.messagebox.showinfo = lambda *a, **k: None
+    try:
+        def order_setup():
+            if os.path.exists(trade_file):
+                os.remove(trade_file)
+            otm = mock.TradeManager(initial_cash=1e9, data_file=trade_file)
+            otm.pending_orders = make_pending_orders(codes, last_prices, n_orders)
+            osim = make_headless_simulator(dm, otm, last_date)
+            osim.stocks = sim.stocks
+            return osim
+        runner.bench("orders.process_pending", lambda s: s.process_pending_orders(), setup=order_setup, rounds=3)
+    finally:
+        mock.messagebox.showinfo = original_showinfo
+
+    # Volume-capped matching of 100k resting orders (order_matching.py), without booking the fills
+    from order_matching import OrderBook, daily_capacity
+    resting = make_pending_orders(codes, last_prices, 100_000, trigger_fraction=0.2)
+    resting_quotes = np.array([last_prices[c]["price"] for c in codes])
+
+    def match_capped(_):
+        book = OrderBook(resting)
+        hit = book.triggered(resting_quotes[[codes.index(c) for c in book.codes]])
+        return book.allocate(hit, daily_capacity(np.full(len(book.codes), 1_000.0), 0.1))
+    runner.bench("orders.match_volume_capped_100k", match_capped, rounds=3)
+
+    # As-of adjustment factors of the whole (days x tickers) panel: a split and quarterly dividends per ticker
+    from corporate_actions import CorporateActions, dividend_action, split_action
+    actions = CorporateActions()
+    for i, code in enumerate(codes):
+        actions.add(split_action(code, days[(i * 7) % len(days)], 2))
+        for day in days[i % 63::63]:
+            actions.add(dividend_action(code, day, 0.25, 50.0))
+    runner.bench("actions.adjust_panel", lambda _: actions.panel(codes, days, as_of=last_date), rounds=3)
+
+    # Chart rendering
+    if mock.MATPLOTLIB_AVAILABLE and attach_agg_chart(sim):
+        runner.bench("chart.update_kline", lambda _: sim.update_kline_chart(codes[0]))
+
+    return {
+        "n_tickers": n_tickers,
+        "n_days": n_days,
+        "n_trades": n_trades,
+        "n_orders": n_orders
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="fixture size multiplier (1.0 = full size)")
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds for light benchmarks")
+    parser.add_argument("--only", nargs="*", help="run benchmarks whose name contains any of these")
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="baseline result JSON to compare against")
+    args = parser.parse_args(argv)
+
+    runner = Runner(only=args.only, rounds=args.rounds)
+    with tempfile.TemporaryDirectory() as workdir:
+        params = run_all(runner, args.scale, workdir)
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "params": params,
+        "results": runner.results
+    }
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
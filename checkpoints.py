@@ -0,0 +1,217 @@
+"""Checkpoint index for "portfolio as of a past date" queries.
+
+Rebuilding cash and positions for a past date used to mean replaying the
+trade log from ``initial_cash``. ``CheckpointIndex`` keeps the trades in
+date order (insertion order within a day, as in the equity curve) and
+snapshots the ledger and cash every ``every_trades`` trades (and, optionally,
+whenever ``every_days`` calendar days have passed). A query finds the
+nearest checkpoint with ``bisect`` and replays at most the trades after it.
+
+The index follows the TradeManager's trade log incrementally:
+
+* appended trades extend the index; the newest state is kept ready
+  ("tip"), so checkpoints cost nothing extra while trading forward;
+* a trade dated before existing ones, or trades removed with
+  ``TradeStore.truncate``/``clear`` (undo, reset), only drop the checkpoints
+  after the affected position;
+* a different trade log, starting cash or cost basis method rebuilds the index.
+
+Stock splits applied to the account (``TradeManager.splits``) are entries of
+the index too, dated on their ex-date and placed after the trades logged
+before them, so positions before and after a split are in the right units.
+
+Cash follows the trade log like the equity curve: ``initial_cash`` minus
+buy amounts plus sell amounts (fees are not part of the log), plus the cash
+paid for fractional shares at splits.
+"""
+import bisect
+import datetime
+import threading
+
+from ledger import PositionLedger
+
+# Trades with an unparseable date sort after every real date
+UNDATED = datetime.date.max.toordinal()
+
+
+def _ordinal(date):
+    if isinstance(date, str):
+        date = datetime.datetime.strptime(date, "%Y-%m-%d")
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return date.toordinal()
+
+
+class PortfolioState:
+    """Cash and ledger after the first ``trades`` trades in date order."""
+
+    def __init__(self, as_of, trades, cash, ledger):
+        self.as_of = as_of
+        self.trades = trades
+        self.cash = cash
+        self.ledger = ledger
+
+    @property
+    def portfolio(self):
+        """{code: {'shares', 'total_cost'}} like TradeManager.portfolio."""
+        return self.ledger.to_portfolio()
+
+    def market_value(self, prices):
+        """Value of the positions at ``prices`` ({code: price}); unpriced codes count at cost."""
+        return sum(pos.shares * prices[code] if code in prices else pos.cost
+                   for code, pos in self.ledger.positions.items())
+
+    def equity(self, prices):
+        return self.cash + self.market_value(prices)
+
+
+class CheckpointIndex:
+    def __init__(self, trade_manager, every_trades=64, every_days=None):
+        self.trade_manager = trade_manager
+        self.every_trades = max(1, int(every_trades))
+        self.every_days = every_days
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        tm = self.trade_manager
+        self._store = tm.trade_records
+        self._initial_cash = float(tm.initial_cash)
+        self._method = tm.cost_basis_method
+        self._seen = 0                              # trades of the log indexed so far
+        self._cuts_seen = len(self._store.truncations)
+        self._splits = tm.splits
+        self._splits_seen = 0
+        self._dates = []                            # trade dates (ordinals) in sorted order
+        self._order = []                            # trade log index at each sorted position (-1 - k: split k)
+        self._cp_pos = [0]                          # sorted positions with a checkpoint
+        self._cp_state = [(self._initial_cash, PositionLedger(self._method))]
+        self._tip = (0, self._initial_cash, PositionLedger(self._method))
+
+    def __len__(self):
+        """Number of checkpoints."""
+        return len(self._cp_pos)
+
+    # ----------------------- Following the trade log -----------------------
+    def _invalidate_from(self, pos):
+        """Drop everything that depends on sorted positions >= ``pos``."""
+        keep = bisect.bisect_right(self._cp_pos, pos)
+        del self._cp_pos[keep:]
+        del self._cp_state[keep:]
+        if self._tip[0] > pos:
+            cash, ledger = self._cp_state[-1]
+            self._tip = (self._cp_pos[-1], cash, ledger.copy())
+
+    def sync(self):
+        """Catch up with the trade log (cheap when nothing changed)."""
+        with self._lock:
+            tm = self.trade_manager
+            store = tm.trade_records
+            if (store is not self._store or float(tm.initial_cash) != self._initial_cash
+                    or tm.cost_basis_method != self._method or tm.splits is not self._splits):
+                self._reset()
+            if len(tm.splits) < self._splits_seen:
+                # Undone splits
+                gone = -1 - len(tm.splits)
+                first = min(pos for pos, i in enumerate(self._order) if i <= gone)
+                kept = [(d, i) for d, i in zip(self._dates, self._order) if i > gone]
+                self._dates = [d for d, _ in kept]
+                self._order = [i for _, i in kept]
+                self._splits_seen = len(tm.splits)
+                self._invalidate_from(first)
+            cuts = store.truncations[self._cuts_seen:]
+            if cuts:
+                self._cuts_seen = len(store.truncations)
+                keep = min(cuts + [len(store)])
+                if keep < self._seen:
+                    first = next(pos for pos, i in enumerate(self._order) if i >= keep)
+                    kept = [(d, i) for d, i in zip(self._dates, self._order) if i < keep]
+                    self._dates = [d for d, _ in kept]
+                    self._order = [i for _, i in kept]
+                    self._seen = keep
+                    self._invalidate_from(first)
+
+            n = len(store)
+            # New trades, with each new split after the trades logged before it
+            splits = tm.splits
+            while self._splits_seen < len(splits):
+                k = self._splits_seen
+                self._insert_trades(store, min(splits[k]['at'], n))
+                self._insert(_ordinal(splits[k]['date']), -1 - k)
+                self._splits_seen += 1
+            self._insert_trades(store, n)
+            self._advance()
+
+    def _insert_trades(self, store, stop):
+        """Index trades [seen, stop) of the log."""
+        if stop <= self._seen:
+            return
+        for i, d in enumerate(store.dates[self._seen:stop].tolist(), start=self._seen):
+            self._insert(d if d > 0 else UNDATED, i)
+        self._seen = stop
+
+    def _insert(self, d, i):
+        pos = bisect.bisect_right(self._dates, d)
+        self._dates.insert(pos, d)
+        self._order.insert(pos, i)
+        if pos < len(self._dates) - 1:
+            # Back-dated entry: later positions shift by one
+            self._invalidate_from(pos)
+
+    def _replay(self, start, stop, cash, ledger, checkpoint=False):
+        """Apply sorted trades [start, stop) to (cash, ledger); returns the new cash."""
+        store = self.trade_manager.trade_records
+        splits = self.trade_manager.splits
+        codes, sides = store.code_ids, store.sides
+        shares, prices, amounts = store.shares, store.prices, store.amounts
+        apply_fill = ledger.apply_fill
+        for pos in range(start, stop):
+            i = self._order[pos]
+            if i < 0:
+                split = splits[-1 - i]
+                cash += ledger.split(split['code'], split['ratio'], split['price']) * split['price']
+            elif sides[i] > 0:
+                cash -= float(amounts[i])
+                apply_fill(store.code_of(codes[i]), 'Buy', int(shares[i]), float(prices[i]))
+            else:
+                cash += float(amounts[i])
+                apply_fill(store.code_of(codes[i]), 'Sell', int(shares[i]), float(prices[i]))
+            if checkpoint and self._due(pos + 1):
+                self._cp_pos.append(pos + 1)
+                self._cp_state.append((cash, ledger.copy()))
+        return cash
+
+    def _due(self, pos):
+        last = self._cp_pos[-1]
+        if pos - last >= self.every_trades:
+            return True
+        if self.every_days and pos < len(self._dates):
+            # Checkpoint before the first trade ``every_days`` after the last checkpoint
+            return self._dates[pos] - self._dates[last] >= self.every_days
+        return False
+
+    def _advance(self):
+        """Move the tip to the newest trade, checkpointing on the way."""
+        k, cash, ledger = self._tip
+        if k < len(self._order):
+            cash = self._replay(k, len(self._order), cash, ledger, checkpoint=True)
+            self._tip = (len(self._order), cash, ledger)
+
+    # ----------------------- Queries -----------------------
+    def state_after(self, trades, as_of=None):
+        """State after the first ``trades`` trades in date order."""
+        with self._lock:
+            self.sync()
+            trades = max(0, min(int(trades), len(self._order)))
+            j = bisect.bisect_right(self._cp_pos, trades) - 1
+            start = self._cp_pos[j]
+            cash, ledger = self._cp_state[j]
+            ledger = ledger.copy()
+            cash = self._replay(start, trades, cash, ledger)
+            return PortfolioState(as_of, trades, cash, ledger)
+
+    def state_at(self, date):
+        """State after every trade dated on or before ``date`` (date, datetime or "YYYY-MM-DD")."""
+        with self._lock:
+            self.sync()
+            return self.state_after(bisect.bisect_right(self._dates, _ordinal(date)), as_of=date)
@@ -0,0 +1,247 @@
+"""Corporate actions (splits and cash dividends) as lazily applied adjustment factors.
+
+Prices are stored raw, as traded on each day, and never rewritten when an
+action is added. ``CorporateActions`` keeps the action table and, per
+ticker, two step functions over the ex-dates:
+
+* C(d): the product of the price factors of every action with ex-date <= d.
+  A split of ``ratio`` new shares per old share has factor 1 / ratio; a cash
+  dividend has factor 1 - amount / previous close;
+* S(d): the product of the split ratios with ex-date <= d.
+
+Both are kept as (ex-date ordinals, cumulative product) arrays, so any
+number of dates is resolved with one ``searchsorted``. The price of day d
+adjusted as of day t is ``raw(d) * C(t) / C(d)``: it is expressed in day t's
+units (like akshare's "qfq"), but only actions known on day t count, so a
+simulation never sees a future split. Share counts convert with S the same
+way. Adjusted and raw views therefore come from the same stored prices with
+one vectorized multiply.
+
+The table is a JSON file next to the price cache. Actions inferred from
+real data (raw vs. adjusted closes, ``infer``) are tagged ``"source":
+"data"`` and replaced when the ticker's history is fetched again. The file
+also records, per ticker, the last date the inference covered
+(``inferred_through``), so a refetch without newer sessions does not need
+the adjusted history again.
+"""
+import datetime
+import json
+import os
+import threading
+from fractions import Fraction
+
+import numpy as np
+
+ACTION_TYPES = ("split", "dividend")
+
+
+def _ordinal(date):
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return date.toordinal()
+
+
+def _ordinals(dates):
+    """Ordinals of a date, a sequence of dates or an integer array of ordinals."""
+    if isinstance(dates, np.ndarray) and dates.dtype.kind in "iu":
+        return dates.astype(np.int64)
+    if isinstance(dates, (list, tuple, np.ndarray)):
+        return np.array([_ordinal(d) for d in dates], dtype=np.int64)
+    return _ordinal(dates)
+
+
+def parse_ratio(text):
+    """Parse a split ratio "new:old" ("2:1", "3:2", "1:10") or a plain number into new shares per old share."""
+    new, sep, old = str(text).partition(":")
+    ratio = float(new) / float(old) if sep else float(new)
+    if ratio <= 0:
+        raise ValueError("Split ratio must be positive")
+    return ratio
+
+
+def split_action(code, date, ratio, source="user"):
+    """Split of ``ratio`` new shares per old share, effective (ex-date) on ``date``."""
+    ratio = float(ratio)
+    return {"code": code, "date": _date_str(date), "type": "split", "ratio": ratio,
+            "factor": 1.0 / ratio, "source": source}
+
+
+def dividend_action(code, date, amount, previous_close, source="user"):
+    """Cash dividend of ``amount`` per share with ex-date ``date``; ``previous_close`` is the raw close before it."""
+    amount = float(amount)
+    if not 0 <= amount < previous_close:
+        raise ValueError("Dividend must be non-negative and below the previous close")
+    return {"code": code, "date": _date_str(date), "type": "dividend", "amount": amount,
+            "factor": 1.0 - amount / float(previous_close), "source": source}
+
+
+def _date_str(date):
+    return date[:10] if isinstance(date, str) else datetime.date.fromordinal(_ordinal(date)).isoformat()
+
+
+def infer(code, dates, raw_close, adjusted_close, tol=1e-4):
+    """Actions implied by back-adjusted closes (e.g. akshare "qfq") next to raw ones.
+
+    The adjusted/raw ratio steps up at every ex-date; a step that looks like a
+    simple fraction far from 1 is a split, anything else a cash dividend.
+    """
+    raw = np.asarray(raw_close, dtype=float)
+    adj = np.asarray(adjusted_close, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = adj / raw
+    ok = np.isfinite(ratio) & (ratio > 0)
+    idx = np.flatnonzero(ok)
+    actions = []
+    for prev, i in zip(idx[:-1].tolist(), idx[1:].tolist()):
+        factor = ratio[prev] / ratio[i]
+        if abs(factor - 1.0) <= tol:
+            continue
+        split = Fraction(1.0 / factor).limit_denominator(10)
+        if split != 1 and (factor < 0.8 or factor > 1.0) and abs(float(split) * factor - 1.0) < 0.01:
+            actions.append(split_action(code, dates[i], float(split), source="data"))
+        elif factor < 1.0:
+            actions.append(dividend_action(code, dates[i], (1.0 - factor) * raw[prev], raw[prev], source="data"))
+    return actions
+
+
+class CorporateActions:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self.inferred = {}   # code -> last date (YYYY-MM-DD) the data-derived actions were inferred through
+        self.actions = self._load()
+        self._steps = {}     # code -> (ex-date ordinals, C after each, S after each)
+        self._known = None   # codes with any action
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    actions = json.load(f)
+                if isinstance(actions, dict):
+                    self.inferred = dict(actions.get("inferred_through", {}))
+                    actions = actions.get("actions")
+                if isinstance(actions, list):
+                    return [a for a in actions if a.get("type") in ACTION_TYPES]
+            except Exception as e:
+                print(f"Failed to load corporate actions: {e}")
+        return []
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"actions": self.actions, "inferred_through": self.inferred}, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"Failed to save corporate actions: {e}")
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __contains__(self, code):
+        return code in self._codes()
+
+    def _codes(self):
+        known = self._known
+        if known is None:
+            known = self._known = {a["code"] for a in self.actions}
+        return known
+
+    def codes(self, splits=False):
+        """Tickers with any action (``splits=True``: with a split)."""
+        if splits:
+            return {a["code"] for a in self.actions if a["type"] == "split"}
+        return set(self._codes())
+
+    def for_code(self, code):
+        """Actions of ``code`` by ex-date."""
+        return sorted((a for a in self.actions if a["code"] == code), key=lambda a: a["date"])
+
+    # ----------------------- Editing -----------------------
+    def _changed(self, code):
+        self._steps.pop(code, None)
+        self._known = None
+        self.save()
+
+    def add(self, action):
+        with self._lock:
+            self.actions.append(action)
+            self._changed(action["code"])
+        return action
+
+    def remove(self, action):
+        """Remove the newest action equal to ``action``; returns False if not found."""
+        with self._lock:
+            for i in range(len(self.actions) - 1, -1, -1):
+                if self.actions[i] == action:
+                    del self.actions[i]
+                    self._changed(action["code"])
+                    return True
+        return False
+
+    def replace_inferred(self, code, actions, through=None):
+        """Swap the data-derived actions of ``code`` for ``actions`` (user-entered ones stay).
+
+        ``through``: last date of the history they were inferred from (see ``inferred_through``).
+        """
+        with self._lock:
+            through = _date_str(through) if through is not None else self.inferred.get(code)
+            kept = [a for a in self.actions if a["code"] != code or a.get("source") != "data"]
+            if len(kept) + len(actions) == len(self.actions) and all(a in self.actions for a in actions):
+                if through == self.inferred.get(code):
+                    return
+            else:
+                self.actions = kept + list(actions)
+            if through is not None:
+                self.inferred[code] = through
+            self._changed(code)
+
+    def inferred_through(self, code):
+        """Last date (YYYY-MM-DD) ``code``'s actions were inferred through, or "" if never."""
+        return self.inferred.get(code, "")
+
+    # ----------------------- Factors -----------------------
+    def _steps_for(self, code):
+        steps = self._steps.get(code)
+        if steps is None:
+            with self._lock:
+                actions = self.for_code(code)
+                ex = np.array([_ordinal(a["date"]) for a in actions], dtype=np.int64)
+                factor = np.array([a["factor"] for a in actions], dtype=float)
+                ratio = np.array([a.get("ratio", 1.0) if a["type"] == "split" else 1.0 for a in actions])
+                steps = self._steps[code] = (ex, np.r_[1.0, np.cumprod(factor)], np.r_[1.0, np.cumprod(ratio)])
+        return steps
+
+    def level(self, code, dates, splits=False):
+        """C(d) (``splits=True``: S(d)) at ``dates``: a float for one date, an array for many."""
+        if code not in self._codes():
+            return np.ones(len(dates)) if isinstance(dates, (list, tuple, np.ndarray)) else 1.0
+        ex, cum, split = self._steps_for(code)
+        at = np.searchsorted(ex, _ordinals(dates), side="right")
+        values = (split if splits else cum)[at]
+        return values if np.ndim(values) else float(values)
+
+    def factors(self, code, dates, as_of, splits=False):
+        """Multipliers that express values of ``dates`` in ``as_of``'s units (prices, or shares with ``splits``)."""
+        return self.level(code, as_of, splits) / self.level(code, dates, splits)
+
+    def panel(self, codes, dates, as_of=None, splits=False):
+        """(dates x codes) price multipliers: C(d), or C(as_of) / C(d) if ``as_of`` is given (``splits``: S)."""
+        ords = _ordinals(dates if isinstance(dates, np.ndarray) else list(dates))
+        out = np.ones((len(ords), len(codes)))
+        known = self._codes()
+        for j, code in enumerate(codes):
+            if code in known:
+                out[:, j] = self.level(code, ords, splits) if as_of is None else self.factors(code, ords, as_of, splits)
+        return out
+
+    def split_ratio(self, code, start, end):
+        """Shares held on ``start`` become this many times as many on ``end`` (< 1 when going back)."""
+        if code not in self._codes():
+            return 1.0
+        return self.level(code, end, splits=True) / self.level(code, start, splits=True)
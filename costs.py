@@ -0,0 +1,110 @@
+"""Transaction costs: tiered commissions, bid/ask spread and square-root market impact.
+
+``CostModel.price`` prices any number of fills in one call. The fill
+arguments and every model parameter except the tier table may be scalars or
+NumPy arrays, and they broadcast together. This covers single GUI fills,
+[account, code] order matrices with per-account fee vectors (AccountPool,
+Monte Carlo) and millions of backtest fills alike.
+
+For a fill of ``shares`` at quote ``price`` the execution price moves against
+the trader by:
+
+* ``slippage_per_share``, a constant amount per share;
+* half the quoted spread, ``price * spread_bps / 2 / 10_000``;
+* market impact ``price * impact_coef * volatility * sqrt(shares / volume)``
+  (the square-root law). ``volume`` is the bar's volume and ``volatility``
+  the daily return volatility. Fills without a volume have no impact.
+
+Sells never execute below 0.01. The commission is the rate times the gross
+amount, plus ``per_share`` for every share, and at least ``min_fee``. The
+rate comes from ``commission_tiers``, a list of (notional, rate) pairs where
+a trade pays the rate of the highest tier it reaches. Without tiers the rate
+is ``fee_rate``.
+
+With the defaults (no tiers, spread or impact) the costs are exactly those of
+the flat fee_rate / min_fee / slippage_per_share model.
+"""
+import numpy as np
+
+from analytics import buy_mask
+
+DEFAULT_VOLATILITY = 0.02     # daily return volatility used for impact when none is given
+
+
+def parse_tiers(text):
+    """Parse "0:0.0005, 10000:0.0003" into [(0.0, 0.0005), (10000.0, 0.0003)] (empty text = no tiers)."""
+    tiers = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        notional, sep, rate = part.partition(":")
+        if not sep:
+            raise ValueError(f"Commission tier must look like notional:rate, got {part!r}")
+        notional, rate = float(notional), float(rate)
+        if notional < 0 or rate < 0:
+            raise ValueError("Commission tiers must be non-negative")
+        tiers.append((notional, rate))
+    return sorted(tiers)
+
+
+def format_tiers(tiers):
+    return ", ".join(f"{notional:g}:{rate:g}" for notional, rate in tiers or ())
+
+
+class CostModel:
+    def __init__(self, fee_rate=0.0001, min_fee=1.0, slippage_per_share=0.0, commission_tiers=None,
+                 per_share=0.0, spread_bps=0.0, impact_coef=0.0, volatility=DEFAULT_VOLATILITY):
+        self.fee_rate = fee_rate
+        self.min_fee = min_fee
+        self.slippage_per_share = slippage_per_share
+        self.commission_tiers = sorted((float(n), float(r)) for n, r in commission_tiers or ())
+        self.per_share = per_share
+        self.spread_bps = spread_bps
+        self.impact_coef = impact_coef
+        self.volatility = volatility
+        self._tier_notional = np.array([n for n, _ in self.commission_tiers])
+        self._tier_rate = np.array([r for _, r in self.commission_tiers])
+
+    def commission_rate(self, gross):
+        """Commission rate for trades of ``gross`` value."""
+        if not self.commission_tiers:
+            return self.fee_rate
+        tier = np.searchsorted(self._tier_notional, gross, side="right") - 1
+        # Trades below the first tier pay the first tier's rate
+        return self._tier_rate[np.maximum(tier, 0)]
+
+    def commission(self, gross, shares):
+        """Commission of fills with ``gross`` value and ``shares`` shares (0 where nothing traded)."""
+        fee = np.maximum(self.min_fee, gross * self.commission_rate(gross) + self.per_share * shares)
+        return np.where(gross > 0, fee, 0.0)
+
+    def impact(self, prices, shares, volume=None, volatility=None):
+        """Price move per share caused by the fills (square-root law); 0 without volume."""
+        if volume is None or not np.any(self.impact_coef):
+            return 0.0
+        volume = np.asarray(volume, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            participation = np.where(volume > 0, shares / volume, 0.0)
+        sigma = self.volatility if volatility is None else volatility
+        return prices * self.impact_coef * sigma * np.sqrt(participation)
+
+    def price(self, prices, shares, sides, volume=None, volatility=None):
+        """(execution price, gross amount, fee) arrays for fills.
+
+        ``sides``: +1/-1 or 'Buy'/'Sell'. ``volume``: bar volume of each fill's
+        stock (NaN or 0 = unknown). ``volatility``: daily return volatility.
+        """
+        prices = np.asarray(prices, dtype=float)
+        shares = np.abs(np.asarray(shares))
+        buy = buy_mask(sides)
+        shift = self.slippage_per_share + prices * (self.spread_bps / 20_000.0) \
+            + self.impact(prices, shares, volume, volatility)
+        exec_price = np.where(buy, prices + shift, np.maximum(0.01, prices - shift))
+        gross = exec_price * shares
+        return exec_price, gross, self.commission(gross, shares)
+
+    def fill(self, price, shares, trade_type, volume=None, volatility=None):
+        """One fill as floats: (execution price, gross amount, fee)."""
+        exec_price, gross, fee = self.price(price, shares, 1 if trade_type == 'Buy' else -1, volume, volatility)
+        return float(exec_price), float(gross), float(fee)
@@ -0,0 +1,347 @@
+"""Technical indicators: streaming, batch and a cached per-stock engine.
+
+* Streaming classes (``SMA``, ``EMA``, ``RSI``, ``Bollinger``, ``ATR``) take
+  one bar per ``update`` call in O(1): running sums, EMA/Wilder recursions
+  and a sliding-window Welford variance.
+* Batch functions (``sma``, ``ema``, ``rsi``, ``bollinger``, ``atr``) compute
+  the same values for a whole array at once. Input may be 1-D or a 2-D
+  (dates x codes) panel; time runs along axis 0.
+* ``IndicatorEngine`` caches indicator series per (code, indicator, params)
+  on top of ``StockDataManager.get_stock_history``. Moving the end date
+  forward only feeds the new bars to the streaming state.
+
+An indicator is named by a spec tuple such as ``("sma", 20)`` or
+``("bollinger", 20, 2.0)``. Every indicator returns a dict of columns:
+"value" for single-line indicators, and "mid"/"upper"/"lower" for Bollinger bands.
+The first bars, before the window is full, are NaN.
+"""
+import bisect
+import datetime
+import math
+from collections import deque
+
+import numpy as np
+
+NAN = float("nan")
+
+
+# ----------------------- Streaming (O(1) per bar) -----------------------
+class SMA:
+    def __init__(self, period):
+        self.period = int(period)
+        self.window = deque()
+        self.total = 0.0
+
+    def update(self, close, high=None, low=None):
+        self.window.append(close)
+        self.total += close
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+        return {"value": self.total / self.period if len(self.window) == self.period else NAN}
+
+
+class EMA:
+    """Exponential moving average seeded with the SMA of the first ``period`` bars."""
+
+    def __init__(self, period, alpha=None):
+        self.period = int(period)
+        self.alpha = 2.0 / (self.period + 1) if alpha is None else alpha
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = NAN
+
+    def update(self, close, high=None, low=None):
+        self.count += 1
+        if self.count < self.period:
+            self.seed_sum += close
+            return {"value": NAN}
+        if self.count == self.period:
+            self.value = (self.seed_sum + close) / self.period
+        else:
+            self.value += self.alpha * (close - self.value)
+        return {"value": self.value}
+
+
+class RSI:
+    """Wilder's RSI: gains and losses smoothed with alpha = 1 / period."""
+
+    def __init__(self, period=14):
+        self.period = int(period)
+        self.prev = None
+        self.gain = EMA(self.period, alpha=1.0 / self.period)
+        self.loss = EMA(self.period, alpha=1.0 / self.period)
+
+    def update(self, close, high=None, low=None):
+        if self.prev is None:
+            self.prev = close
+            return {"value": NAN}
+        change = close - self.prev
+        self.prev = close
+        gain = self.gain.update(max(change, 0.0))["value"]
+        loss = self.loss.update(max(-change, 0.0))["value"]
+        return {"value": _rsi_value(gain, loss)}
+
+
+def _rsi_value(gain, loss):
+    if math.isnan(gain):
+        return NAN
+    if loss == 0:
+        return 100.0 if gain > 0 else 50.0
+    return 100.0 - 100.0 / (1.0 + gain / loss)
+
+
+class Bollinger:
+    """Bands at mean ± k population std over a sliding window (Welford add/remove)."""
+
+    def __init__(self, period=20, k=2.0):
+        self.period = int(period)
+        self.k = float(k)
+        self.window = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, close, high=None, low=None):
+        self.window.append(close)
+        n = len(self.window)
+        delta = close - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (close - self.mean)
+        if n > self.period:
+            old = self.window.popleft()
+            n -= 1
+            delta = old - self.mean
+            self.mean -= delta / n
+            self.m2 -= delta * (old - self.mean)
+        if n < self.period:
+            return {"mid": NAN, "upper": NAN, "lower": NAN}
+        std = math.sqrt(max(self.m2 / n, 0.0))
+        return {"mid": self.mean, "upper": self.mean + self.k * std, "lower": self.mean - self.k * std}
+
+
+class ATR:
+    """Average true range with Wilder smoothing (first bar's TR is high - low)."""
+
+    def __init__(self, period=14):
+        self.period = int(period)
+        self.prev_close = None
+        self.avg = EMA(self.period, alpha=1.0 / self.period)
+
+    def update(self, close, high=None, low=None):
+        high = close if high is None else high
+        low = close if low is None else low
+        if self.prev_close is None:
+            tr = high - low
+        else:
+            tr = max(high, self.prev_close) - min(low, self.prev_close)
+        self.prev_close = close
+        return self.avg.update(tr)
+
+
+STREAMING = {"sma": SMA, "ema": EMA, "rsi": RSI, "bollinger": Bollinger, "atr": ATR}
+OUTPUTS = {"sma": ("value",), "ema": ("value",), "rsi": ("value",),
+           "bollinger": ("mid", "upper", "lower"), "atr": ("value",)}
+
+
+# ----------------------- Batch (vectorized over a panel) -----------------------
+def _as_panel(values):
+    return np.asarray(values, dtype=float)
+
+
+def sma(close, period):
+    x = _as_panel(close)
+    period = int(period)
+    out = np.full(x.shape, np.nan)
+    if len(x) < period:
+        return {"value": out}
+    c = np.cumsum(x, axis=0)
+    out[period - 1] = c[period - 1]
+    out[period:] = c[period:] - c[:-period]
+    out[period - 1:] /= period
+    return {"value": out}
+
+
+def _ema_recursion(x, period, alpha):
+    """EMA along axis 0, seeded with the SMA of the first ``period`` rows.
+
+    Loops over time only; each step is vectorized across all codes.
+    """
+    out = np.full(x.shape, np.nan)
+    if len(x) < period:
+        return out
+    value = x[:period].mean(axis=0)
+    out[period - 1] = value
+    for t in range(period, len(x)):
+        value = value + alpha * (x[t] - value)
+        out[t] = value
+    return out
+
+
+def ema(close, period):
+    period = int(period)
+    return {"value": _ema_recursion(_as_panel(close), period, 2.0 / (period + 1))}
+
+
+def rsi(close, period=14):
+    x = _as_panel(close)
+    period = int(period)
+    out = np.full(x.shape, np.nan)
+    if len(x) < 2:
+        return {"value": out}
+    change = np.diff(x, axis=0)
+    gain = _ema_recursion(np.maximum(change, 0.0), period, 1.0 / period)
+    loss = _ema_recursion(np.maximum(-change, 0.0), period, 1.0 / period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = 100.0 - 100.0 / (1.0 + gain / loss)
+    value = np.where(loss == 0, np.where(gain > 0, 100.0, 50.0), value)
+    out[1:] = np.where(np.isnan(gain), np.nan, value)
+    return {"value": out}
+
+
+def bollinger(close, period=20, k=2.0):
+    x = _as_panel(close)
+    period = int(period)
+    # Shift by the first row so the sum of squares stays well conditioned
+    shift = x[:1] if len(x) else 0.0
+    centered = x - shift
+    mean = sma(centered, period)["value"]
+    sq = sma(centered * centered, period)["value"]
+    std = np.sqrt(np.maximum(sq - mean * mean, 0.0))
+    mid = mean + shift
+    return {"mid": mid, "upper": mid + k * std, "lower": mid - k * std}
+
+
+def atr(high, low, close, period=14):
+    h = _as_panel(high)
+    lo = _as_panel(low)
+    c = _as_panel(close)
+    tr = h - lo
+    if len(c) > 1:
+        prev = c[:-1]
+        tr[1:] = np.maximum(h[1:], prev) - np.minimum(lo[1:], prev)
+    period = int(period)
+    return {"value": _ema_recursion(tr, period, 1.0 / period)}
+
+
+def batch(spec, close, high=None, low=None):
+    """Compute indicator ``spec`` over whole arrays/panels."""
+    name, params = spec[0], spec[1:]
+    if name == "atr":
+        return atr(close if high is None else high, close if low is None else low, close, *params)
+    return BATCH[name](close, *params)
+
+
+BATCH = {"sma": sma, "ema": ema, "rsi": rsi, "bollinger": bollinger, "atr": atr}
+
+
+def warmup_bars(spec):
+    """Bars needed before an indicator's values settle."""
+    name, params = spec[0], spec[1:]
+    period = int(params[0]) if params else 14
+    if name in ("ema", "rsi", "atr"):
+        return 3 * period
+    return period
+
+
+# ----------------------- Cached engine -----------------------
+class _Series:
+    """Indicator values for one (code, spec), computed from ``origin`` on."""
+
+    __slots__ = ("origin", "covered", "dates", "columns", "state", "last_date", "level")
+
+    def __init__(self, origin, spec, level=1.0):
+        self.origin = origin
+        self.level = level      # corporate-action level the prices are adjusted to
+        self.covered = origin   # bars before this date have been fetched
+        self.dates = []
+        self.columns = {col: [] for col in OUTPUTS[spec[0]]}
+        self.state = STREAMING[spec[0]](*spec[1:])
+        self.last_date = None
+
+    def feed(self, history):
+        """Feed bars of a get_stock_history DataFrame newer than ``last_date``."""
+        state = self.state
+        columns = self.columns
+        for d, h, lo, c in zip(history["date"], history["high"], history["low"], history["close"]):
+            day = datetime.date.fromisoformat(d)
+            if self.last_date is not None and day <= self.last_date:
+                continue
+            values = state.update(float(c), float(h), float(lo))
+            for col, series in columns.items():
+                series.append(values[col])
+            self.dates.append(day)
+            self.last_date = day
+
+
+class IndicatorEngine:
+    """Indicator series per (code, indicator, params) over a StockDataManager.
+
+    Windows follow ``get_stock_history``: the last ``window_days`` trading
+    sessions before ``end_date``, adjusted for the splits and dividends up to
+    ``end_date``. With ``include_end`` the window ends with ``end_date``'s
+    session instead, so the last value uses that day's close. Strategies get
+    these values, matching the quotes in ``StrategyContext.prices``. A series
+    is recomputed when a corporate action lies between the dates it was
+    computed for and ``end_date``.
+    """
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self._cache = {}
+
+    def invalidate(self, code=None):
+        """Drop cached series for ``code`` (or everything)."""
+        if code is None:
+            self._cache.clear()
+            return
+        for key in [k for k in self._cache if k[0] == code]:
+            del self._cache[key]
+
+    def series(self, code, spec, end_date, window_days=60, include_end=False):
+        """Return {"date": [...], column: ndarray, ...} for the window ending before ``end_date``.
+
+        ``include_end``: end the window with ``end_date``'s session (on or before it) instead.
+        """
+        spec = tuple(spec)
+        calendar = self.data_manager.calendar
+        end = end_date.date() if isinstance(end_date, datetime.datetime) else end_date
+        stop = calendar.next_session(end) if include_end else end
+        start = calendar.session_before(stop, window_days)
+        key = (code,) + spec
+        entry = self._cache.get(key)
+        level = self.data_manager.actions.level(code, end)
+        if entry is None or entry.origin > start or entry.level != level:
+            origin = calendar.session_before(start, warmup_bars(spec) + 1)
+            entry = self._cache[key] = _Series(origin, spec, level)
+        if stop > entry.covered:
+            self._extend(entry, code, stop, end)
+        return self._slice(entry, start, stop)
+
+    def _extend(self, entry, code, stop, as_of):
+        """Fetch the sessions between ``entry.covered`` and ``stop`` in ``as_of``'s units and stream them in."""
+        sessions = self.data_manager.calendar.count_in(entry.covered, stop)
+        if sessions > 0:
+            stop_dt = datetime.datetime.combine(stop, datetime.time())
+            as_of_dt = datetime.datetime.combine(as_of, datetime.time())
+            history = self.data_manager.get_stock_history(code, stop_dt, window_days=sessions, as_of=as_of_dt)
+            if history is not None and not history.empty:
+                entry.feed(history)
+        entry.covered = stop
+
+    def _slice(self, entry, start, end):
+        lo = bisect.bisect_left(entry.dates, start)
+        hi = bisect.bisect_left(entry.dates, end)
+        result = {"date": [d.strftime("%Y-%m-%d") for d in entry.dates[lo:hi]]}
+        for col, values in entry.columns.items():
+            result[col] = np.array(values[lo:hi], dtype=float)
+        return result
+
+    def latest(self, codes, spec, end_date, window_days=60, include_end=False):
+        """Latest value of ``spec`` for every code, as {column: array over codes}."""
+        columns = {col: np.full(len(codes), np.nan) for col in OUTPUTS[spec[0]]}
+        for i, code in enumerate(codes):
+            result = self.series(code, spec, end_date, window_days, include_end)
+            if result["date"]:
+                for col in columns:
+                    columns[col][i] = result[col][-1]
+        return columns
+
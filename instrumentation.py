@@ -0,0 +1,218 @@
+"""Lightweight timers and counters for the simulator's hot paths.
+
+Profiling is off unless the ``STOCK_SIM_PROFILE`` environment variable is set
+(1/true/yes/on) before import. When off, ``timed`` returns the decorated
+function unchanged and ``timer``/``count`` do nothing, so instrumented code
+pays close to nothing.
+
+When on, a report is written at interpreter exit to the path in
+``STOCK_SIM_PROFILE_OUT`` (JSON), or printed to stderr if no path is given.
+"""
+import atexit
+import functools
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+ENABLED = os.environ.get("STOCK_SIM_PROFILE", "").strip().lower() in {"1", "true", "yes", "on"}
+
+# Histogram buckets: upper bounds of 1us, 2us, 4us ... ~67s
+_BUCKET_BOUNDS = [2 ** i / 1e6 for i in range(27)]
+
+
+class _TimerStats:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        if seconds <= 0:
+            idx = 0
+        else:
+            idx = max(0, math.ceil(math.log2(seconds * 1e6)))
+        self.buckets[min(idx, len(_BUCKET_BOUNDS))] += 1
+
+    def percentile(self, pct):
+        """Estimate a percentile as the upper bound of the bucket holding it."""
+        if self.count == 0:
+            return 0.0
+        target = self.count * pct / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(_BUCKET_BOUNDS[i], self.max) if i < len(_BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self):
+        histogram = {}
+        for i, n in enumerate(self.buckets):
+            if n:
+                label = f"<={_BUCKET_BOUNDS[i] * 1e6:.0f}us" if i < len(_BUCKET_BOUNDS) else "overflow"
+                histogram[label] = n
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "min_s": self.min if self.count else 0.0,
+            "max_s": self.max,
+            "p50_s": self.percentile(50),
+            "p95_s": self.percentile(95),
+            "histogram": histogram
+        }
+
+
+class Recorder:
+    """Thread-safe store of timer and counter values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self._timers.get(name)
+            if stats is None:
+                stats = self._timers[name] = _TimerStats()
+            stats.add(seconds)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def report(self):
+        """Return all timers and counters as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "timers": {name: s.to_dict() for name, s in sorted(self._timers.items())},
+                "counters": dict(sorted(self._counters.items()))
+            }
+
+    def dump_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+    def format_text(self):
+        data = self.report()
+        lines = [f"{'timer':<36}{'count':>8}{'total ms':>12}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for name, t in data["timers"].items():
+            lines.append(
+                f"{name:<36}{t['count']:>8}{t['total_s'] * 1e3:>12.2f}{t['mean_s'] * 1e3:>10.3f}"
+                f"{t['p95_s'] * 1e3:>10.3f}{t['max_s'] * 1e3:>10.3f}"
+            )
+        if data["counters"]:
+            lines.append("")
+            lines.append(f"{'counter':<36}{'value':>8}")
+            for name, value in data["counters"].items():
+                lines.append(f"{name:<36}{value:>8}")
+        return "\n".join(lines)
+
+
+recorder = Recorder()
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        recorder.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """Context manager timing the enclosed block under ``name``."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def timed(name=None):
+    """Decorator timing every call of the function under ``name``.
+
+    Resolved at decoration time: with profiling off the original function is
+    returned as-is.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.record(label, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Increment counter ``name`` by ``n``."""
+    if ENABLED:
+        recorder.incr(name, n)
+
+
+def report():
+    return recorder.report()
+
+
+def dump_json(path):
+    recorder.dump_json(path)
+
+
+def _write_report_at_exit():
+    out_path = os.environ.get("STOCK_SIM_PROFILE_OUT", "").strip()
+    try:
+        if out_path:
+            recorder.dump_json(out_path)
+        else:
+            print(recorder.format_text(), file=sys.stderr)
+    except Exception as e:
+        print(f"Failed to write profiling report: {e}", file=sys.stderr)
+
+
+if ENABLED:
+    atexit.register(_write_report_at_exit)
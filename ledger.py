@@ -0,0 +1,263 @@
+"""Position ledger with lot-level cost basis.
+
+Each fill updates one position in O(1) amortized time: FIFO and LIFO keep a
+deque of open lots, average-cost keeps only shares and total cost. Realized
+P&L and win/loss tallies are maintained incrementally, so position and
+performance queries never need to replay the trade history.
+"""
+from collections import deque
+
+COST_METHODS = ("average", "fifo", "lifo")
+
+
+class Position:
+    """Open position in one stock."""
+
+    __slots__ = ("code", "shares", "cost", "realized", "lots")
+
+    def __init__(self, code):
+        self.code = code
+        self.shares = 0
+        self.cost = 0.0         # cost basis of the open shares
+        self.realized = 0.0     # realized P&L accumulated on this code
+        self.lots = deque()     # [shares, price] per open lot (FIFO/LIFO only)
+
+    @property
+    def avg_cost(self):
+        return self.cost / self.shares if self.shares > 0 else 0.0
+
+    def unrealized(self, price):
+        return price * self.shares - self.cost
+
+    def __repr__(self):
+        return f"Position({self.code!r}, shares={self.shares}, cost={self.cost:.2f}, realized={self.realized:.2f})"
+
+
+class PositionLedger:
+    """Per-code positions updated fill by fill."""
+
+    def __init__(self, method="average"):
+        if method not in COST_METHODS:
+            raise ValueError(f"Unknown cost basis method: {method}")
+        self.method = method
+        self.positions = {}
+        self.realized_by_code = {}
+        self.total_realized = 0.0
+        # Tallies over closing fills (pnl >= 0 counts as a win)
+        self.win_count = 0
+        self.loss_count = 0
+        self.profit_sum = 0.0
+        self.loss_sum = 0.0
+
+    def clear(self):
+        self.__init__(self.method)
+
+    def copy(self):
+        """Independent copy of all positions, lots and tallies (used for checkpoints)."""
+        other = PositionLedger(self.method)
+        for code, pos in self.positions.items():
+            dup = other.positions[code] = Position(code)
+            dup.shares = pos.shares
+            dup.cost = pos.cost
+            dup.realized = pos.realized
+            dup.lots = deque(pos.lots)     # lots are never mutated in place
+        other.realized_by_code = dict(self.realized_by_code)
+        other.total_realized = self.total_realized
+        other.win_count = self.win_count
+        other.loss_count = self.loss_count
+        other.profit_sum = self.profit_sum
+        other.loss_sum = self.loss_sum
+        return other
+
+    def snapshot(self, code):
+        """JSON-friendly state of one code plus the tallies, for undoing the next fill on it."""
+        pos = self.positions.get(code)
+        return {
+            "position": [pos.shares, pos.cost, pos.realized, [list(lot) for lot in pos.lots]] if pos else None,
+            "realized": self.realized_by_code.get(code),
+            "tallies": [self.total_realized, self.win_count, self.loss_count, self.profit_sum, self.loss_sum],
+        }
+
+    def restore(self, code, snap):
+        """Put back the state captured by ``snapshot(code)``."""
+        if snap["position"] is None:
+            self.positions.pop(code, None)
+        else:
+            shares, cost, realized, lots = snap["position"]
+            pos = self.positions[code] = Position(code)
+            pos.shares, pos.cost, pos.realized = shares, cost, realized
+            pos.lots = deque(list(lot) for lot in lots)
+        if snap["realized"] is None:
+            self.realized_by_code.pop(code, None)
+        else:
+            self.realized_by_code[code] = snap["realized"]
+        (self.total_realized, self.win_count, self.loss_count,
+         self.profit_sum, self.loss_sum) = snap["tallies"]
+
+    def apply_fill(self, code, trade_type, shares, price):
+        """Apply one fill and return the P&L it realized (0 for buys).
+
+        Sells larger than the open position only close what is held.
+        """
+        if shares <= 0:
+            return 0.0
+        pos = self.positions.get(code)
+        if trade_type == 'Buy':
+            if pos is None:
+                pos = self.positions[code] = Position(code)
+                pos.realized = self.realized_by_code.get(code, 0.0)
+            pos.shares += shares
+            pos.cost += shares * price
+            if self.method != "average":
+                pos.lots.append([shares, price])
+            return 0.0
+
+        if pos is None or pos.shares <= 0:
+            return 0.0
+        qty = min(shares, pos.shares)
+        if self.method == "average":
+            released = pos.cost * qty / pos.shares
+        else:
+            released = self._consume_lots(pos.lots, qty)
+        pnl = qty * price - released
+        pos.shares -= qty
+        pos.cost = pos.cost - released if pos.shares > 0 else 0.0
+        pos.realized += pnl
+        self.realized_by_code[code] = pos.realized
+        self.total_realized += pnl
+        if pnl >= 0:
+            self.win_count += 1
+            self.profit_sum += pnl
+        else:
+            self.loss_count += 1
+            self.loss_sum += pnl
+        if pos.shares == 0:
+            del self.positions[code]
+        return pnl
+
+    def _consume_lots(self, lots, qty, take_front=None):
+        """Remove ``qty`` shares from the lot queue and return their cost.
+
+        Lots are taken in sell order (oldest first for FIFO); ``take_front=False`` takes the newest first.
+        """
+        if take_front is None:
+            take_front = self.method == "fifo"
+        released = 0.0
+        while qty > 0 and lots:
+            lot = lots[0] if take_front else lots[-1]
+            if lot[0] <= qty:
+                released += lot[0] * lot[1]
+                qty -= lot[0]
+                if take_front:
+                    lots.popleft()
+                else:
+                    lots.pop()
+            else:
+                released += qty * lot[1]
+                # Replace rather than mutate the lot, so ledger copies can share lot lists
+                if take_front:
+                    lots[0] = [lot[0] - qty, lot[1]]
+                else:
+                    lots[-1] = [lot[0] - qty, lot[1]]
+                qty = 0
+        return released
+
+    def split(self, code, ratio, price):
+        """Apply a stock split of ``ratio`` new shares per old share to ``code``.
+
+        Lots keep their total cost (shares x ratio at price / ratio). A
+        fractional share left over is sold at ``price`` (cash in lieu) and its
+        P&L realized; it comes off the newest lots first, across as many lots
+        as it takes. Returns the number of shares sold that way.
+
+        >>> ledger = PositionLedger("fifo")
+        >>> _ = ledger.apply_fill("X", "Buy", 12, 10.0)
+        >>> _ = ledger.apply_fill("X", "Buy", 1, 20.0)
+        >>> round(ledger.split("X", 0.1, 100.0), 6)
+        0.3
+        >>> pos = ledger.position("X")
+        >>> pos.shares, round(pos.cost, 6), [[round(n, 6), px] for n, px in pos.lots]
+        (1, 100.0, [[1, 100.0]])
+        """
+        pos = self.positions.get(code)
+        if pos is None or pos.shares <= 0 or ratio == 1:
+            return 0.0
+        total = pos.shares * ratio
+        whole = int(total + 1e-9)
+        fraction = total - whole if total - whole > 1e-9 else 0.0
+        pos.lots = deque([lot_shares * ratio, lot_price / ratio] for lot_shares, lot_price in pos.lots)
+        if fraction:
+            if self.method == "average":
+                released = pos.cost * fraction / total
+            else:
+                # The odd fraction comes off the newest lots, like a sell in LIFO order
+                released = self._consume_lots(pos.lots, fraction, take_front=False)
+            pnl = fraction * price - released
+            pos.cost -= released
+            pos.realized += pnl
+            self.realized_by_code[code] = pos.realized
+            self.total_realized += pnl
+        # Lots stay fractional only where a split made them so (their sum is whole)
+        pos.lots = deque([int(round(n)) if abs(n - round(n)) < 1e-9 else n, px] for n, px in pos.lots if n > 1e-9)
+        pos.shares = whole
+        if whole == 0:
+            del self.positions[code]
+        return fraction
+
+    # ----------------------- Queries (O(1)) -----------------------
+    def position(self, code):
+        return self.positions.get(code)
+
+    def shares(self, code):
+        pos = self.positions.get(code)
+        return pos.shares if pos else 0
+
+    def cost_basis(self, code):
+        pos = self.positions.get(code)
+        return pos.cost if pos else 0.0
+
+    def avg_cost(self, code):
+        pos = self.positions.get(code)
+        return pos.avg_cost if pos else 0.0
+
+    def realized(self, code=None):
+        if code is None:
+            return self.total_realized
+        return self.realized_by_code.get(code, 0.0)
+
+    def unrealized(self, code, price):
+        pos = self.positions.get(code)
+        return pos.unrealized(price) if pos else 0.0
+
+    def trade_stats(self):
+        """Win rate (%) and profit factor over closing fills."""
+        closed = self.win_count + self.loss_count
+        win_rate = self.win_count / closed * 100 if closed else 0.0
+        if self.loss_sum < 0:
+            profit_factor = self.profit_sum / abs(self.loss_sum)
+        else:
+            profit_factor = self.profit_sum if self.profit_sum > 0 else 0.0
+        return {"win_rate": win_rate, "profit_factor": profit_factor, "closed_trades": closed}
+
+    def to_portfolio(self):
+        """Portfolio dict in the TradeManager layout {code: {'shares', 'total_cost'}}."""
+        return {code: {'shares': p.shares, 'total_cost': p.cost} for code, p in self.positions.items()}
+
+    # ----------------------- Bulk construction -----------------------
+    def replay(self, store, start=0, stop=None):
+        """Apply the trades [start, stop) of a TradeStore in order (default: all)."""
+        codes = store.codes.strings
+        apply_fill = self.apply_fill
+        window = slice(start, stop)
+        for code_id, side, qty, px in zip(
+            store.code_ids[window].tolist(), store.sides[window].tolist(),
+            store.shares[window].tolist(), store.prices[window].tolist()
+        ):
+            apply_fill(codes[code_id], 'Buy' if side > 0 else 'Sell', qty, px)
+
+    def seed(self, portfolio):
+        """Open one lot per position from a {code: {'shares', 'total_cost'}} dict."""
+        for code, info in portfolio.items():
+            shares = int(info.get('shares', 0))
+            if shares > 0:
+                self.apply_fill(code, 'Buy', shares, float(info.get('total_cost', 0.0)) / shares)
@@ -0,0 +1,302 @@
+"""Correlated mock market: GBM or GARCH(1,1) price paths for the whole universe.
+
+The default mock generator draws every day independently around a fixed
+base price. ``MarketSimulator`` instead simulates one continuous path per
+stock, so mock prices trend, draw down and recover:
+
+* daily shocks come from one seeded stream per stock (seeded by the
+  simulator seed and the code's CRC32), and are correlated through the
+  Cholesky factor of a market + sector correlation matrix;
+* returns follow geometric Brownian motion, or GARCH(1,1) with volatility
+  clustering (``model="garch"``);
+* prices are ``base * cumprod(growth)`` along the date axis, pinned to the
+  base price on the first simulated session (the anchor). The whole panel
+  is built once with NumPy, which takes well under a second for years x
+  hundreds of tickers;
+* ``stock_events`` impacts are drift shocks: on every session of an event
+  the day's growth is multiplied by ``1 + impact_pct / 100``. As with a real
+  shock, all later prices move too (all earlier ones for events before the
+  anchor).
+
+The simulated range starts at 2010-01-04 and is extended a year at a time
+when a quote falls outside it, up to the trading calendar's own range.
+Sessions after the range continue each code's stream; sessions before the
+anchor come from a second stream per code, walked backwards from the
+anchor. Either way the paths already simulated stay unchanged. ``covers``
+tells callers whether a date can be simulated at all; outside it
+``quotes`` gives NaN and StockDataManager falls back to the iid generator.
+
+Paths depend only on the seed, the code and the codes added before it. New
+codes are appended, and because the Cholesky factor is lower-triangular,
+adding one never changes the existing paths.
+
+Sessions, codes and prices form one snapshot that is replaced as a whole
+(under a lock) when codes are added, the range is extended or events
+change. Lookups read a single snapshot, so they are safe from any thread.
+
+Select it with ``STOCK_SIM_MOCK_MODEL=gbm`` (or ``garch``), or
+``StockDataManager(mock_model="gbm")``.
+"""
+import datetime
+import threading
+import zlib
+
+import numpy as np
+
+MODELS = ("iid", "gbm", "garch")
+TRADING_DAYS = 252
+DEFAULT_START = datetime.date(2010, 1, 4)
+DEFAULT_END = datetime.date(2030, 12, 31)
+
+
+def _crc(code):
+    return zlib.crc32(code.encode("utf-8"))
+
+
+def stock_params(codes):
+    """(base price, annual drift, annual volatility) arrays derived from the codes."""
+    h = np.array([_crc(c) for c in codes], dtype=np.int64)
+    base = 50.0 + h % 250                      # same base prices as the iid mock generator
+    drift = -0.04 + (h >> 8) % 17 / 100.0      # -4% .. +12% a year
+    vol = 0.15 + (h >> 16) % 36 / 100.0        # 15% .. 50% a year
+    return base, drift, vol
+
+
+def _path(base, growth, anchor):
+    """Prices from per-session growth, equal to ``base`` on row ``anchor``."""
+    prices = np.empty_like(growth)
+    forward = growth[anchor:].copy()
+    forward[0] = 1.0
+    prices[anchor:] = base * np.cumprod(forward, axis=0)
+    if anchor:
+        # price[r - 1] = price[r] / growth[r], walking back from the anchor
+        prices[:anchor] = base / np.cumprod(growth[anchor:0:-1], axis=0)[::-1]
+    return prices
+
+
+def correlation_matrix(codes, market_corr=0.3, sector_corr=0.2, n_sectors=8):
+    """One market factor plus ``n_sectors`` sector factors (sector = CRC32 % n_sectors)."""
+    sector = np.array([(_crc(c) >> 24) % n_sectors for c in codes])
+    corr = market_corr + sector_corr * (sector[:, None] == sector[None, :])
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+class _Paths:
+    """One consistent version of the simulated panel. Never modified: writers publish a new one."""
+    __slots__ = ("sessions", "anchor", "codes", "index", "base", "growth", "prices")
+
+    def __init__(self, sessions, anchor, codes, base, growth, prices):
+        self.sessions = sessions
+        self.anchor = anchor    # row of the first simulated session, where every path starts at its base price
+        self.codes = codes
+        self.index = {c: j for j, c in enumerate(codes)}
+        self.base = base
+        self.growth = growth
+        self.prices = prices
+
+    def row(self, ordinal):
+        i = int(np.searchsorted(self.sessions, ordinal, side="right")) - 1
+        return min(max(i, 0), len(self.sessions) - 1)
+
+
+class MarketSimulator:
+    def __init__(self, codes, calendar, model="gbm", seed=0, start=DEFAULT_START, end=DEFAULT_END,
+                 market_corr=0.3, sector_corr=0.2, garch=(0.08, 0.90), events=()):
+        if model not in ("gbm", "garch"):
+            raise ValueError(f"unknown mock market model: {model}")
+        self.model = model
+        self.seed = seed
+        self.market_corr = market_corr
+        self.sector_corr = sector_corr
+        self.garch = garch
+        self.calendar = calendar
+        self.events = list(events)
+        self._lock = threading.Lock()
+        sessions = np.array([d.toordinal() for d in calendar.sessions_between(start, end)], dtype=np.int64)
+        empty = np.empty((len(sessions), 0))
+        self._paths = _Paths(sessions, 0, [], np.empty(0), empty, empty)
+        self.add_codes(codes)
+
+    @property
+    def sessions(self):
+        return self._paths.sessions
+
+    @property
+    def codes(self):
+        return self._paths.codes
+
+    @property
+    def prices(self):
+        return self._paths.prices
+
+    # ----------------------- Simulation -----------------------
+    def _noise(self, codes, n, stream=()):
+        """Standard normal shocks (n x codes), one seeded stream per code."""
+        z = np.empty((n, len(codes)))
+        for j, code in enumerate(codes):
+            z[:, j] = np.random.default_rng([self.seed, _crc(code), *stream]).standard_normal(n)
+        return z
+
+    def _simulate(self, codes, sessions, a):
+        """(base, growth) of ``codes`` over ``sessions``, with the paths anchored on row ``a``."""
+        base, drift, vol = stock_params(codes)
+        chol = np.linalg.cholesky(correlation_matrix(codes, self.market_corr, self.sector_corr))
+        growth = np.ones((len(sessions), len(codes)))
+        growth[a + 1:] = np.exp(self._log_returns(self._noise(codes, len(sessions) - a) @ chol.T, drift, vol)[1:])
+        if a:
+            # Growth into rows a, a-1, .., 1, drawn in that order from the backward stream
+            growth[a:0:-1] = np.exp(self._log_returns(self._noise(codes, a, (1,)) @ chol.T, drift, vol))
+        return base, growth
+
+    def _log_returns(self, eps, drift, vol):
+        mu = drift / TRADING_DAYS
+        var = vol ** 2 / TRADING_DAYS
+        if self.model == "garch":
+            alpha, beta = self.garch
+            omega = var * (1.0 - alpha - beta)
+            h = var.copy()
+            log_ret = np.empty_like(eps)
+            # Time recursion; each step is vectorized across all codes
+            for t in range(len(eps)):
+                shock = np.sqrt(h) * eps[t]
+                log_ret[t] = mu - 0.5 * h + shock
+                h = omega + alpha * shock * shock + beta * h
+        else:
+            log_ret = (mu - 0.5 * var) + np.sqrt(var) * eps
+        return log_ret
+
+    def _publish(self, sessions, anchor, codes):
+        """Simulate ``codes`` over ``sessions`` and make it the current snapshot (caller holds the lock)."""
+        base, growth = self._simulate(codes, sessions, anchor)
+        paths = _Paths(sessions, anchor, codes, base, growth, None)
+        paths.prices = self._price_columns(paths)
+        self._paths = paths
+
+    def add_codes(self, codes):
+        """Append codes that are not simulated yet (existing paths stay unchanged)."""
+        with self._lock:
+            paths = self._paths
+            new = [c for c in dict.fromkeys(codes) if c not in paths.index]
+            if not new and paths.codes:
+                return
+            self._publish(paths.sessions, paths.anchor, paths.codes + new)
+
+    def _extend(self, lo, hi):
+        """Grow the simulated sessions, with a year of margin, to cover ordinals lo..hi."""
+        with self._lock:
+            paths = self._paths
+            first, last = int(paths.sessions[0]), int(paths.sessions[-1])
+            start = datetime.date(datetime.date.fromordinal(lo).year - 1, 1, 1).toordinal() if lo < first else first
+            end = datetime.date(datetime.date.fromordinal(hi).year + 1, 12, 31).toordinal() if hi > last else last
+            start, end = max(start, self.calendar.first), min(end, self.calendar.last)
+            if start >= first and end <= last:
+                return
+            dates = self.calendar.sessions_between(datetime.date.fromordinal(start), datetime.date.fromordinal(end))
+            sessions = np.array([d.toordinal() for d in dates], dtype=np.int64)
+            anchor = int(np.searchsorted(sessions, paths.sessions[paths.anchor]))
+            self._publish(sessions, anchor, paths.codes)
+
+    def _cover(self, ordinals):
+        """Extend the range if some of ``ordinals`` (clipped to the calendar) fall outside it.
+
+        Returns the snapshot to read from.
+        """
+        lo = max(min(ordinals), self.calendar.first)
+        hi = min(max(ordinals), self.calendar.last)
+        paths = self._paths
+        if lo < paths.sessions[0] or hi > paths.sessions[-1]:
+            self._extend(lo, hi)
+            paths = self._paths
+        return paths
+
+    def covers(self, date):
+        """True if ``date`` lies inside the range the simulator can price (extending it if needed)."""
+        ordinal = date.toordinal()
+        if not self.calendar.first <= ordinal <= self.calendar.last:
+            return False
+        return self._cover([ordinal]).sessions[0] <= ordinal
+
+    def _event_factors(self, code, sessions):
+        factor = np.ones(len(sessions))
+        for ev in self.events:
+            if ev.get("code") != code:
+                continue
+            try:
+                start = datetime.date.fromisoformat(ev.get("start", "")).toordinal()
+            except ValueError:
+                continue
+            days = int(ev.get("days", 0))
+            lo = np.searchsorted(sessions, start)
+            hi = np.searchsorted(sessions, start + days)
+            factor[lo:hi] *= 1.0 + float(ev.get("impact_pct", 0.0)) / 100.0
+        return factor
+
+    def _price_columns(self, paths, codes=None):
+        """Prices of ``paths`` with the columns of ``codes`` (all by default) recomputed from growth and events."""
+        if codes is None:
+            cols = range(len(paths.codes))
+            growth = paths.growth.copy()
+        else:
+            cols = [paths.index[c] for c in codes if c in paths.index]
+            growth = paths.growth[:, cols].copy()
+        for k, j in enumerate(cols):
+            growth[:, k] *= self._event_factors(paths.codes[j], paths.sessions)
+        if codes is None:
+            return _path(paths.base, growth, paths.anchor)
+        prices = paths.prices.copy()
+        for k, j in enumerate(cols):
+            prices[:, j] = _path(paths.base[j], growth[:, k], paths.anchor)
+        return prices
+
+    def set_events(self, events, codes=None):
+        """Replace the event list and re-price the affected codes (all if ``codes`` is None)."""
+        with self._lock:
+            self.events = list(events)
+            paths = self._paths
+            self._paths = _Paths(paths.sessions, paths.anchor, paths.codes, paths.base, paths.growth,
+                                 self._price_columns(paths, codes))
+
+    # ----------------------- Lookups -----------------------
+    # Each lookup reads one snapshot, so a concurrent extension or new code never mixes versions
+    def _snapshot(self, codes, ordinals):
+        paths = self._paths
+        if any(c not in paths.index for c in codes):
+            self.add_codes(codes)
+        return self._cover(ordinals) if len(ordinals) else self._paths
+
+    def quote(self, code, date):
+        """{"price", "change_percent"} of ``code`` on the last session on or before ``date``."""
+        paths = self._snapshot([code], [date.toordinal()])
+        j = paths.index[code]
+        i = paths.row(date.toordinal())
+        price = float(paths.prices[i, j])
+        prev = float(paths.prices[i - 1, j]) if i > 0 else price
+        return {
+            "price": round(price, 2),
+            "change_percent": round((price / prev - 1.0) * 100, 2)
+        }
+
+    def quotes(self, dates, codes):
+        """Vectorized ``quote``: (price, change_percent) arrays of shape (dates x codes).
+
+        Rows of dates the simulator cannot cover (see ``covers``) are NaN.
+        """
+        ordinals = np.array([d.toordinal() for d in dates], dtype=np.int64)
+        paths = self._snapshot(codes, ordinals.tolist())
+        inside = (ordinals >= paths.sessions[0]) & (ordinals <= self.calendar.last)
+        rows = np.array([paths.row(o) for o in ordinals.tolist()], dtype=np.int64)
+        cols = [paths.index[c] for c in codes]
+        price = paths.prices[np.ix_(rows, cols)]
+        prev = paths.prices[np.ix_(np.maximum(rows - 1, 0), cols)]
+        price = np.where(inside[:, None], price, np.nan)
+        return np.round(price, 2), np.round((price / prev - 1.0) * 100, 2)
+
+    def panel(self, start, end, codes=None):
+        """(dates, prices): sessions with start <= date <= end and a (dates x codes) price block."""
+        codes = list(codes) if codes is not None else self.codes
+        paths = self._snapshot(codes, [start.toordinal(), end.toordinal()])
+        lo = int(np.searchsorted(paths.sessions, start.toordinal()))
+        hi = int(np.searchsorted(paths.sessions, end.toordinal(), side="right"))
+        dates = [datetime.date.fromordinal(int(o)) for o in paths.sessions[lo:hi]]
+        return dates, paths.prices[lo:hi, [paths.index[c] for c in codes]]
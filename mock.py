@@ -3,60 +3,375 @@ import random  # Import random module for generating random numbers
 from tkinter import messagebox  # Import messagebox from tkinter for displaying message boxes
 from tkinter import simpledialog  # Import simpledialog for user input dialogs
 import datetime  # Import datetime module for date manipulation
-from tkcalendar import Calendar, DateEntry  # Import Calendar and DateEntry from tkcalendar
 from tkinter import ttk  # Import ttk for Combobox
+import contextlib
+import functools
+import importlib.util
 import threading
 import time
 import json
 import os
-try:
-    import matplotlib
-    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-    from matplotlib.figure import Figure
-    MATPLOTLIB_AVAILABLE = True
-except Exception:
-    matplotlib = None
-    FigureCanvasTkAgg = None
-    Figure = None
-    MATPLOTLIB_AVAILABLE = False
-try:
-    import akshare as ak
-    AKSHARE_AVAILABLE = True
-except Exception:
-    ak = None
-    AKSHARE_AVAILABLE = False
-import pandas as pd
-import numpy as np
+import shutil
+import zlib
+
+from instrumentation import count, timed
+from ledger import COST_METHODS, PositionLedger
+
+# Heavy optional dependencies (pandas, numpy, matplotlib, tkcalendar, akshare)
+# are imported on first use so that importing this module and showing the
+# window stay fast. Availability is checked without importing.
+MATPLOTLIB_AVAILABLE = importlib.util.find_spec("matplotlib") is not None
+AKSHARE_AVAILABLE = importlib.util.find_spec("akshare") is not None
+_matplotlib_tk = None
+_akshare = None
+
+
+def _load_matplotlib_tk():
+    """Import matplotlib's Tk backend on first chart use.
+
+    Returns (Figure, FigureCanvasTkAgg, Rectangle), or None if the import fails.
+    """
+    global _matplotlib_tk, MATPLOTLIB_AVAILABLE
+    if _matplotlib_tk is None and MATPLOTLIB_AVAILABLE:
+        try:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            from matplotlib.figure import Figure
+            from matplotlib.patches import Rectangle
+            _matplotlib_tk = (Figure, FigureCanvasTkAgg, Rectangle)
+        except Exception as e:
+            print(f"Failed to import matplotlib, charts disabled: {e}")
+            MATPLOTLIB_AVAILABLE = False
+    return _matplotlib_tk
+
+
+def _load_akshare():
+    """Import akshare on first network fetch (None if unavailable)."""
+    global _akshare, AKSHARE_AVAILABLE
+    if _akshare is None and AKSHARE_AVAILABLE:
+        try:
+            import akshare
+            _akshare = akshare
+        except Exception as e:
+            print(f"Failed to import akshare: {e}")
+            AKSHARE_AVAILABLE = False
+    return _akshare
+
+
+@functools.lru_cache(maxsize=None)
+def code_hash(code):
+    """Stable non-negative hash of a stock code (CRC32).
+
+    Unlike the built-in ``hash``, it does not change with PYTHONHASHSEED, so
+    mock prices match across runs, processes and the on-disk cache.
+    """
+    return zlib.crc32(code.encode("utf-8"))
+
+
+# Format of the price cache (stock_data.json / the SQLite prices table). Older caches are
+# upgraded once when opened (StockDataManager._upgrade_prices)
+# (1: stable mock prices, 2: real histories cached raw instead of forward-adjusted)
+PRICE_CACHE_VERSION = 2
+# Key of the format stamp in stock_data.json (every other key is a date)
+CACHE_META_KEY = "_cache"
+
+
+# Idle time on a date before its neighbouring trading days are prefetched
+PREFETCH_IDLE_MS = 400
+
+# K-line overlay choices: label -> indicator spec (see indicators.py)
+KLINE_OVERLAYS = {
+    "None": None,
+    "SMA 20": ("sma", 20),
+    "EMA 20": ("ema", 20),
+    "Bollinger 20, 2σ": ("bollinger", 20, 2.0),
+}
 
 
 class StockDataManager:
-    def __init__(self, data_file="stock_data.json", use_mock_data=None):
+    def __init__(self, data_file="stock_data.json", use_mock_data=None, storage=None, mock_model=None):
         # Get the directory of the current file
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.data_file = os.path.join(self.base_dir, data_file)
         self.events_file = os.path.join(self.base_dir, "stock_events.json")
-        self.data = self._load_data()
+        self.actions_file = os.path.splitext(self.data_file)[0] + "_actions.json"
+        self.bars_file = os.path.splitext(self.data_file)[0] + "_bars.npz"
+        # Optional SQLite backend (storage.py); None keeps the JSON files
+        from storage import get_store
+        self.store = get_store(storage, self.base_dir)
+        self._pending_rows = []
+        if self.store is not None:
+            self._upgrade_store()
+            self._import_json_into_store()
+        # The price store is parsed on first access (or by preload_async).
+        # With SQLite this is only an in-memory memo of rows read or written.
+        self._data = None
+        self._data_lock = threading.Lock()
+        # Guards writes to the price cache (UI, loader and prefetch threads share it)
+        self._write_lock = threading.RLock()
+        self._defer_depth = 0
+        self._dirty = False
+        self._indicators = None
+        self._bars = None
+        self._actions = None
         self.events = self._load_events()
         self.stock_list = self._get_default_stock_list()
         self.use_mock_data = self._determine_mock_mode(use_mock_data)
+        # Mock price model: "iid" (independent days) or a path simulator, "gbm"/"garch" (market_sim.py)
+        if mock_model is None:
+            mock_model = os.environ.get("STOCK_SIM_MOCK_MODEL", "iid")
+        self.mock_model = str(mock_model).strip().lower()
+        self._market = None
+
+    @property
+    def data(self):
+        """Cached prices {date_str: {code: {...}}}, loaded from disk on first access."""
+        if self._data is None:
+            with self._data_lock:
+                if self._data is None:
+                    self._data = self._load_data()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def calendar(self):
+        """Trading calendar (NYSE sessions) used for date stepping and history windows."""
+        from trading_calendar import default_calendar
+        return default_calendar()
+
+    def session_date(self, date):
+        """Roll ``date`` back to the last trading session on or before it."""
+        try:
+            return self.calendar.rollback(date)
+        except ValueError:
+            return date.date() if isinstance(date, datetime.datetime) else date
+
+    @property
+    def bars(self):
+        """Real OHLCV bars per code (see bars.py), kept next to the price cache."""
+        if self._bars is None:
+            from bars import BarCache
+            if self.store is None:
+                # Parse the price file first: upgrading it may drop outdated bars (_load_data)
+                self.data
+            self._bars = BarCache(path=self.bars_file, store=self.store)
+        return self._bars
+
+    @property
+    def market(self):
+        """Correlated path simulator used for mock prices, or None for the iid generator."""
+        if self._market is None and self.use_mock_data and self.mock_model in ("gbm", "garch"):
+            with self._write_lock:
+                if self._market is None:
+                    try:
+                        from market_sim import MarketSimulator
+                        self._market = MarketSimulator(
+                            list(self.stock_list), self.calendar, model=self.mock_model, events=self.events
+                        )
+                    except Exception as e:
+                        print(f"Failed to start the {self.mock_model} mock market, using iid mock data: {e}")
+                        self.mock_model = "iid"
+        return self._market
+
+    @property
+    def actions(self):
+        """Splits and dividends (corporate_actions.py), kept next to the price cache."""
+        if self._actions is None:
+            from corporate_actions import CorporateActions
+            self._actions = CorporateActions(self.actions_file)
+        return self._actions
+
+    def get_bar(self, code, date):
+        """Real OHLCV bar of ``code`` on ``date``'s session as a dict, or None if none is cached."""
+        return self.bars.bar(code, self.session_date(date))
+
+    @property
+    def indicators(self):
+        """Cached technical indicators over this manager's price history (see indicators.py)."""
+        if self._indicators is None:
+            from indicators import IndicatorEngine
+            self._indicators = IndicatorEngine(self)
+        return self._indicators
+
+    def preload_async(self):
+        """Parse the price store on a background thread so the UI can start first."""
+        if self._data is not None:
+            return
+        threading.Thread(target=lambda: self.data, daemon=True).start()
         
     def _load_data(self):
         """Load stored data"""
+        if self.store is not None:
+            return {}
         if os.path.exists(self.data_file):
             try:
                 with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    data = json.load(f)
             except:
                 return {}
+            version = data.pop(CACHE_META_KEY, {}).get("version", 0)
+            if version < PRICE_CACHE_VERSION:
+                upgraded = self._upgrade_prices(data, version)
+                # Nothing is dropped without a backup (e.g. stock_data.v0.json); retried next time if that fails
+                if upgraded != data and not self._backup_file(self.data_file, version, copy=True):
+                    return data
+                if version < 2 and os.path.exists(self.bars_file) and not self._backup_file(self.bars_file, version):
+                    return data
+                data = upgraded
+                self._write_data_file(data)
+            return data
         return {}
+
+    def _write_data_file(self, data):
+        with open(self.data_file, 'w', encoding='utf-8') as f:
+            json.dump(dict(data, **{CACHE_META_KEY: {"version": PRICE_CACHE_VERSION}}), f, ensure_ascii=False, indent=2)
+
+    def _backup_file(self, path, version, copy=False):
+        """Move (or copy) ``path`` aside as <name>.v<version><ext> before an upgrade drops its data."""
+        root, ext = os.path.splitext(path)
+        backup = f"{root}.v{version}{ext}"
+        try:
+            if copy:
+                shutil.copyfile(path, backup)
+            else:
+                os.replace(path, backup)
+        except OSError as e:
+            print(f"Failed to back up {path}, not upgrading it: {e}")
+            return False
+        print(f"Kept the previous cache as {backup}")
+        return True
+
+    def _upgrade_prices(self, data, version):
+        """Bring a price cache {date_str: {code: {...}}} of format ``version`` to PRICE_CACHE_VERSION.
+
+        Returns a new dict if anything changed (``data`` itself is left as it is).
+        """
+        if version < 1 and data:
+            # Mock prices used to come from the salted built-in hash, so cached and newly generated
+            # prices disagreed; unstamped rows cannot be told apart from real ones, so all are dropped
+            print("Price cache predates stable mock prices, clearing it once")
+            data = {}
+        if version < 2 and data and os.path.exists(self.bars_file):
+            # Full histories (bars and closes) used to be fetched forward-adjusted; their codes are
+            # dropped, with the bar file, and fetched again raw. Bulk imports need to be re-imported
+            from bars import BarCache
+            codes = set(BarCache(self.bars_file).codes())
+            if codes:
+                print("Price cache holds forward-adjusted histories, clearing them once")
+                kept = {}
+                for date_str, day in data.items():
+                    day = {c: e for c, e in day.items() if c not in codes}
+                    if day:
+                        kept[date_str] = day
+                data = kept
+        return data
+
+    def _upgrade_store(self):
+        """`_upgrade_prices` for the SQLite prices table (stamped in its meta table)."""
+        store = self.store
+        try:
+            version = store.get_meta("price_cache_version", 0)
+            if version >= PRICE_CACHE_VERSION:
+                return
+            # The old rows are copied to backup tables (e.g. prices_v0) before anything is dropped
+            if version < 1 and not store.is_empty("prices"):
+                print(f"Price cache in {store.path} predates stable mock prices, clearing it once")
+                store.backup_table("prices", f"v{version}")
+                store.clear_prices()
+            if version < 2 and not store.is_empty("bars"):
+                print(f"Price cache in {store.path} holds forward-adjusted histories, clearing them once")
+                store.backup_table("prices", f"v{version}")
+                store.backup_table("bars", f"v{version}")
+                store.clear_bars()
+            store.set_meta("price_cache_version", PRICE_CACHE_VERSION)
+        except Exception as e:
+            print(f"Failed to upgrade the price cache in {store.path}: {e}")
     
+    @timed()
     def _save_data(self):
-        """Save data to file"""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        """Save data to file, or insert new rows into SQLite (postponed while saves are deferred)"""
+        with self._write_lock:
+            if self._defer_depth > 0:
+                self._dirty = True
+                return
+            self._dirty = False
+            if self._bars is not None:
+                self._bars.save()
+            if self.store is not None:
+                rows, self._pending_rows = self._pending_rows, []
+                if rows:
+                    self.store.put_prices(rows)
+                return
+            self._write_data_file(self.data)
+
+    def _import_json_into_store(self):
+        """One-time migration: copy the JSON files into an empty SQLite database."""
+        store = self.store
+        try:
+            if store.is_empty("prices") and os.path.exists(self.data_file):
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                data = self._upgrade_prices(data, data.pop(CACHE_META_KEY, {}).get("version", 0))
+                store.put_prices([
+                    (code, date_str, entry["price"], entry["change_percent"])
+                    for date_str, day in data.items() for code, entry in day.items()
+                ])
+            if store.is_empty("events") and os.path.exists(self.events_file):
+                with open(self.events_file, 'r', encoding='utf-8') as f:
+                    events = json.load(f)
+                if isinstance(events, list):
+                    store.replace_events(events)
+            list_path = os.path.join(self.base_dir, "stock_list.json")
+            if store.is_empty("universe") and os.path.exists(list_path):
+                with open(list_path, 'r', encoding='utf-8') as f:
+                    stock_list = json.load(f)
+                if isinstance(stock_list, dict) and stock_list:
+                    store.save_universe(stock_list)
+        except Exception as e:
+            print(f"Failed to import JSON data into {store.path}: {e}")
+
+    # ----------------------- Cache accessors -----------------------
+    def get_cached_price(self, code, date_str):
+        """Cached {"price", "change_percent"} for code/date, or None (never fetches)."""
+        day = self.data.get(date_str)
+        if day is not None and code in day:
+            return day[code]
+        if self.store is not None:
+            entry = self.store.get_price(code, date_str)
+            if entry is not None:
+                with self._write_lock:
+                    self.data.setdefault(date_str, {})[code] = entry
+            return entry
+        return None
+
+    def get_cached_day(self, date_str):
+        """All cached prices of one date as {code: {...}} (empty if none)."""
+        if self.store is not None:
+            day = self.store.get_day(date_str)
+            day.update(self.data.get(date_str, {}))
+            return day
+        return self.data.get(date_str, {})
+
+    @contextlib.contextmanager
+    def deferred_saves(self):
+        """Batch cache writes: save once when the outermost block exits."""
+        with self._write_lock:
+            self._defer_depth += 1
+        try:
+            yield
+        finally:
+            with self._write_lock:
+                self._defer_depth -= 1
+                if self._defer_depth == 0 and self._dirty:
+                    self._save_data()
 
     def _load_events(self):
         """Load stock event data (good/bad news that affect mock returns)."""
+        if self.store is not None:
+            self._event_ids, events = self.store.load_event_rows()
+            return events
         if os.path.exists(self.events_file):
             try:
                 with open(self.events_file, 'r', encoding='utf-8') as f:
@@ -92,6 +407,10 @@ class StockDataManager:
     
     def _get_default_stock_list(self):
         """Return stock list (load from file if available, otherwise use built-in defaults)"""
+        if self.store is not None:
+            stored = self.store.load_universe()
+            if stored:
+                return stored
         # Allow user to customize stock universe via stock_list.json in the same directory.
         custom_path = os.path.join(self.base_dir, "stock_list.json")
         if os.path.exists(custom_path):
@@ -126,26 +445,54 @@ class StockDataManager:
     def get_stock_list(self):
         """Get stock list"""
         return self.stock_list
+
+    def save_stock_list(self):
+        """Persist the current universe (stock_list.json or the SQLite universe table)."""
+        if self.store is not None:
+            self.store.save_universe(self.stock_list)
+            return
+        path = os.path.join(self.base_dir, "stock_list.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.stock_list, f, ensure_ascii=False, indent=2)
     
+    @timed()
     def get_stock_data(self, code, date):
-        """Get data for specified date and stock code"""
+        """Get data for specified date and stock code.
+
+        Non-trading days resolve to the previous session, so nothing is
+        fetched, generated or stored for weekends and holidays.
+        """
+        date = self.session_date(date)
         date_str = date.strftime("%Y-%m-%d")
         
         # Check if data for this date already exists
-        if date_str in self.data and code in self.data[date_str]:
-            print(f"Getting {code} data for {date_str} from local cache")
-            return self.data[date_str][code]
+        cached = self.get_cached_price(code, date_str)
+        if cached is not None:
+            count("data.cache_hit")
+            return cached
         
         if self.use_mock_data:
-            stock_data = self._generate_mock_stock_data(code, date)
+            count("data.mock_generated")
+            market = self.market
+            if market is not None and market.covers(date):
+                stock_data = market.quote(code, date)
+            else:
+                stock_data = self._generate_mock_stock_data(code, date)
+            if code in self.actions:
+                # Mock paths are total-return series; splits and dividends up to ``date`` give the raw price
+                stock_data = dict(stock_data, price=round(stock_data["price"] * self.actions.level(code, date), 2))
             self._cache_stock_data(date_str, code, stock_data)
             return stock_data
         
-        print(f"Getting {code} data for {date_str} from network")
+        count("data.network_fetch")
+        ak = _load_akshare()
+        if ak is None:
+            print(f"Failed to get stock {code} data: akshare unavailable")
+            return None
         # If no data exists, fetch from network
         try:
-            # Get historical data
-            hist_data = ak.stock_us_daily(symbol=code, adjust='qfq')
+            # Get historical data: raw prices are cached, adjusted views are derived at read time
+            hist_data = ak.stock_us_daily(symbol=code)
             
             if hist_data.empty:
                 print(f"Stock {code} has no historical data")
@@ -153,6 +500,19 @@ class StockDataManager:
                 
             # Ensure data is sorted by date
             hist_data = hist_data.sort_values('date')
+            # Forward-adjusted closes only serve to infer the splits and dividends, so they are
+            # downloaded only if the history has sessions after the last inference
+            adjusted = None
+            if str(hist_data['date'].iloc[-1])[:10] > self.actions.inferred_through(code):
+                try:
+                    adjusted = ak.stock_us_daily(symbol=code, adjust='qfq')
+                except Exception as e:
+                    print(f"Failed to get adjusted prices of {code}, corporate actions not updated: {e}")
+            # Keep the whole history (real OHLCV bars and daily closes) so later dates need no refetch
+            self.cache_history(code, hist_data, adjusted)
+            cached = self.get_cached_price(code, date_str)
+            if cached is not None:
+                return cached
             
             # Get target date data
             target_price_data = hist_data[hist_data['date'] <= date_str]
@@ -195,60 +555,69 @@ class StockDataManager:
             print(f"Failed to get stock {code} data: {str(e)}")
             return None
 
-    def get_stock_history(self, code, end_date, window_days=60):
+    def get_stock_history(self, code, end_date, window_days=60, adjusted=True, as_of=None):
         """Get historical OHLC data for k-line chart.
-        Returns a pandas DataFrame with columns: date, open, high, low, close.
+        Returns a pandas DataFrame with columns: date, open, high, low, close, volume.
+        The window is the last ``window_days`` trading sessions before ``end_date``.
+        Sessions with a cached real bar (akshare history or a bulk import) use it as-is.
+        ``adjusted``: express prices and volumes in ``end_date``'s units, i.e.
+        adjusted for the splits and dividends up to then (False = raw prices).
+        ``as_of``: adjust to this date's units instead of ``end_date``'s.
 
         Note: 为了保证在本地离线环境、以及不同日期选择下都有平滑且可重复的效果，
-        这里不再强依赖 akshare 的真实历史数据，而是统一基于当前选择的日期和股票代码
+        没有真实 K 线的日期基于当前选择的日期和股票代码
         生成一个“合成但合理”的 K 线序列。这样：
         - 切换不同股票 → 形态会变化；
         - 切换不同日期 → 窗口会随日期移动，而不是一直固定在同一段历史。
         """
-        # 统一使用合成 OHLC 数据，围绕每日收盘价构造。
+        sessions = self.calendar.sessions_before(end_date, window_days)
+        # Real bars (akshare history or bulk import) are used as-is where cached
+        real, rows = self.bars.lookup(code, [d.toordinal() for d in sessions])
+        if len(sessions) and real.all():
+            count("data.real_bars")
+            import pandas as pd
+            df = pd.DataFrame({
+                "date": [d.strftime("%Y-%m-%d") for d in sessions],
+                "open": rows["open"],
+                "high": rows["high"],
+                "low": rows["low"],
+                "close": rows["close"],
+                "volume": rows["volume"]
+            })
+            return self._adjust_history(code, df, as_of or end_date) if adjusted else df
+
+        # 其余日期使用合成 OHLC 数据，围绕每日收盘价构造。
         dates = []
         opens = []
         highs = []
         lows = []
         closes = []
-        for i in range(window_days, 0, -1):
-            d = end_date - datetime.timedelta(days=i)
+        volumes = []
+        for i, d in enumerate(sessions):
+            if real[i]:
+                bar = rows[i]
+                dates.append(d.strftime("%Y-%m-%d"))
+                opens.append(float(bar["open"]))
+                highs.append(float(bar["high"]))
+                lows.append(float(bar["low"]))
+                closes.append(float(bar["close"]))
+                volumes.append(int(bar["volume"]))
+                continue
             data = self.get_stock_data(code, d)
             if data is None:
                 continue
-            close_price = float(data["price"])
-            # Deterministic randomness based on code+date
-            seed = f"{code}-{d.strftime('%Y-%m-%d')}-ohlc"
-            rng = random.Random(seed)
-            # Generate open/close with small variation
-            spread = close_price * 0.02  # 2% intraday range baseline
-            open_price = close_price + rng.uniform(-0.5, 0.5) * spread
-            high_price = max(open_price, close_price) + rng.uniform(0.1, 0.6) * spread
-            low_price = min(open_price, close_price) - rng.uniform(0.1, 0.6) * spread
-
+            bar = self.synthetic_bar(code, d, float(data["price"]))
             dates.append(d.strftime("%Y-%m-%d"))
-            opens.append(round(open_price, 2))
-            highs.append(round(high_price, 2))
-            lows.append(round(low_price, 2))
-            closes.append(round(close_price, 2))
+            opens.append(bar["open"])
+            highs.append(bar["high"])
+            lows.append(bar["low"])
+            closes.append(bar["close"])
+            volumes.append(bar["volume"])
 
         if not dates:
             return None
 
-        # 生成与价格对应的合成成交量（与波动程度、价格水平弱相关，便于展示）
-        volumes = []
-        for i, cp in enumerate(closes):
-            # 使用与 K 线相同的 deterministic 随机源，保证同一日期/股票下重复性
-            d = datetime.datetime.strptime(dates[i], "%Y-%m-%d").date()
-            seed = f"{code}-{d.strftime('%Y-%m-%d')}-vol"
-            rng = random.Random(seed)
-            base_vol = 1_000_000 + (abs(hash(code)) % 500_000)
-            # 让高波动日的成交量略高
-            intraday_range = highs[i] - lows[i]
-            vol_scale = 1.0 + min(intraday_range / max(cp, 1.0), 0.5)
-            volume = int(base_vol * vol_scale * rng.uniform(0.7, 1.3))
-            volumes.append(volume)
-
+        import pandas as pd
         df = pd.DataFrame({
             "date": dates,
             "open": opens,
@@ -257,13 +626,61 @@ class StockDataManager:
             "close": closes,
             "volume": volumes
         })
-        return df
+        return self._adjust_history(code, df, as_of or end_date) if adjusted else df
+
+    def _adjust_history(self, code, frame, as_of):
+        """Multiply a raw history frame into ``as_of``'s units (one vectorized pass, only if ``code`` has actions)."""
+        actions = self.actions
+        if code not in actions or frame.empty:
+            return frame
+        import numpy as np
+        ordinals = np.array([datetime.date.fromisoformat(d).toordinal() for d in frame["date"]], dtype=np.int64)
+        price = actions.factors(code, ordinals, as_of)
+        shares = actions.factors(code, ordinals, as_of, splits=True)
+        frame = frame.copy()
+        for col in ("open", "high", "low", "close"):
+            frame[col] = frame[col].to_numpy(dtype=float) * price
+        frame["volume"] = np.rint(frame["volume"].to_numpy(dtype=float) * shares).astype(np.int64)
+        return frame
+
+    def synthetic_bar(self, code, date, close_price):
+        """Deterministic synthetic OHLCV bar around ``close_price`` (used where no real bar is cached)."""
+        # Deterministic randomness based on code+date
+        date_str = date.strftime('%Y-%m-%d')
+        rng = random.Random(f"{code}-{date_str}-ohlc")
+        # Generate open/close with small variation
+        spread = close_price * 0.02  # 2% intraday range baseline
+        open_price = close_price + rng.uniform(-0.5, 0.5) * spread
+        high_price = round(max(open_price, close_price) + rng.uniform(0.1, 0.6) * spread, 2)
+        low_price = round(min(open_price, close_price) - rng.uniform(0.1, 0.6) * spread, 2)
+        close_price = round(close_price, 2)
+
+        # 生成与价格对应的合成成交量（与波动程度、价格水平弱相关，便于展示）
+        # 使用与 K 线相同的 deterministic 随机源，保证同一日期/股票下重复性
+        rng = random.Random(f"{code}-{date_str}-vol")
+        base_vol = 1_000_000 + code_hash(code) % 500_000
+        # 让高波动日的成交量略高
+        vol_scale = 1.0 + min((high_price - low_price) / max(close_price, 1.0), 0.5)
+        return {
+            "open": round(open_price, 2),
+            "high": high_price,
+            "low": low_price,
+            "close": close_price,
+            "volume": int(base_vol * vol_scale * rng.uniform(0.7, 1.3))
+        }
+
+    def bar_volume(self, code, date, close_price):
+        """Volume of ``code`` on ``date``: the real bar's if cached, else the synthetic bar's."""
+        bar = self.get_bar(code, date)
+        if bar is None:
+            bar = self.synthetic_bar(code, date, close_price)
+        return float(bar["volume"])
 
     def _generate_mock_stock_data(self, code, date):
         """Generate deterministic mock stock data"""
         date_str = date.strftime("%Y-%m-%d")
         rng = random.Random(f"{code}-{date_str}")
-        base_price = 50 + (abs(hash(code)) % 250)
+        base_price = 50 + code_hash(code) % 250
         change_percent = round(rng.uniform(-4.5, 4.5), 2)
 
         # 应用事件脚本：在事件持续期间对日涨跌幅做偏移
@@ -292,13 +709,77 @@ class StockDataManager:
 
     def _cache_stock_data(self, date_str, code, stock_data):
         """Cache stock data locally"""
-        if date_str not in self.data:
-            self.data[date_str] = {}
-        self.data[date_str][code] = stock_data
-        self._save_data()
+        with self._write_lock:
+            if date_str not in self.data:
+                self.data[date_str] = {}
+            self.data[date_str][code] = stock_data
+            if self.store is not None:
+                self._pending_rows.append((code, date_str, stock_data["price"], stock_data["change_percent"]))
+            self._save_data()
+
+    def cache_prices(self, rows):
+        """Bulk version of _cache_stock_data for (code, date_str, price, change_percent) rows."""
+        with self._write_lock:
+            if self.store is not None:
+                self.store.put_prices(rows)
+                # Keep already-memoized entries in sync; new rows are read from the store on demand
+                memo = self._data or {}
+                for code, date_str, price, change_percent in rows:
+                    day = memo.get(date_str)
+                    if day is not None and code in day:
+                        day[code] = {"price": price, "change_percent": change_percent}
+            else:
+                data = self.data
+                for code, date_str, price, change_percent in rows:
+                    day = data.get(date_str)
+                    if day is None:
+                        day = data[date_str] = {}
+                    day[code] = {"price": price, "change_percent": change_percent}
+                self._save_data()
+            if self._indicators is not None:
+                self._indicators.invalidate()
+
+    def cache_bars(self, code, bars):
+        """Store real bars (bars.BAR_DTYPE array) for ``code``."""
+        with self._write_lock:
+            self.bars.put(code, bars)
+            if self._indicators is not None:
+                self._indicators.invalidate(code)
+            self._save_data()
+
+    def cache_history(self, code, frame, adjusted=None):
+        """Cache a full daily history frame (date, open, high, low, close, volume) of one code.
+
+        ``frame`` holds raw prices. ``adjusted`` (date, close of the same history
+        back-adjusted, e.g. akshare "qfq") updates the code's inferred splits and
+        dividends. Daily changes are total-return changes over the known actions.
+        """
+        import numpy as np
+        from bars import bars_from_frame
+        bars = bars_from_frame(frame)
+        if not len(bars):
+            return
+        close = bars["close"]
+        basis = close
+        if adjusted is not None and len(adjusted):
+            from corporate_actions import infer
+            adj = bars_from_frame(adjusted)
+            at = np.minimum(np.searchsorted(adj["date"], bars["date"]), len(adj) - 1)
+            adj_close = np.where(adj["date"][at] == bars["date"], adj["close"][at], np.nan)
+            self.actions.replace_inferred(code, infer(code, bars["date"], close, adj_close), through=int(bars["date"][-1]))
+            if self._indicators is not None:
+                self._indicators.invalidate(code)
+        if code in self.actions:
+            basis = close / self.actions.level(code, bars["date"])
+        change = np.zeros(len(close))
+        change[1:] = (basis[1:] - basis[:-1]) / basis[:-1] * 100
+        dates = [datetime.date.fromordinal(int(o)).strftime("%Y-%m-%d") for o in bars["date"]]
+        with self.deferred_saves():
+            self.cache_bars(code, bars)
+            self.cache_prices(list(zip([code] * len(dates), dates, close.tolist(), change.tolist())))
 
     def add_event(self, code, start_date, days, impact_pct):
-        """Add a good/bad news event for a stock.
+        """Add a good/bad news event for a stock and return it (None if ``days`` <= 0).
 
         impact_pct: 正数表示在原有日涨跌幅基础上增加（利好），负数表示减少（利空）。
         """
@@ -312,37 +793,140 @@ class StockDataManager:
             "impact_pct": float(impact_pct)
         }
         self.events.append(event)
-        self._save_events()
-
-        # 为了让事件立即生效，清除该股票在事件区间内的本地价格缓存
+        if self.store is not None:
+            self._event_ids.append(self.store.add_event(event))
+        else:
+            self._save_events()
+        self._apply_event_change(code, start_date, days)
+        return event
+
+    def remove_event(self, event):
+        """Remove an event added with `add_event` (the newest equal one); returns False if not found."""
+        for i in range(len(self.events) - 1, -1, -1):
+            if self.events[i] == event:
+                break
+        else:
+            return False
+        del self.events[i]
+        if self.store is not None:
+            # Only this row: events other processes added stay
+            self.store.delete_event(self._event_ids.pop(i))
+        else:
+            self._save_events()
+        start_date = datetime.datetime.strptime(event["start"], "%Y-%m-%d")
+        self._apply_event_change(event["code"], start_date, int(event["days"]))
+        return True
+
+    def add_action(self, action):
+        """Record a split or dividend (corporate_actions.py) and return it."""
+        self.actions.add(action)
+        self._apply_action_change(action)
+        return action
+
+    def remove_action(self, action):
+        """Remove an action added with `add_action`; returns False if not found."""
+        if not self.actions.remove(action):
+            return False
+        self._apply_action_change(action)
+        return True
+
+    def _apply_action_change(self, action):
+        code = action["code"]
+        if self._indicators is not None:
+            self._indicators.invalidate(code)
+        if not self.use_mock_data:
+            # Cached real prices are raw: only the adjusted views change
+            return
+        # Mock raw prices are derived from the actions: drop them from the ex-date on
+        start_str = action["date"]
         try:
-            for i in range(days):
-                d = start_date + datetime.timedelta(days=i)
-                d_str = d.strftime("%Y-%m-%d")
-                if d_str in self.data and code in self.data[d_str]:
+            with self._write_lock:
+                for d_str in [d for d in self.data if d >= start_str and code in self.data[d]]:
                     del self.data[d_str][code]
                     if not self.data[d_str]:
                         del self.data[d_str]
-            self._save_data()
+                if self.store is not None:
+                    self._pending_rows = [r for r in self._pending_rows if r[0] != code or r[1] < start_str]
+                    self.store.delete_prices_from(code, start_str)
+                else:
+                    self._save_data()
+        except Exception as e:
+            print(f"Failed to clear cached prices for corporate action on {code}: {e}")
+
+    def _apply_event_change(self, code, start_date, days):
+        """Re-price ``code`` after its events changed and drop the cached prices they affect."""
+        start_str = start_date.strftime("%Y-%m-%d")
+        if self._indicators is not None:
+            self._indicators.invalidate(code)
+        market = self.market
+        if market is not None:
+            market.set_events(self.events, [code])
+
+        # 为了让事件立即生效，清除该股票在事件区间内的本地价格缓存
+        try:
+            with self._write_lock:
+                cleared = [(start_date + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+                if market is not None:
+                    # Path simulation: the shock also moves every later price of this stock
+                    cleared += [d for d in self.data if d > cleared[-1] and code in self.data[d]]
+                for d_str in cleared:
+                    if d_str in self.data and code in self.data[d_str]:
+                        del self.data[d_str][code]
+                        if not self.data[d_str]:
+                            del self.data[d_str]
+                if self.store is not None and market is not None:
+                    self._pending_rows = [r for r in self._pending_rows if r[0] != code or r[1] < start_str]
+                    self.store.delete_prices_from(code, start_str)
+                elif self.store is not None:
+                    self._pending_rows = [r for r in self._pending_rows if r[0] != code or r[1] not in cleared]
+                    self.store.delete_prices(code, cleared)
+                else:
+                    self._save_data()
         except Exception as e:
             print(f"Failed to clear cached prices for event on {code}: {e}")
 
 class TradeManager:
-    def __init__(self, initial_cash=100000.0):
+    def __init__(self, initial_cash=100000.0, data_file="trade_data.json", storage=None, account="default"):
         # Get the directory of the current file
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
-        self.data_file = os.path.join(self.base_dir, "trade_data.json")
-        self.trade_records = []
+        self.data_file = os.path.join(self.base_dir, data_file)
+        # Optional SQLite backend: only new trades and changed orders are written
+        from storage import get_store
+        self.store = get_store(storage, self.base_dir)
+        self.account = account
+        # What this process last wrote: the seq of each trade of the log, the cash, the orders
+        self._trade_seqs = []
+        self._saved_log = (None, 0)     # (trade store, truncations seen)
+        self._saved_cash = None
+        self._saved_orders = None
+        # Columnar trade log (see trade_store.py); iterates as dict-like records
+        from trade_store import TradeStore
+        self.trade_records = TradeStore()
         self.pending_orders = []
         # Allow customizable starting cash; this may be overridden by saved data in load_data().
         self.initial_cash = float(initial_cash)
         self.cash = float(initial_cash)
         self.portfolio = {}
+        # Lot-level cost basis; `portfolio` mirrors it as {'shares', 'total_cost'} for the UI
+        self.cost_basis_method = "average"
+        self.ledger = PositionLedger(self.cost_basis_method)
+        # Snapshots for "state as of date" queries (checkpoints.py), built on first use
+        self.checkpoints = None
 
         # Trading cost settings（默认值：万分之一手续费、1 美元最低、无滑点）
         self.fee_rate = 0.0001          # 比例手续费（相对于成交金额）
         self.min_fee = 1.0              # 每笔最低手续费
         self.slippage_per_share = 0.0   # 每股滑点（价格偏移）
+        # Cost model extras (costs.py): [(notional, rate)] commission tiers, quoted spread, sqrt market impact
+        self.commission_tiers = []
+        self.spread_bps = 0.0
+        self.impact_coef = 0.0
+        # Largest fraction of a bar's volume filled per ticker and day for pending orders (0 = no limit)
+        self.participation_rate = 0.0
+        # Stock splits (corporate_actions.py): the split level S positions and orders of each code are
+        # expressed in, and the splits applied to positions, with the trade count at the time (for rebuilds)
+        self.split_levels = {}
+        self.splits = []
 
         # Risk & auto-trading settings
         self.stop_loss_pct = 0.0        # 单只股票止损线（亏损百分比，例如 10 表示 -10% 自动卖出）
@@ -351,13 +935,43 @@ class TradeManager:
 
         self.load_data()
 
+    def _read_saved_data(self):
+        """Saved account state in the trade_data.json layout, or None.
+
+        With SQLite, an account that was never saved is migrated from the JSON file.
+        """
+        if self.store is not None:
+            saved = self.store.load_account(self.account)
+            if saved is not None:
+                cash, initial_cash, settings = saved
+                self._trade_seqs, trade_records = self.store.load_trade_rows(self.account)
+                data = dict(settings)
+                data.update({
+                    'cash': cash,
+                    'initial_cash': initial_cash,
+                    'trade_records': trade_records,
+                    'pending_orders': self.store.load_pending_orders(self.account)
+                })
+                self._saved_cash = cash
+                self._saved_orders = json.dumps(data['pending_orders'], ensure_ascii=False)
+                return data
+        if os.path.exists(self.data_file):
+            if self.store is not None:
+                print(f"Importing {self.data_file} into {self.store.path}")
+                self._migrate_json = True
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
     def load_data(self):
         """Load trade data from file"""
-        if os.path.exists(self.data_file):
+        if self.store is not None or os.path.exists(self.data_file):
             try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.trade_records = data.get('trade_records', [])
+                data = self._read_saved_data()
+                if data is not None:
+                    from trade_store import TradeStore
+                    self.trade_records = TradeStore.from_records(data.get('trade_records', []))
+                    self._saved_log = (self.trade_records, 0)
                     self.cash = data.get('cash', self.cash)
                     self.initial_cash = data.get('initial_cash', self.initial_cash)
                     self.portfolio = data.get('portfolio', {})
@@ -367,21 +981,115 @@ class TradeManager:
                     self.fee_rate = data.get('fee_rate', self.fee_rate)
                     self.min_fee = data.get('min_fee', self.min_fee)
                     self.slippage_per_share = data.get('slippage_per_share', self.slippage_per_share)
+                    self.commission_tiers = data.get('commission_tiers', self.commission_tiers)
+                    self.spread_bps = data.get('spread_bps', self.spread_bps)
+                    self.impact_coef = data.get('impact_coef', self.impact_coef)
+                    self.participation_rate = data.get('participation_rate', self.participation_rate)
+                    self.split_levels = data.get('split_levels', {})
+                    self.splits = data.get('splits', [])
                     # 加载风险与自动交易设置
                     self.stop_loss_pct = data.get('stop_loss_pct', self.stop_loss_pct)
                     self.scale_step_pct = data.get('scale_step_pct', self.scale_step_pct)
                     self.scale_fraction_pct = data.get('scale_fraction_pct', self.scale_fraction_pct)
+                    method = data.get('cost_basis_method', self.cost_basis_method)
+                    self.cost_basis_method = method if method in COST_METHODS else "average"
             except Exception as e:
                 print(f"Failed to load data: {str(e)}")
-                self.trade_records = []
+                self.trade_records.clear()
                 self.cash = 100000.0
                 self.portfolio = {}
+        self.rebuild_ledger()
+        if getattr(self, '_migrate_json', False):
+            self._migrate_json = False
+            self.save_data()
+
+    def rebuild_ledger(self, method=None):
+        """Rebuild positions from the trade log (or from the saved portfolio if there are no trades)."""
+        if method is not None:
+            self.cost_basis_method = method
+        self.ledger = PositionLedger(self.cost_basis_method)
+        if self.trade_records:
+            # Splits are applied between the trades they came after
+            start = 0
+            for split in self.splits:
+                self.ledger.replay(self.trade_records, start, split['at'])
+                self.ledger.split(split['code'], split['ratio'], split['price'])
+                start = split['at']
+            self.ledger.replay(self.trade_records, start)
+        else:
+            self.ledger.seed(self.portfolio)
+        self._sync_portfolio()
+
+    def _sync_portfolio(self, codes=None):
+        """Mirror ledger positions into the portfolio dict in place (UI holds a reference)."""
+        if codes is None:
+            self.portfolio.clear()
+            self.portfolio.update(self.ledger.to_portfolio())
+            return
+        for code in codes:
+            pos = self.ledger.position(code)
+            if pos is None:
+                self.portfolio.pop(code, None)
+            else:
+                self.portfolio[code] = {'shares': pos.shares, 'total_cost': pos.cost}
+
+    def _settings_dict(self):
+        return {
+            'portfolio': self.portfolio,
+            'fee_rate': self.fee_rate,
+            'min_fee': self.min_fee,
+            'slippage_per_share': self.slippage_per_share,
+            'commission_tiers': self.commission_tiers,
+            'spread_bps': self.spread_bps,
+            'impact_coef': self.impact_coef,
+            'participation_rate': self.participation_rate,
+            'split_levels': self.split_levels,
+            'splits': self.splits,
+            'stop_loss_pct': self.stop_loss_pct,
+            'scale_step_pct': self.scale_step_pct,
+            'scale_fraction_pct': self.scale_fraction_pct,
+            'cost_basis_method': self.cost_basis_method
+        }
 
+    def _save_to_store(self):
+        """Write only what changed since the last save: new trades, orders if edited, account row.
+
+        Trades undone since then are deleted by their seqs and new ones appended
+        after whatever another process has stored; cash is saved as a change.
+        """
+        from trade_store import RECORD_FIELDS
+        store = self.trade_records
+        n = len(store)
+        saved_store, cuts_seen = self._saved_log
+        if store is saved_store:
+            cuts = store.truncations[cuts_seen:]
+            keep = min(cuts + [len(self._trade_seqs), n])
+            clear = 0 in cuts
+        else:
+            keep = 0    # log replaced (undo of a reset)
+            clear = saved_store is not None
+        new_trades = [tuple(rec[k] for k in RECORD_FIELDS) for rec in store[keep:n]]
+        orders = json.dumps(self.pending_orders, ensure_ascii=False)
+        seqs = self.store.save_account(
+            self.account, self.cash, self.initial_cash, self._settings_dict(),
+            new_trades=new_trades, drop_seqs=self._trade_seqs[keep:],
+            pending_orders=self.pending_orders if orders != self._saved_orders else None,
+            cash_base=self._saved_cash, clear=clear
+        )
+        self._trade_seqs = self._trade_seqs[:keep] + seqs
+        self._saved_log = (store, len(store.truncations))
+        self._saved_cash = self.cash
+        self._saved_orders = orders
+
+    @timed()
     def save_data(self):
         """Save trade data to file"""
         try:
+            if self.store is not None:
+                self._save_to_store()
+                return
             data = {
-                'trade_records': self.trade_records,
+                'trade_records': self.trade_records.to_records(),
                 'cash': self.cash,
                 'initial_cash': self.initial_cash,
                 'portfolio': self.portfolio,
@@ -389,46 +1097,190 @@ class TradeManager:
                 'fee_rate': self.fee_rate,
                 'min_fee': self.min_fee,
                 'slippage_per_share': self.slippage_per_share,
+                'commission_tiers': self.commission_tiers,
+                'spread_bps': self.spread_bps,
+                'impact_coef': self.impact_coef,
+                'participation_rate': self.participation_rate,
+                'split_levels': self.split_levels,
+                'splits': self.splits,
                 'stop_loss_pct': self.stop_loss_pct,
                 'scale_step_pct': self.scale_step_pct,
-                'scale_fraction_pct': self.scale_fraction_pct
+                'scale_fraction_pct': self.scale_fraction_pct,
+                'cost_basis_method': self.cost_basis_method
             }
+            # Compact one-shot encoding: this file grows with every trade and
+            # json.dumps + a single write is much faster than streaming json.dump
+            payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
             with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.write(payload)
         except Exception as e:
             print(f"Failed to save data: {str(e)}")
 
     def add_trade_record(self, date, stock_code, stock_name, trade_type, shares, price, total_amount):
         """Add trade record"""
-        record = {
-            'date': date,
-            'stock_code': stock_code,
-            'stock_name': stock_name,
-            'trade_type': trade_type,
-            'shares': shares,
-            'price': price,
-            'total_amount': total_amount
-        }
-        self.trade_records.append(record)
+        self.trade_records.add(date, stock_code, stock_name, trade_type, shares, price, total_amount)
         self.save_data()
 
     def update_portfolio(self, stock_code, shares, price, trade_type):
-        """Update portfolio information"""
+        """Update portfolio information.
+
+        Sells release cost basis according to `cost_basis_method` (not the sale
+        price), so `total_cost` always reflects the shares still held.
+        Returns the realized P&L of the fill.
+        """
+        pnl = self.ledger.apply_fill(stock_code, trade_type, shares, price)
+        self._sync_portfolio((stock_code,))
+        return pnl
+
+    def execute_fill(self, date, stock_code, stock_name, trade_type, shares, price, total_amount, fee=0.0, save=True):
+        """Record one fill: trade log, position and cash, saved once (``save=False``: the caller saves).
+
+        Returns the ledger snapshot taken before the fill (for `revert_fill`).
+        """
+        before = self.ledger.snapshot(stock_code)
+        self.trade_records.add(date, stock_code, stock_name, trade_type, shares, price, total_amount)
+        self.ledger.apply_fill(stock_code, trade_type, shares, price)
+        self._sync_portfolio((stock_code,))
         if trade_type == 'Buy':
-            if stock_code in self.portfolio:
-                self.portfolio[stock_code]['shares'] += shares
-                self.portfolio[stock_code]['total_cost'] += shares * price
-            else:
-                self.portfolio[stock_code] = {
-                    'shares': shares,
-                    'total_cost': shares * price
-                }
-        else:  # Sell
-            if stock_code in self.portfolio:
-                self.portfolio[stock_code]['shares'] -= shares
-                self.portfolio[stock_code]['total_cost'] -= shares * price
-                if self.portfolio[stock_code]['shares'] == 0:
-                    del self.portfolio[stock_code]
+            self.cash -= (total_amount + fee)
+        else:
+            self.cash += (total_amount - fee)
+        if save:
+            self.save_data()
+        return before
+
+    def revert_fill(self, stock_code, trade_type, shares, total_amount, fee=0.0, before=None):
+        """Undo the newest fill (it must be the last trade record).
+
+        With the `execute_fill` snapshot the position is restored in O(1);
+        without it the ledger is rebuilt from the trade log.
+        """
+        n = len(self.trade_records)
+        last = self.trade_records[n - 1] if n else None
+        if last is None or last['stock_code'] != stock_code or last['trade_type'] != trade_type \
+                or int(last['shares']) != int(shares):
+            raise ValueError(f"The last trade is not the {trade_type} of {shares} {stock_code} being undone")
+        self.trade_records.truncate(n - 1)
+        if trade_type == 'Buy':
+            self.cash += (total_amount + fee)
+        else:
+            self.cash -= (total_amount - fee)
+        if before is not None:
+            self.ledger.restore(stock_code, before)
+            self._sync_portfolio((stock_code,))
+        else:
+            self.rebuild_ledger()
+        self.save_data()
+
+    def apply_split(self, date, stock_code, ratio, price):
+        """Convert the position and pending orders of ``stock_code`` after a split of ``ratio`` new shares per old.
+
+        A fractional share is paid out at ``price`` (cash in lieu). Returns the
+        state needed by `revert_split`.
+        """
+        undo = {
+            'before': self.ledger.snapshot(stock_code),
+            'orders': [[i, dict(o)] for i, o in enumerate(self.pending_orders) if o.get('code') == stock_code],
+            'level': self.split_levels.get(stock_code, 1.0),
+            'logged': self.ledger.shares(stock_code) > 0,
+        }
+        fraction = self.ledger.split(stock_code, ratio, price)
+        self._sync_portfolio((stock_code,))
+        undo['lieu'] = fraction * price
+        self.cash += undo['lieu']
+        for order in self.pending_orders:
+            if order.get('code') == stock_code:
+                order['shares'] = int(order.get('shares', 0) * ratio + 1e-9)
+                order['price'] = round(float(order.get('price', 0)) / ratio, 4)
+                if 'filled' in order:
+                    order['filled'] = int(order['filled'] * ratio + 1e-9)
+        self.pending_orders[:] = [o for o in self.pending_orders if o.get('code') != stock_code or o['shares'] > 0]
+        self.split_levels[stock_code] = undo['level'] * ratio
+        if undo['logged']:
+            self.splits.append({'date': date, 'code': stock_code, 'ratio': ratio, 'price': price,
+                                'at': len(self.trade_records)})
+        self.save_data()
+        return undo
+
+    def revert_split(self, stock_code, undo):
+        """Undo the newest `apply_split` of ``stock_code``."""
+        self.ledger.restore(stock_code, undo['before'])
+        self._sync_portfolio((stock_code,))
+        self.cash -= undo['lieu']
+        orders = self.pending_orders
+        orders[:] = [o for o in orders if o.get('code') != stock_code]
+        for i, order in undo['orders']:
+            orders.insert(i, dict(order))
+        self.split_levels[stock_code] = undo['level']
+        if undo['logged']:
+            self.splits.pop()
+        self.save_data()
+
+    def split_scale(self):
+        """Per trade, the product of the ratios of the splits of its code logged before it."""
+        import numpy as np
+        store = self.trade_records
+        scale = np.ones(len(store))
+        for split in self.splits:
+            code_id = store.code_id(split['code'])
+            if code_id is not None:
+                scale[split['at']:][store.code_ids[split['at']:] == code_id] *= split['ratio']
+        return scale
+
+    def get_position(self, stock_code):
+        """Ledger position (shares, cost, avg_cost, realized, lots) or None."""
+        return self.ledger.position(stock_code)
+
+    def state_at(self, date):
+        """Cash and positions after every trade dated on or before ``date`` (checkpoints.PortfolioState)."""
+        if self.checkpoints is None:
+            from checkpoints import CheckpointIndex
+            self.checkpoints = CheckpointIndex(self)
+        return self.checkpoints.state_at(date)
+
+    def reset(self, initial_cash):
+        """Clear trades and positions and start over with `initial_cash`."""
+        self.trade_records.clear()
+        self.splits = []
+        self.portfolio = {}
+        self.ledger = PositionLedger(self.cost_basis_method)
+        self.initial_cash = float(initial_cash)
+        self.cash = float(initial_cash)
+        self._saved_cash = None     # a reset sets the cash, it does not move it
+        self.save_data()
+
+    def restore_account(self, trade_records, cash, initial_cash, splits=()):
+        """Put back a trade log, its splits and cash saved before `reset` (undo of a reset)."""
+        from trade_store import TradeStore
+        self.trade_records = TradeStore.from_records(trade_records)
+        self.splits = [dict(split) for split in splits]
+        self.portfolio = {}
+        self.initial_cash = float(initial_cash)
+        self.cash = float(cash)
+        self._saved_cash = None
+        self.rebuild_ledger()
+        self.save_data()
+
+    SETTING_KEYS = ('fee_rate', 'min_fee', 'slippage_per_share', 'commission_tiers', 'spread_bps', 'impact_coef',
+                    'participation_rate', 'stop_loss_pct', 'scale_step_pct', 'scale_fraction_pct', 'cost_basis_method')
+
+    def get_settings(self):
+        """Cost, risk and cost basis settings as a plain dict."""
+        settings = {key: getattr(self, key) for key in self.SETTING_KEYS}
+        settings['commission_tiers'] = [list(tier) for tier in self.commission_tiers]
+        return settings
+
+    def apply_settings(self, settings):
+        """Set the given settings (keys of SETTING_KEYS) and save; rebuilds positions if the cost basis changed."""
+        for key, value in settings.items():
+            if key == 'commission_tiers':
+                self.commission_tiers = [[float(n), float(r)] for n, r in value]
+            elif key in self.SETTING_KEYS and key != 'cost_basis_method':
+                setattr(self, key, float(value))
+        method = settings.get('cost_basis_method', self.cost_basis_method)
+        if method != self.cost_basis_method:
+            self.rebuild_ledger(method)
+        self.save_data()
 
     def get_trade_records(self):
         """Get all trade records"""
@@ -465,20 +1317,26 @@ class TradeManager:
             self.cash += (amount - fee)
         self.save_data()
 
-    def calculate_trade_costs(self, price, shares, trade_type):
+    @property
+    def cost_model(self):
+        """costs.CostModel for the current cost settings."""
+        from costs import CostModel
+        return CostModel(
+            fee_rate=self.fee_rate, min_fee=self.min_fee, slippage_per_share=self.slippage_per_share,
+            commission_tiers=self.commission_tiers, spread_bps=self.spread_bps, impact_coef=self.impact_coef
+        )
+
+    def calculate_trade_costs(self, price, shares, trade_type, volume=None):
         """根据当前交易成本设置，计算实际成交价、成交金额和手续费。
 
+        volume: 当日成交量（用于市场冲击，None 表示不计冲击）
         返回: execution_price, gross_amount, fee
         """
-        # 滑点：买入价格向上偏移，卖出价格向下偏移
-        if trade_type == 'Buy':
-            exec_price = price + self.slippage_per_share
-        else:
-            exec_price = max(0.01, price - self.slippage_per_share)
+        return self.cost_model.fill(price, shares, trade_type, volume)
 
-        gross = exec_price * shares
-        fee = max(self.min_fee, abs(gross) * self.fee_rate) if gross > 0 else 0.0
-        return exec_price, gross, fee
+    def price_fills(self, prices, shares, sides, volume=None):
+        """Batch `calculate_trade_costs`: (execution price, gross, fee) arrays for many fills."""
+        return self.cost_model.price(prices, shares, sides, volume)
 
 class StockTradeSimulator:
     def __init__(self, root, use_mock_data=None):
@@ -507,6 +1365,8 @@ class StockTradeSimulator:
         self.use_mock_data = self.data_manager.use_mock_data
         if self.use_mock_data:
             print("Running in mock data mode. Set STOCK_SIM_USE_MOCK=0 to disable.")
+        # Parse the price store in the background while the window is being built
+        self.data_manager.preload_async()
 
         # Ask user for initial cash only when no existing trade data file is present
         initial_cash = 100000.0
@@ -535,35 +1395,53 @@ class StockTradeSimulator:
         
         # Initialize stock data dictionary
         self.stocks = {}
+
+        # Extra strategies.Strategy plugins run after the built-in rules
+        self.custom_strategies = []
+
+        # Warms the neighbouring trading days while the user is idle
+        from prefetch import Prefetcher
+        self.prefetcher = Prefetcher(self.data_manager)
+        self._prefetch_job = None
+
+        # Cross-sectional screener (screener.py), created on first use
+        self.screener = None
+
+        # Operation log for undo/redo and session replay (oplog.py), kept next to the trade data
+        from oplog import OperationLog
+        tm = self.trade_manager
+        self.oplog = OperationLog(os.path.splitext(tm.data_file)[0] + "_oplog.jsonl")
+        if not len(self.oplog):
+            self.oplog.record(
+                "session", cash=tm.cash, initial_cash=tm.initial_cash, settings=tm.get_settings(),
+                portfolio={code: dict(info) for code, info in tm.portfolio.items()}
+            )
         
         # Create UI components first
         self.create_widgets()
-        
-        # Check if local data exists for current date
-        current_date = datetime.datetime.now()
-        date_str = current_date.strftime("%Y-%m-%d")
-        if date_str in self.data_manager.data:
-            # Load data from local
-            self.stocks = {}
-            stock_list = self.data_manager.get_stock_list()
-            for code, name in stock_list.items():
-                if code in self.data_manager.data[date_str]:
-                    stock_data = self.data_manager.data[date_str][code]
-                    self.stocks[code] = {
-                        "name": name,
-                        "price": stock_data["price"],
-                        "change_percent": stock_data["change_percent"]
-                    }
-            self.update_stock_listbox()
-            # Automatically select first stock
-            self.select_first_stock()
-        else:
-            # If no local data, load from network
-            self.show_loading(self._loading_message())
-            self.load_stocks()
+        self._update_history_buttons()
+
+        # Load prices once the window is up instead of blocking before it appears
+        self.root.after(10, self._initial_load)
+
+    def _initial_load(self):
+        """Load today's stock data (cache or network) and refresh the account display."""
+        self.show_loading(self._loading_message())
+        self.load_stocks()
 
         # Update portfolio and asset display
         self.update_assets()
+        self._schedule_prefetch()
+
+    def _schedule_prefetch(self):
+        """Warm the adjacent trading days once the user has stayed on the current date for a moment."""
+        if self._prefetch_job is not None:
+            self.root.after_cancel(self._prefetch_job)
+
+        def start():
+            self._prefetch_job = None
+            self.prefetcher.schedule(self.current_date, list(self.data_manager.get_stock_list()))
+        self._prefetch_job = self.root.after(PREFETCH_IDLE_MS, start)
 
     def _loading_message(self, action="Loading", current=None, total=None):
         """Build contextual loading text"""
@@ -600,16 +1478,23 @@ class StockTradeSimulator:
 
     def hide_loading(self):
         """Hide loading window"""
-        if hasattr(self, 'loading_window'):
+        if getattr(self, 'loading_window', None) is not None:
             self.progress.stop()
             self.loading_window.destroy()
+            self.loading_window = None
 
-    def load_stocks(self, target_date=None):
-        """Load stock data"""
+    def _set_loading_text(self, text):
+        """Update the loading dialog's message if one is showing."""
+        if getattr(self, 'loading_window', None) is not None:
+            self.loading_label.config(text=text)
+
+    def load_stocks(self, target_date=None, run_engine=True):
+        """Load stock data (``run_engine=False`` skips pending order execution, e.g. when undoing)"""
+        @timed("StockTradeSimulator.load_stocks")
         def load_data(target_date):
             try:
                 # Update loading message
-                self.loading_label.config(text=self._loading_message("Loading"))
+                self._set_loading_text(self._loading_message("Loading"))
                 
                 # Get stock list
                 self.stocks = {}
@@ -618,33 +1503,25 @@ class StockTradeSimulator:
                 # Ensure valid target date
                 if target_date is None:
                     target_date = datetime.datetime.now()
+                # 非交易日（周末/节假日）使用上一个交易日的行情
+                target_date = self.data_manager.session_date(target_date)
                 
                 # Check if local data exists for this date
                 date_str = target_date.strftime("%Y-%m-%d")
-                if date_str in self.data_manager.data:
-                    # Load data from local
-                    for code, name in stock_list.items():
-                        if code in self.data_manager.data[date_str]:
-                            stock_data = self.data_manager.data[date_str][code]
-                            self.stocks[code] = {
-                                "name": name,
-                                "price": stock_data["price"],
-                                "change_percent": stock_data["change_percent"]
-                            }
-                    self.root.after(0, self.update_stock_listbox)
-                    # Automatically select first stock
-                    self.root.after(0, self.select_first_stock)
-                    return
-                
-                # If no local data, fetch from network
-                self.loading_label.config(text=self._loading_message("Fetching"))
-                total_stocks = len(stock_list)
-                for i, (code, name) in enumerate(stock_list.items()):
-                    # Update loading message
-                    self.loading_label.config(text=self._loading_message("Fetching", current=i+1, total=total_stocks))
-                    
-                    # Get stock data
-                    stock_data = self.data_manager.get_stock_data(code, target_date)
+                cached_day = self.data_manager.get_cached_day(date_str)
+                # Only stocks without a cached price are fetched: a day can be partial after a
+                # cancelled prefetch or a price import of a few tickers
+                missing = [code for code in stock_list if code not in cached_day]
+                if missing:
+                    self._set_loading_text(self._loading_message("Fetching"))
+                fetched = 0
+                for code, name in stock_list.items():
+                    stock_data = cached_day.get(code)
+                    if stock_data is None:
+                        # Update loading message
+                        fetched += 1
+                        self._set_loading_text(self._loading_message("Fetching", current=fetched, total=len(missing)))
+                        stock_data = self.data_manager.get_stock_data(code, target_date)
                     
                     if stock_data is not None:
                         self.stocks[code] = {
@@ -662,9 +1539,10 @@ class StockTradeSimulator:
                 
                 # Update listbox
                 self.root.after(0, self.update_stock_listbox)
-                # Automatically select first stock
+                # Keep the selected stock (or select the first one)
                 self.root.after(0, self.select_first_stock)
-                self.root.after(0, self.process_pending_orders)
+                if run_engine:
+                    self.root.after(0, self.process_pending_orders)
                 
             except Exception as e:
                 print(f"Failed to load stock data: {str(e)}")
@@ -677,9 +1555,10 @@ class StockTradeSimulator:
                     "NVDA": {"name": "NVIDIA", "price": 450.0, "change_percent": -2.1}
                 }
                 self.root.after(0, self.update_stock_listbox)
-                # Automatically select first stock
+                # Keep the selected stock (or select the first one)
                 self.root.after(0, self.select_first_stock)
-                self.root.after(0, self.process_pending_orders)
+                if run_engine:
+                    self.root.after(0, self.process_pending_orders)
             
             finally:
                 # Hide loading window
@@ -690,110 +1569,99 @@ class StockTradeSimulator:
         thread.start()
 
     def select_first_stock(self):
-        """Select first stock and show its information"""
+        """Keep the selected stock after a (re)load, or select the first one, and show its information"""
         if self.stocks:
-            # Clear current selection
-            self.stock_listbox.selection_clear(0, tk.END)
-            # Select first stock
-            self.stock_listbox.selection_set(0)
+            self._restore_selection()
             # Show stock information
             self.show_stock_details()
 
     def update_stock_listbox(self):
-        """Update stock listbox"""
-        self.stock_listbox.delete(0, tk.END)
-        for code in self.stocks:
-            name = self.stocks[code]['name']
-            # Use tab for alignment
-            display_text = f"{code:<6} | {name}"
-            self.stock_listbox.insert(tk.END, display_text)
+        """Update the quote board (only the visible rows are redrawn)"""
+        self.quote_board.set_quotes(self.stocks)
+
+    def selected_code(self):
+        """Code of the stock selected in the quote board, or None."""
+        code = self.quote_board.selected_code()
+        return code if code in self.stocks else None
+
+    def _restore_selection(self):
+        """Keep the selected stock after a reload, or fall back to the first row."""
+        if not self.quote_board.select_code(self.quote_board.selected_code()):
+            self.quote_board.select_index(0)
 
     # ----------------------- Auto trading rules -----------------------
+    def _strategy_context(self):
+        """Universe arrays (prices, positions, cost basis) for the strategy engine."""
+        import numpy as np
+        from strategies import StrategyContext
+
+        codes = list(self.stocks)
+        index = {code: i for i, code in enumerate(codes)}
+        prices = np.fromiter((s['price'] for s in self.stocks.values()), dtype=float, count=len(codes))
+        positions = np.zeros(len(codes), dtype=np.int64)
+        cost = np.zeros(len(codes))
+        for code, info in self.portfolio.items():
+            i = index.get(code)
+            if i is not None:
+                positions[i] = info['shares']
+                cost[i] = info['total_cost']
+        # Indicators requested by custom strategies: value as of today's close, like ``prices``
+        indicators = {}
+        for strategy in self.custom_strategies:
+            for spec in strategy.indicators:
+                spec = tuple(spec)
+                if spec not in indicators:
+                    indicators[spec] = self.data_manager.indicators.latest(codes, spec, self.current_date,
+                                                                           include_end=True)
+        return StrategyContext(self.current_date, codes, prices, positions, cost, self.cash, indicators)
+
     def apply_auto_trading_rules(self):
-        """Apply stop-loss and scale in/out rules when date changes."""
+        """Apply stop-loss and scale in/out rules (plus any custom strategies) when date changes."""
         tm = self.trade_manager
         # 如果没有开启任何规则，直接返回
-        if (tm.stop_loss_pct <= 0) and (tm.scale_step_pct <= 0 or tm.scale_fraction_pct <= 0):
+        rules_on = tm.stop_loss_pct > 0 or (tm.scale_step_pct > 0 and tm.scale_fraction_pct > 0)
+        if not rules_on and not self.custom_strategies:
             return
 
-        if not self.stocks or not self.portfolio:
+        if not self.stocks:
+            return
+        if not self.portfolio and not self.custom_strategies:
             return
 
-        actions = []
-        date_str = self.current_date.strftime('%Y-%m-%d')
-
-        for stock_code, info in list(self.portfolio.items()):
-            if stock_code not in self.stocks:
-                continue
-            shares = info['shares']
-            if shares <= 0:
-                continue
-
-            cost = info['total_cost']
-            if cost <= 0:
-                continue
-
-            current_price = self.stocks[stock_code]['price']
-            current_value = current_price * shares
-            pnl_pct = (current_value - cost) / cost * 100.0
-
-            # 止损规则：亏损超过阈值，直接全仓卖出
-            if tm.stop_loss_pct > 0 and pnl_pct <= -tm.stop_loss_pct:
-                actions.append(('Sell', stock_code, shares, current_price, 'Auto Stop-Loss'))
-                # 一旦触发止损，就不再对这只股票做分批调整
-                continue
+        from strategies import default_engine
 
-            # 分批加减仓规则
-            if tm.scale_step_pct > 0 and tm.scale_fraction_pct > 0:
-                step = tm.scale_step_pct
-                frac = tm.scale_fraction_pct / 100.0
-                scale_shares = max(1, int(shares * frac))
+        # 内置规则优先（止损先于分批加减仓），自定义策略随后
+        engine = default_engine(tm.stop_loss_pct, tm.scale_step_pct, tm.scale_fraction_pct)
+        for strategy in self.custom_strategies:
+            engine.add(strategy)
+        ctx = self._strategy_context()
+        orders, source = engine.evaluate(ctx)
 
-                if pnl_pct >= step and shares - scale_shares > 0:
-                    # 盈利超过阈值 → 分批减仓
-                    actions.append(('Sell', stock_code, scale_shares, current_price, 'Auto Scale-Out'))
-                elif pnl_pct <= -step:
-                    # 亏损但尚未触发止损 → 分批加仓
-                    actions.append(('Buy', stock_code, scale_shares, current_price, 'Auto Scale-In'))
+        date_str = self.current_date.strftime('%Y-%m-%d')
+        rows = orders.nonzero()[0]
+        codes = [ctx.codes[i] for i in rows.tolist()]
+        quotes = ctx.prices[rows]
+        # 一次性计算全部成交的交易成本
+        exec_prices, grosses, fees = tm.price_fills(quotes, orders[rows], orders[rows], self._fill_volumes(codes, quotes))
 
         executed = 0
-        for trade_type, code, shares, base_price, reason in actions:
+        for k, (i, code) in enumerate(zip(rows.tolist(), codes)):
+            qty = int(orders[i])
+            trade_type = 'Buy' if qty > 0 else 'Sell'
+            shares, base_price, reason = abs(qty), float(quotes[k]), engine.label(source[i])
+            exec_price, gross, fee = float(exec_prices[k]), float(grosses[k]), float(fees[k])
             stock_name = self.stocks[code]['name']
-            # 计算交易成本
-            exec_price, gross, fee = tm.calculate_trade_costs(base_price, shares, trade_type)
 
             if trade_type == 'Buy':
                 # 现金是否足够
                 if gross + fee > self.cash:
                     continue
-                # 记录
-                tm.add_trade_record(
-                    date_str,
-                    code,
-                    stock_name,
-                    'Buy',
-                    shares,
-                    exec_price,
-                    gross
-                )
-                tm.update_portfolio(code, shares, exec_price, 'Buy')
-                tm.update_cash(gross, 'Buy', fee=fee)
             else:
                 # 检查持仓是否足够
                 if code not in self.portfolio or self.portfolio[code]['shares'] < shares:
                     continue
-                tm.add_trade_record(
-                    date_str,
-                    code,
-                    stock_name,
-                    'Sell',
-                    shares,
-                    exec_price,
-                    gross
-                )
-                tm.update_portfolio(code, shares, exec_price, 'Sell')
-                tm.update_cash(gross, 'Sell', fee=fee)
-
+            self._execute_fill(code, stock_name, trade_type, shares, base_price, exec_price, gross, fee,
+                               engine=True, reason=reason)
             executed += 1
 
         if executed > 0:
@@ -895,10 +1763,8 @@ class StockTradeSimulator:
 
         def save_universe_to_file():
             """Persist current stock_list to stock_list.json and reload stocks."""
-            path = os.path.join(self.data_manager.base_dir, "stock_list.json")
             try:
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(self.data_manager.stock_list, f, ensure_ascii=False, indent=2)
+                self.data_manager.save_stock_list()
                 messagebox.showinfo("Success", "Stock universe saved. Reloading stock data...")
                 # After updating universe, reload stocks for current date
                 self.show_loading(self._loading_message())
@@ -1020,6 +1886,7 @@ class StockTradeSimulator:
         self.date_label.pack(pady=5, padx=5)
 
         # Create calendar widget
+        from tkcalendar import Calendar
         self.calendar = Calendar(
             date_frame,
             selectmode='day',
@@ -1111,29 +1978,32 @@ class StockTradeSimulator:
             pady=2
         ).pack(side=tk.RIGHT, padx=5)
 
-        # Create stock list
-        self.stock_listbox = tk.Listbox(
-            list_frame,
+        tk.Button(
+            header_frame,
+            text="Screener",
+            command=self.open_screener,
             bg=self.panel_bg,
             fg=self.text_color,
-            font=('Segoe UI', 12),
-            selectbackground=self.hover_color,
-            selectforeground=self.text_color,
-            activestyle='none',
-            highlightthickness=0,
+            font=('Segoe UI', 10, 'bold'),
             relief='flat',
             borderwidth=0,
-            height=10,
-            selectmode='single'
-        )
-        self.stock_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
-        self.stock_listbox.bind("<<ListboxSelect>>", self.show_stock_details)
+            cursor='hand2',
+            padx=8,
+            pady=2
+        ).pack(side=tk.RIGHT, padx=5)
 
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=5)
-        self.stock_listbox.config(yscrollcommand=scrollbar.set)
-        scrollbar.config(command=self.stock_listbox.yview)
+        # Create stock list (virtualized quote board with search and sorting)
+        from quote_board import QuoteBoard
+        self.quote_board = QuoteBoard(
+            list_frame,
+            on_select=self.show_stock_details,
+            bg=self.panel_bg,
+            fg=self.text_color,
+            select_bg=self.hover_color,
+            up_color=self.danger_color,
+            down_color=self.success_color
+        )
+        self.quote_board.pack(fill=tk.BOTH, expand=True)
 
         # Create trade frame
         trade_frame = tk.Frame(left_frame, bg=self.bg_color)
@@ -1244,6 +2114,20 @@ class StockTradeSimulator:
             cursor='hand2',
             padx=8,
             pady=4
+        ).pack(side=tk.LEFT, padx=(0, 4))
+
+        tk.Button(
+            settings_frame,
+            text="Split / Dividend",
+            command=self.add_corporate_action,
+            bg=self.panel_bg,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold'),
+            relief='flat',
+            borderwidth=0,
+            cursor='hand2',
+            padx=8,
+            pady=4
         ).pack(side=tk.LEFT, padx=(0, 0))
 
         # Performance metrics panel (left column, under Trade Shares)
@@ -1280,26 +2164,37 @@ class StockTradeSimulator:
         )
         self.metric_sharpe.pack(anchor='w')
 
+        self.metric_sortino = tk.Label(
+            metrics_frame, text="Sortino / Calmar: --", font=('Segoe UI', 11),
+            bg=self.panel_bg, fg=self.text_color, anchor='w'
+        )
+        self.metric_sortino.pack(anchor='w')
+
         self.metric_win_rate = tk.Label(
             metrics_frame, text="Win Rate / PF: --", font=('Segoe UI', 11),
             bg=self.panel_bg, fg=self.text_color, anchor='w'
         )
         self.metric_win_rate.pack(anchor='w')
 
-        # Equity curve chart (compact)
+        tk.Button(
+            perf_panel,
+            text="Monte Carlo Outlook",
+            command=self.run_monte_carlo,
+            bg=self.panel_bg,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold'),
+            relief='flat',
+            borderwidth=0,
+            cursor='hand2',
+            padx=8,
+            pady=4
+        ).pack(anchor='w', padx=6, pady=(0, 4))
+
+        # Equity curve chart (compact); the figure is created on first draw
         self.equity_canvas = None
         if MATPLOTLIB_AVAILABLE:
-            self.equity_fig = Figure(figsize=(3.6, 1.8), dpi=100)
-            self.equity_ax = self.equity_fig.add_subplot(111)
-            self.equity_ax.set_title("Equity Curve", fontsize=10)
-            self.equity_ax.grid(True, linestyle='--', alpha=0.3)
-            self.equity_ax.tick_params(axis='x', labelrotation=30, labelsize=8)
-            self.equity_ax.tick_params(axis='y', labelsize=8)
-
-            equity_container = tk.Frame(perf_panel, bg=self.panel_bg)
-            equity_container.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 8))
-            self.equity_canvas = FigureCanvasTkAgg(self.equity_fig, master=equity_container)
-            self.equity_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+            self.equity_container = tk.Frame(perf_panel, bg=self.panel_bg)
+            self.equity_container.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 8))
         else:
             tk.Label(
                 perf_panel,
@@ -1502,6 +2397,38 @@ class StockTradeSimulator:
         )
         self.reset_button.pack(anchor='w', padx=10, pady=(4, 8))
 
+        # Undo / redo of trades, orders, date changes, events and settings (oplog.py)
+        history_frame = tk.Frame(asset_info_frame, bg=self.panel_bg)
+        history_frame.pack(anchor='w', padx=10, pady=(0, 8))
+        self.undo_button = tk.Button(
+            history_frame,
+            text="Undo",
+            command=self.undo,
+            bg=self.panel_bg,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold'),
+            relief='flat',
+            borderwidth=0,
+            cursor='hand2',
+            padx=10,
+            pady=4
+        )
+        self.undo_button.pack(side=tk.LEFT, padx=(0, 4))
+        self.redo_button = tk.Button(
+            history_frame,
+            text="Redo",
+            command=self.redo,
+            bg=self.panel_bg,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold'),
+            relief='flat',
+            borderwidth=0,
+            cursor='hand2',
+            padx=10,
+            pady=4
+        )
+        self.redo_button.pack(side=tk.LEFT)
+
         # Performance metrics moved to left column under Trade Shares
 
         # K-line (candlestick) chart frame
@@ -1518,30 +2445,25 @@ class StockTradeSimulator:
             anchor='w'
         ).pack(anchor='w', padx=10, pady=5)
 
+        # Indicator overlay selector
+        overlay_row = tk.Frame(chart_frame, bg=self.panel_bg)
+        overlay_row.pack(anchor='w', padx=10)
+        tk.Label(overlay_row, text="Overlay:", bg=self.panel_bg, fg=self.text_color).pack(side=tk.LEFT)
+        self.overlay_var = tk.StringVar(value="None")
+        overlay_box = ttk.Combobox(
+            overlay_row, textvariable=self.overlay_var, values=list(KLINE_OVERLAYS), state='readonly', width=16
+        )
+        overlay_box.pack(side=tk.LEFT, padx=5)
+        overlay_box.bind('<<ComboboxSelected>>', lambda e: self.kline_code and self.update_kline_chart(self.kline_code))
+        self.kline_code = None
+
         self.chart_container = tk.Frame(chart_frame, bg=self.panel_bg)
         self.chart_container.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+        # The K-line figure is created when the first chart is shown
         self.kline_canvas = None
 
-        if MATPLOTLIB_AVAILABLE:
-            # Initialize a figure with two subplots: upper for price K-line (higher), lower for volume bars (lower)
-            self.kline_figure = Figure(figsize=(6, 4), dpi=100)
-            # 使用 GridSpec 控制高度比例：价格图 : 成交量图 = 3 : 1
-            gs = self.kline_figure.add_gridspec(4, 1, hspace=0.05)
-            self.kline_ax = self.kline_figure.add_subplot(gs[:3, 0])
-            self.volume_ax = self.kline_figure.add_subplot(gs[3, 0], sharex=self.kline_ax)
-
-            self.kline_ax.set_ylabel("Price")
-            self.kline_ax.grid(True, linestyle='--', alpha=0.3)
-            # 只在底部子图显示日期刻度
-            self.kline_ax.tick_params(labelbottom=False)
-
-            self.volume_ax.set_ylabel("Volume")
-            self.volume_ax.grid(True, linestyle='--', alpha=0.3)
-
-            self.kline_canvas = FigureCanvasTkAgg(self.kline_figure, master=self.chart_container)
-            self.kline_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        else:
+        if not MATPLOTLIB_AVAILABLE:
             tk.Label(
                 self.chart_container,
                 text="matplotlib not installed. Install it to enable K-line chart.",
@@ -1566,6 +2488,19 @@ class StockTradeSimulator:
             bg=self.panel_bg,
             fg=self.text_color
         ).pack(pady=5)
+
+        # 勾选后显示当前所选日期时的持仓（基于检查点快速回放交易记录）
+        self.portfolio_as_of_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            portfolio_frame,
+            text="Holdings as of selected date",
+            variable=self.portfolio_as_of_var,
+            command=self.update_portfolio_table,
+            bg=self.panel_bg,
+            fg=self.text_color,
+            activebackground=self.panel_bg,
+            font=('Segoe UI', 9)
+        ).pack(anchor='w', padx=5)
         
         # Create portfolio table
         columns = ('stock_code', 'stock_name', 'shares', 'cost', 'current_value', 'profit')
@@ -1647,8 +2582,11 @@ class StockTradeSimulator:
         for item in self.portfolio_tree.get_children():
             self.portfolio_tree.delete(item)
         
-        # Add new records
-        for stock_code, info in self.portfolio.items():
+        # Add new records (optionally the holdings on the selected date, see checkpoints.py)
+        portfolio = self.portfolio
+        if self.portfolio_as_of_var.get():
+            portfolio = self.trade_manager.state_at(self.current_date).portfolio
+        for stock_code, info in portfolio.items():
             if stock_code in self.stocks:
                 stock = self.stocks[stock_code]
                 shares = info['shares']
@@ -1669,10 +2607,8 @@ class StockTradeSimulator:
 
     def show_stock_details(self, event=None):
         """Show selected stock details"""
-        selection = self.stock_listbox.curselection()
-        if selection:
-            index = selection[0]
-            code = self.stock_listbox.get(index).split()[0]
+        code = self.selected_code()
+        if code:
             stock = self.stocks[code]
 
             # Update stock info labels
@@ -1712,11 +2648,10 @@ class StockTradeSimulator:
 
     def place_pending_order(self):
         try:
-            selection = self.stock_listbox.curselection()
-            if not selection:
+            code = self.selected_code()
+            if not code:
                 messagebox.showerror("Error", "Please select a stock first.")
                 return
-            code = self.stock_listbox.get(selection[0]).split()[0]
             stock = self.stocks.get(code)
             if not stock:
                 messagebox.showerror("Error", "Stock data not available.")
@@ -1755,9 +2690,11 @@ class StockTradeSimulator:
                 "status": "open",
                 "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
+            self._mark_split_level(code)
             self.pending_orders.append(order)
             self.trade_manager.pending_orders = self.pending_orders
             self.trade_manager.save_data()
+            self._record_op("place_order", order=dict(order))
             self.refresh_pending_orders_table()
             messagebox.showinfo("Order Placed", f"{otype.replace('_', ' ').title()} {side} order placed for {code}.")
         except Exception as e:
@@ -1769,83 +2706,118 @@ class StockTradeSimulator:
             if not selection:
                 return
             oid = selection[0]
+            index = next((i for i, o in enumerate(self.pending_orders) if o.get("id") == oid), None)
+            if index is None:
+                return
+            order = self.pending_orders[index]
             self.pending_orders = [o for o in self.pending_orders if o.get("id") != oid]
             self.trade_manager.pending_orders = self.pending_orders
             self.trade_manager.save_data()
+            self._record_op("cancel_order", order=dict(order), index=index)
             self.refresh_pending_orders_table()
         except Exception as e:
             print(f"Failed to cancel order: {e}")
 
+    @timed()
     def process_pending_orders(self):
-        """Process open limit/stop orders based on current prices."""
+        """Process open limit/stop orders based on current prices.
+
+        With a participation rate, fills per ticker and day are capped at that
+        share of the bar volume and the rest of an order stays pending
+        (order_matching.py).
+        """
         if not self.pending_orders or not self.stocks:
             return
+        import numpy as np
+        from order_matching import OrderBook, after_fill, daily_capacity, traded_shares
+
+        tm = self.trade_manager
+        book = OrderBook(self.pending_orders)
+        quotes = np.array([self.stocks[c]["price"] if c in self.stocks else np.nan for c in book.codes], dtype=float)
+        hit = book.triggered(quotes)
+        if not hit.any():
+            return
+        volume = None
+        capacity = None
+        if tm.participation_rate > 0:
+            # Volume and today's traded shares once per ticker, not per order
+            volume = np.full(len(book.codes), np.nan)
+            for j in np.unique(book.code_ix[hit]).tolist():
+                volume[j] = self.data_manager.bar_volume(book.codes[j], self.current_date, float(quotes[j]))
+            capacity = daily_capacity(volume, tm.participation_rate,
+                                      traded_shares(tm.trade_records, self.current_date, book.codes))
+        fills = book.allocate(hit, capacity)
+        rows = np.flatnonzero(fills > 0)
+        if not len(rows):
+            return
+
+        # Price every fill in one batch
+        ix = book.code_ix[rows]
+        codes = [book.codes[j] for j in ix.tolist()]
+        if volume is None or tm.impact_coef <= 0:
+            fill_volume = self._fill_volumes(codes, quotes[ix])
+        else:
+            fill_volume = volume[ix]
+        exec_prices, grosses, fees = tm.price_fills(quotes[ix], fills[rows], book.buy[rows], fill_volume)
+        costs = {int(i): (int(fills[i]), float(p), float(g), float(f))
+                 for i, p, g, f in zip(rows.tolist(), exec_prices, grosses, fees)}
+
+        def price_one(i, shares):
+            """Cost of one fill whose size differs from the batch allocation."""
+            j = int(book.code_ix[i])
+            if volume is None or tm.impact_coef <= 0:
+                vol = self._fill_volumes([book.codes[j]], quotes[[j]])
+            else:
+                vol = volume[[j]]
+            p, g, f = tm.price_fills(quotes[[j]], np.array([shares]), book.buy[[i]], vol)
+            return shares, float(p[0]), float(g[0]), float(f[0])
+
+        # Capacity left per ticker: an order skipped for cash or holdings hands its share to later orders
+        left = None if capacity is None else np.array(capacity, dtype=float)
         updated = False
-        executed = 0
+        executed = partial = 0
         remaining = []
-        for order in list(self.pending_orders):
-            code = order.get("code")
-            if code not in self.stocks:
+        for i, order in enumerate(list(self.pending_orders)):
+            if not hit[i]:
                 remaining.append(order)
                 continue
-            current_price = self.stocks[code]["price"]
-            trigger_price = float(order.get("price", 0))
-            shares = int(order.get("shares", 0))
-            side = order.get("side", "Buy")
-            otype = order.get("type", "limit")
-
-            should_exec = False
-            if otype == "limit":
-                if side == "Buy" and current_price <= trigger_price:
-                    should_exec = True
-                if side == "Sell" and current_price >= trigger_price:
-                    should_exec = True
-            elif otype == "stop_loss":
-                if side == "Sell" and current_price <= trigger_price:
-                    should_exec = True
-            elif otype == "take_profit":
-                if side == "Sell" and current_price >= trigger_price:
-                    should_exec = True
-
-            if not should_exec:
+            j = int(book.code_ix[i])
+            shares = int(book.shares[i]) if left is None else int(min(book.shares[i], left[j]))
+            if shares <= 0:
                 remaining.append(order)
                 continue
+            code = order["code"]
+            current_price = self.stocks[code]["price"]
+            side = order.get("side", "Buy")
 
             # Execute
             try:
-                exec_price, gross, fee = self.trade_manager.calculate_trade_costs(current_price, shares, side)
+                cost = costs.get(i)
+                shares, exec_price, gross, fee = cost if cost and cost[0] == shares else price_one(i, shares)
+                # Cash and holdings as of the fills already made in this pass
                 if side == "Buy":
-                    if gross + fee > self.cash:
+                    if gross + fee > tm.get_cash():
                         remaining.append(order)  # keep pending if insufficient cash
                         continue
-                    self.trade_manager.add_trade_record(
-                        self.current_date.strftime('%Y-%m-%d'),
-                        code,
-                        order.get("name", code),
-                        'Buy',
-                        shares,
-                        exec_price,
-                        gross
-                    )
-                    self.trade_manager.update_portfolio(code, shares, exec_price, 'Buy')
-                    self.trade_manager.update_cash(gross, 'Buy', fee=fee)
                 else:  # Sell
-                    if code not in self.portfolio or self.portfolio[code]['shares'] < shares:
+                    held = tm.get_portfolio().get(code)
+                    if held is None or held['shares'] < shares:
                         remaining.append(order)  # keep pending if not enough shares
                         continue
-                    self.trade_manager.add_trade_record(
-                        self.current_date.strftime('%Y-%m-%d'),
-                        code,
-                        order.get("name", code),
-                        'Sell',
-                        shares,
-                        exec_price,
-                        gross
-                    )
-                    self.trade_manager.update_portfolio(code, shares, exec_price, 'Sell')
-                    self.trade_manager.update_cash(gross, 'Sell', fee=fee)
-
-                executed += 1
+                if shares < int(order.get("shares", 0)):
+                    # Partial fill: the rest stays in the queue at the same place
+                    self._execute_fill(code, order.get("name", code), side, shares, current_price, exec_price, gross,
+                                       fee, engine=True, save=False, order=dict(order), partial=True)
+                    order.update(after_fill(order, shares))
+                    remaining.append(order)
+                    partial += 1
+                else:
+                    # order_index: where the order goes back when the fill is undone
+                    self._execute_fill(code, order.get("name", code), side, shares, current_price, exec_price, gross,
+                                       fee, engine=True, save=False, order=dict(order), order_index=len(remaining))
+                    executed += 1
+                if left is not None:
+                    left[j] -= shares
                 updated = True
             except Exception as e:
                 print(f"Failed to execute order {order.get('id')}: {e}")
@@ -1853,22 +2825,27 @@ class StockTradeSimulator:
 
         if updated:
             self.pending_orders = remaining
-            self.trade_manager.pending_orders = self.pending_orders
-            self.trade_manager.save_data()
-            self.cash = self.trade_manager.get_cash()
-            self.portfolio = self.trade_manager.get_portfolio()
+            tm.pending_orders = self.pending_orders
+            tm.save_data()
+            self.cash = tm.get_cash()
+            self.portfolio = tm.get_portfolio()
             self.update_assets()
             self.load_trade_records()
             self.update_portfolio_table()
             self.refresh_pending_orders_table()
-            if executed > 0:
-                messagebox.showinfo("Orders Executed", f"{executed} order(s) executed based on current prices.")
+            if executed > 0 or partial > 0:
+                message = f"{executed} order(s) executed based on current prices."
+                if partial:
+                    message += f"\n{partial} order(s) partially filled (volume limit); the rest stays pending."
+                messagebox.showinfo("Orders Executed", message)
 
     def open_trading_settings(self):
-        """Open a dialog to configure trading cost settings (fee rate, min fee, slippage)."""
+        """Open a dialog to configure trading cost settings (fee rate, min fee, slippage, spread, impact)."""
+        from costs import format_tiers, parse_tiers
+
         manager = tk.Toplevel(self.root)
         manager.title("Trading Settings")
-        manager.geometry("360x220")
+        manager.geometry("460x610")
         manager.transient(self.root)
         manager.grab_set()
 
@@ -1919,6 +2896,54 @@ class StockTradeSimulator:
         slippage_entry = tk.Entry(frame, textvariable=slippage_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
         slippage_entry.grid(row=3, column=1, sticky='w', pady=2)
 
+        tk.Label(
+            frame,
+            text="Bid/ask spread (bps):",
+            bg=self.bg_color,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold')
+        ).grid(row=4, column=0, sticky='e', pady=2, padx=(0, 5))
+
+        spread_var = tk.StringVar(value=f"{self.trade_manager.spread_bps:.2f}")
+        spread_entry = tk.Entry(frame, textvariable=spread_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
+        spread_entry.grid(row=4, column=1, sticky='w', pady=2)
+
+        tk.Label(
+            frame,
+            text="Impact coefficient:",
+            bg=self.bg_color,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold')
+        ).grid(row=5, column=0, sticky='e', pady=2, padx=(0, 5))
+
+        impact_var = tk.StringVar(value=f"{self.trade_manager.impact_coef:.4f}")
+        impact_entry = tk.Entry(frame, textvariable=impact_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
+        impact_entry.grid(row=5, column=1, sticky='w', pady=2)
+
+        tk.Label(
+            frame,
+            text="Commission tiers (notional:rate, ...; empty = flat fee rate):",
+            bg=self.bg_color,
+            fg=self.text_color,
+            font=('Segoe UI', 10)
+        ).grid(row=6, column=0, columnspan=2, sticky='w', pady=(8, 2))
+
+        tiers_var = tk.StringVar(value=format_tiers(self.trade_manager.commission_tiers))
+        tiers_entry = tk.Entry(frame, textvariable=tiers_var, width=36, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
+        tiers_entry.grid(row=7, column=0, columnspan=2, sticky='w', pady=2)
+
+        tk.Label(
+            frame,
+            text="Participation (max fraction of bar volume, 0 = no limit):",
+            bg=self.bg_color,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold')
+        ).grid(row=8, column=0, sticky='e', pady=2, padx=(0, 5))
+
+        participation_var = tk.StringVar(value=f"{self.trade_manager.participation_rate:.4f}")
+        participation_entry = tk.Entry(frame, textvariable=participation_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
+        participation_entry.grid(row=8, column=1, sticky='w', pady=2)
+
         # Risk & auto-trading settings
         tk.Label(
             frame,
@@ -1926,7 +2951,7 @@ class StockTradeSimulator:
             bg=self.bg_color,
             fg=self.text_color,
             font=('Segoe UI', 10)
-        ).grid(row=4, column=0, columnspan=2, sticky='w', pady=(8, 2))
+        ).grid(row=9, column=0, columnspan=2, sticky='w', pady=(8, 2))
 
         tk.Label(
             frame,
@@ -1934,11 +2959,11 @@ class StockTradeSimulator:
             bg=self.bg_color,
             fg=self.text_color,
             font=('Segoe UI', 10, 'bold')
-        ).grid(row=5, column=0, sticky='e', pady=2, padx=(0, 5))
+        ).grid(row=10, column=0, sticky='e', pady=2, padx=(0, 5))
 
         stop_loss_var = tk.StringVar(value=f"{self.trade_manager.stop_loss_pct:.2f}")
         stop_loss_entry = tk.Entry(frame, textvariable=stop_loss_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
-        stop_loss_entry.grid(row=5, column=1, sticky='w', pady=2)
+        stop_loss_entry.grid(row=10, column=1, sticky='w', pady=2)
 
         tk.Label(
             frame,
@@ -1946,7 +2971,7 @@ class StockTradeSimulator:
             bg=self.bg_color,
             fg=self.text_color,
             font=('Segoe UI', 10)
-        ).grid(row=6, column=0, columnspan=2, sticky='w', pady=(8, 2))
+        ).grid(row=11, column=0, columnspan=2, sticky='w', pady=(8, 2))
 
         tk.Label(
             frame,
@@ -1954,11 +2979,11 @@ class StockTradeSimulator:
             bg=self.bg_color,
             fg=self.text_color,
             font=('Segoe UI', 10, 'bold')
-        ).grid(row=7, column=0, sticky='e', pady=2, padx=(0, 5))
+        ).grid(row=12, column=0, sticky='e', pady=2, padx=(0, 5))
 
         scale_step_var = tk.StringVar(value=f"{self.trade_manager.scale_step_pct:.2f}")
         scale_step_entry = tk.Entry(frame, textvariable=scale_step_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
-        scale_step_entry.grid(row=7, column=1, sticky='w', pady=2)
+        scale_step_entry.grid(row=12, column=1, sticky='w', pady=2)
 
         tk.Label(
             frame,
@@ -1966,7 +2991,7 @@ class StockTradeSimulator:
             bg=self.bg_color,
             fg=self.text_color,
             font=('Segoe UI', 10)
-        ).grid(row=8, column=0, columnspan=2, sticky='w', pady=(2, 2))
+        ).grid(row=13, column=0, columnspan=2, sticky='w', pady=(2, 2))
 
         tk.Label(
             frame,
@@ -1974,40 +2999,79 @@ class StockTradeSimulator:
             bg=self.bg_color,
             fg=self.text_color,
             font=('Segoe UI', 10, 'bold')
-        ).grid(row=9, column=0, sticky='e', pady=2, padx=(0, 5))
+        ).grid(row=14, column=0, sticky='e', pady=2, padx=(0, 5))
 
         scale_fraction_var = tk.StringVar(value=f"{self.trade_manager.scale_fraction_pct:.2f}")
         scale_fraction_entry = tk.Entry(frame, textvariable=scale_fraction_var, width=12, bg=self.panel_bg, fg=self.text_color, font=('Segoe UI', 11))
-        scale_fraction_entry.grid(row=9, column=1, sticky='w', pady=2)
+        scale_fraction_entry.grid(row=14, column=1, sticky='w', pady=2)
+
+        tk.Label(
+            frame,
+            text="Cost basis method (how sells release position cost):",
+            bg=self.bg_color,
+            fg=self.text_color,
+            font=('Segoe UI', 10)
+        ).grid(row=15, column=0, columnspan=2, sticky='w', pady=(8, 2))
+
+        tk.Label(
+            frame,
+            text="Cost basis:",
+            bg=self.bg_color,
+            fg=self.text_color,
+            font=('Segoe UI', 10, 'bold')
+        ).grid(row=16, column=0, sticky='e', pady=2, padx=(0, 5))
+
+        cost_method_var = tk.StringVar(value=self.trade_manager.cost_basis_method)
+        cost_method_box = ttk.Combobox(frame, textvariable=cost_method_var, values=COST_METHODS, state='readonly', width=10)
+        cost_method_box.grid(row=16, column=1, sticky='w', pady=2)
 
         def save_settings():
             try:
                 fee_rate = float(fee_rate_var.get())
                 min_fee = float(min_fee_var.get())
                 slippage = float(slippage_var.get())
+                spread = float(spread_var.get())
+                impact = float(impact_var.get())
+                tiers = parse_tiers(tiers_var.get())
+                participation = float(participation_var.get())
                 stop_loss = float(stop_loss_var.get())
                 scale_step = float(scale_step_var.get())
                 scale_fraction = float(scale_fraction_var.get())
 
-                if fee_rate < 0 or min_fee < 0 or slippage < 0 or stop_loss < 0 or scale_step < 0 or scale_fraction < 0:
+                if (fee_rate < 0 or min_fee < 0 or slippage < 0 or spread < 0 or impact < 0 or participation < 0
+                        or stop_loss < 0 or scale_step < 0 or scale_fraction < 0):
                     messagebox.showerror("Error", "All values must be non-negative.")
                     return
 
-                self.trade_manager.fee_rate = fee_rate
-                self.trade_manager.min_fee = min_fee
-                self.trade_manager.slippage_per_share = slippage
-                self.trade_manager.stop_loss_pct = stop_loss
-                self.trade_manager.scale_step_pct = scale_step
-                self.trade_manager.scale_fraction_pct = scale_fraction
-                self.trade_manager.save_data()
+                before = self.trade_manager.get_settings()
+                after = {
+                    'fee_rate': fee_rate,
+                    'min_fee': min_fee,
+                    'slippage_per_share': slippage,
+                    'commission_tiers': [list(tier) for tier in tiers],
+                    'spread_bps': spread,
+                    'impact_coef': impact,
+                    'participation_rate': participation,
+                    'stop_loss_pct': stop_loss,
+                    'scale_step_pct': scale_step,
+                    'scale_fraction_pct': scale_fraction,
+                    'cost_basis_method': cost_method_var.get()
+                }
+                self.trade_manager.apply_settings(after)
+                if after != before:
+                    self._record_op("settings", before=before, after=after)
+                if after['cost_basis_method'] != before['cost_basis_method']:
+                    self.portfolio = self.trade_manager.get_portfolio()
+                    self.update_portfolio_table()
+                    self.update_assets()
 
                 messagebox.showinfo("Success", "Trading settings updated successfully.")
                 manager.destroy()
-            except ValueError:
-                messagebox.showerror("Error", "Please enter valid numeric values.")
+            except ValueError as e:
+                messagebox.showerror("Error", f"Please enter valid numeric values.\n{e}")
 
         btn_frame = tk.Frame(frame, bg=self.bg_color)
-        btn_frame.grid(row=4, column=0, columnspan=2, pady=(12, 0))
+        btn_frame.grid(row=17, column=0, columnspan=2, pady=(12, 0))
 
         tk.Button(
             btn_frame,
@@ -2040,13 +3104,11 @@ class StockTradeSimulator:
     # ----------------------- News / sentiment events -----------------------
     def add_news_event(self, event_type='good'):
         """Add a good/bad news event for the currently selected stock starting from current date."""
-        selection = self.stock_listbox.curselection()
-        if not selection:
+        stock_code = self.selected_code()
+        if not stock_code:
             messagebox.showerror("Error", "Please select a stock in the list first.")
             return
 
-        index = selection[0]
-        stock_code = self.stock_listbox.get(index).split()[0]
         stock_name = self.stocks[stock_code]['name']
 
         # Default settings: good news +3%, bad news -3%, duration 5 days
@@ -2077,7 +3139,11 @@ class StockTradeSimulator:
             return
 
         # Add event to data manager
-        self.data_manager.add_event(stock_code, self.current_date, days, impact)
+        event = self.data_manager.add_event(stock_code, self.current_date, days, impact)
+        if event is not None:
+            self._record_op("add_event", event=dict(event))
+        if self.screener is not None:
+            self.screener.invalidate()
 
         # Reload current date prices so effect is visible immediately
         self.show_loading(self._loading_message("Loading"))
@@ -2090,6 +3156,150 @@ class StockTradeSimulator:
             f"impact {impact:+.2f}% per day."
         )
 
+    # ----------------------- Corporate actions -----------------------
+    def add_corporate_action(self):
+        """Add a stock split or cash dividend of the selected stock with the current date as ex-date."""
+        stock_code = self.selected_code()
+        if not stock_code:
+            messagebox.showerror("Error", "Please select a stock in the list first.")
+            return
+        stock_name = self.stocks[stock_code]['name']
+        text = simpledialog.askstring(
+            "Split / Dividend",
+            f"Corporate action of {stock_name} ({stock_code}) from {self.current_date.strftime('%Y-%m-%d')}:\n\n"
+            f"Split: new:old shares, e.g. 2:1 or 1:10 (reverse split).\n"
+            f"Cash dividend: amount per share with $, e.g. $0.50.",
+            parent=self.root
+        )
+        if not text or not text.strip():
+            return
+
+        import corporate_actions
+        dm = self.data_manager
+        try:
+            text = text.strip()
+            if text.startswith("$"):
+                # The dividend factor is taken against the last raw close before the ex-date
+                previous = dm.calendar.previous_session(self.current_date)
+                previous_close = float(dm.get_stock_data(stock_code, previous)['price'])
+                action = corporate_actions.dividend_action(stock_code, self.current_date, float(text[1:]), previous_close)
+                summary = f"Cash dividend of ${action['amount']:.2f} per share"
+            else:
+                action = corporate_actions.split_action(stock_code, self.current_date, corporate_actions.parse_ratio(text))
+                summary = f"{action['ratio']:g}-for-1 split"
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid split or dividend: {e}")
+            return
+
+        dm.add_action(action)
+        self._record_op("add_action", action=dict(action))
+        # Convert held shares and pending orders of the stock right away
+        self._sync_splits()
+        if self.screener is not None:
+            self.screener.invalidate()
+        self.update_portfolio_table()
+        self.refresh_pending_orders_table()
+        self.load_trade_records()
+        self.show_loading(self._loading_message("Loading"))
+        self.load_stocks(datetime.datetime.combine(self.current_date, datetime.time()), run_engine=False)
+
+        messagebox.showinfo(
+            "Corporate Action Added",
+            f"{summary} of {stock_name} ({stock_code}) from {self.current_date.strftime('%Y-%m-%d')}."
+        )
+
+    # ----------------------- Screener -----------------------
+    SCREENER_PRESETS = (
+        ("Top Movers", "abs(change_percent) > 2", "change_percent"),
+        ("Near 60-Day High", "from_high_60 > -2", "ret_20"),
+        ("Volume Spike", "volume_ratio_20 > 2", "volume_ratio_20"),
+        ("Oversold", "rsi_14 < 30", "rsi_14"),
+    )
+
+    def open_screener(self):
+        """Dialog that screens the whole universe on the current date (screener.py)."""
+        if self.screener is None:
+            from screener import Screener
+            self.screener = Screener(self.data_manager)
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Stock Screener")
+        dialog.geometry("560x460")
+        dialog.transient(self.root)
+
+        frame = tk.Frame(dialog, bg=self.bg_color)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        filter_var = tk.StringVar(value=self.SCREENER_PRESETS[0][1])
+        rank_var = tk.StringVar(value=self.SCREENER_PRESETS[0][2])
+        descending_var = tk.BooleanVar(value=True)
+        for label, var in (("Filter", filter_var), ("Rank by", rank_var)):
+            row = tk.Frame(frame, bg=self.bg_color)
+            row.pack(fill=tk.X, pady=2)
+            tk.Label(row, text=label, width=8, anchor='w', bg=self.bg_color, fg=self.text_color,
+                     font=('Segoe UI', 11)).pack(side=tk.LEFT)
+            tk.Entry(row, textvariable=var, font=('Segoe UI', 11)).pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        presets = tk.Frame(frame, bg=self.bg_color)
+        presets.pack(fill=tk.X, pady=4)
+        tk.Checkbutton(presets, text="Highest first", variable=descending_var, bg=self.bg_color,
+                       fg=self.text_color).pack(side=tk.RIGHT)
+
+        columns = ("code", "name", "rank")
+        tree = ttk.Treeview(frame, columns=columns, show='headings', style="Treeview", height=12)
+        for col, heading, width in zip(columns, ("Code", "Name", "Rank Value"), (80, 260, 120)):
+            tree.heading(col, text=heading)
+            tree.column(col, width=width, anchor='w' if col == "name" else 'center')
+        tree.pack(fill=tk.BOTH, expand=True, pady=(4, 0))
+        status = tk.Label(frame, text="", anchor='w', bg=self.bg_color, fg=self.text_color, font=('Segoe UI', 10))
+        status.pack(fill=tk.X)
+
+        def show(results, elapsed):
+            if not dialog.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for r in results:
+                tree.insert("", tk.END, values=(r["code"], r["name"], f"{r['rank']:.2f}"))
+            status.config(text=f"{len(results)} match(es) on {self.current_date} ({elapsed * 1000:.0f} ms)")
+
+        def run():
+            expr, rank_by, descending = filter_var.get(), rank_var.get(), descending_var.get()
+            end_date = datetime.datetime.combine(self.current_date, datetime.time())
+            status.config(text="Screening...")
+
+            def worker():
+                try:
+                    start = time.perf_counter()
+                    results = self.screener.screen(expr, end_date, rank_by=rank_by, descending=descending, limit=100)
+                    elapsed = time.perf_counter() - start
+                    self.root.after(0, lambda: show(results, elapsed))
+                except Exception as e:
+                    message = f"Screen failed: {e}"
+                    self.root.after(0, lambda: messagebox.showerror("Error", message, parent=dialog))
+            threading.Thread(target=worker, daemon=True).start()
+
+        def apply_preset(preset):
+            filter_var.set(preset[1])
+            rank_var.set(preset[2])
+            run()
+
+        for preset in self.SCREENER_PRESETS:
+            tk.Button(presets, text=preset[0], command=lambda p=preset: apply_preset(p), bg=self.panel_bg,
+                      fg=self.text_color, relief='flat', cursor='hand2', padx=6).pack(side=tk.LEFT, padx=(0, 4))
+
+        def on_open(event=None):
+            selection = tree.selection()
+            if selection:
+                code = tree.item(selection[0], "values")[0]
+                self.quote_board.search_var.set("")
+                self.quote_board.select_code(code, notify=True)
+
+        tree.bind("<Double-1>", on_open)
+        tk.Button(frame, text="Run Screen", command=run, bg=self.panel_bg, fg=self.text_color,
+                  font=('Segoe UI', 10, 'bold'), relief='flat', cursor='hand2', padx=10,
+                  pady=4).pack(anchor='e', pady=(6, 0))
+        run()
+
     def load_trade_records(self):
         """Load trade records to table"""
         # Clear existing records
@@ -2135,49 +3345,76 @@ class StockTradeSimulator:
         # Update performance metrics & equity curve
         self.update_equity_metrics(total_value)
 
+    @timed()
     def _build_equity_curve(self, include_current=True):
         """Replay trade records to build equity curve (date, equity)."""
-        records = self.trade_manager.get_trade_records()
-        if not records:
+        store = self.trade_manager.get_trade_records()
+        if not store:
             current_equity = self.cash
             for code, info in self.portfolio.items():
                 price = self.stocks.get(code, {}).get('price', 0)
                 current_equity += price * info['shares']
             return [(self.current_date, current_equity)]
 
-        # Sort by date then insertion order
-        def _parse_date(rec):
-            try:
-                return datetime.datetime.strptime(rec['date'], "%Y-%m-%d").date()
-            except Exception:
-                return self.current_date
-
-        sorted_records = sorted(enumerate(records), key=lambda x: (_parse_date(x[1]), x[0]))
-
-        cash = float(self.trade_manager.initial_cash)
-        holdings = {}
-        last_price = {}
-        curve = []
-
-        for _, rec in sorted_records:
-            date = _parse_date(rec)
-            code = rec['stock_code']
-            price = float(rec['price'])
-            shares = int(rec['shares'])
-            trade_type = rec['trade_type']
-
-            if trade_type == 'Buy':
-                cash -= float(rec['total_amount'])
-                holdings[code] = holdings.get(code, 0) + shares
-            else:  # Sell
-                cash += float(rec['total_amount'])
-                holdings[code] = holdings.get(code, 0) - shares
-                if holdings.get(code, 0) <= 0:
-                    holdings.pop(code, None)
-
-            last_price[code] = price
-            equity = cash + sum(holdings[c] * last_price.get(c, 0) for c in holdings)
-            curve.append((date, equity))
+        import numpy as np
+
+        # Sort by date then insertion order (unparseable dates count as today)
+        dates = store.dates.astype(np.int64)
+        dates[dates <= 0] = self.current_date.toordinal()
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+        codes = store.code_ids[order]
+        is_buy = store.sides[order] > 0
+        shares = store.shares[order].astype(float)
+        prices = store.prices[order]
+        amounts = store.amounts[order]
+        if self.trade_manager.splits:
+            # Trades after a split are in the new share units: express all of them in the first units
+            scale = self.trade_manager.split_scale()[order]
+            shares = shares / scale
+            prices = prices * scale
+
+        cash = float(self.trade_manager.initial_cash) + np.cumsum(np.where(is_buy, -amounts, amounts))
+        signed_shares = np.where(is_buy, shares, -shares)
+
+        # Position of the traded code after each trade: cumulative sum within each code
+        by_code = np.argsort(codes, kind='stable')
+        c = codes[by_code]
+        q = signed_shares[by_code]
+        p = prices[by_code]
+        n = len(c)
+        starts = np.ones(n, dtype=bool)
+        starts[1:] = c[1:] != c[:-1]
+        first = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+        csum = np.cumsum(q)
+        pos_after = csum - (csum[first] - q[first])
+        ends = np.ones(n, dtype=bool)
+        ends[:-1] = starts[1:]
+        last_price = {store.code_of(code): px for code, px in zip(c[ends].tolist(), p[ends].tolist())}
+
+        if np.any(pos_after < 0):
+            # Oversold history: positions are floored at zero, replay sequentially
+            holdings = {}
+            prev = {}
+            market_value = np.empty(n)
+            for i, (code, qty, px) in enumerate(zip(codes.tolist(), signed_shares.tolist(), prices.tolist())):
+                held = holdings.get(code, 0) + qty
+                holdings[code] = held if held > 0 else 0
+                prev[code] = px
+                market_value[i] = sum(h * prev[k] for k, h in holdings.items())
+        else:
+            # Each trade re-marks only its own code: value change = new position at
+            # the trade price minus old position at that code's previous trade price
+            prev_price = np.empty(n)
+            prev_price[0] = 0.0
+            prev_price[1:] = p[:-1]
+            prev_price[starts] = 0.0
+            delta = np.empty(n)
+            delta[by_code] = pos_after * p - (pos_after - q) * prev_price
+            market_value = np.cumsum(delta)
+
+        equity = cash + market_value
+        curve = list(zip(map(datetime.date.fromordinal, dates.tolist()), equity.tolist()))
 
         if include_current:
             current_equity = self.cash
@@ -2189,83 +3426,72 @@ class StockTradeSimulator:
         return curve
 
     def _compute_performance_stats(self, curve):
-        """Compute basic performance stats from equity curve."""
+        """Compute performance stats from equity curve and realized trades."""
         if not curve:
             return {}
+        import numpy as np
+        import analytics
         # Sort by date
         curve = sorted(curve, key=lambda x: x[0])
-        dates = [c[0] for c in curve]
-        values = np.array([c[1] for c in curve], dtype=float)
-        if len(values) == 0:
-            return {}
+        dates = np.fromiter((c[0].toordinal() for c in curve), dtype=np.int64, count=len(curve))
+        values = np.fromiter((c[1] for c in curve), dtype=float, count=len(curve))
 
-        total_return = values[-1] / values[0] - 1 if values[0] != 0 else 0.0
+        stats = analytics.performance_summary(dates, values)
 
-        # Daily returns
-        if len(values) > 1 and np.all(values[:-1] > 0):
-            rets = np.diff(values) / values[:-1]
-            avg_ret = rets.mean()
-            vol = rets.std(ddof=1) if len(rets) > 1 else 0.0
-            sharpe = (avg_ret / vol * np.sqrt(252)) if vol > 1e-9 else 0.0
-        else:
-            sharpe = 0.0
-
-        cum_max = np.maximum.accumulate(values)
-        drawdowns = (cum_max - values) / cum_max
-        max_dd = drawdowns.max() if len(drawdowns) else 0.0
-
-        # CAGR based on days
-        span_days = max(1, (dates[-1] - dates[0]).days or 1)
-        cagr = (values[-1] / values[0]) ** (365 / span_days) - 1 if values[0] > 0 else 0.0
-
-        # Win rate / profit factor from realized trades
-        win_count = 0
-        loss_count = 0
-        profit_sum = 0.0
-        loss_sum = 0.0
-        holdings = {}
-        avg_cost = {}
-        records = self.trade_manager.get_trade_records()
-        for rec in records:
-            code = rec['stock_code']
-            shares = int(rec['shares'])
-            price = float(rec['price'])
-            if rec['trade_type'] == 'Buy':
-                prev_shares = holdings.get(code, 0)
-                prev_cost = avg_cost.get(code, 0.0) * prev_shares
-                new_total_shares = prev_shares + shares
-                new_total_cost = prev_cost + shares * price
-                holdings[code] = new_total_shares
-                avg_cost[code] = new_total_cost / new_total_shares if new_total_shares > 0 else 0.0
-            else:
-                if holdings.get(code, 0) <= 0:
-                    continue
-                cost_basis = avg_cost.get(code, 0.0)
-                pnl = (price - cost_basis) * shares
-                if pnl >= 0:
-                    win_count += 1
-                    profit_sum += pnl
-                else:
-                    loss_count += 1
-                    loss_sum += pnl
-                holdings[code] = holdings.get(code, 0) - shares
-                if holdings[code] <= 0:
-                    holdings.pop(code, None)
-                    avg_cost.pop(code, None)
+        # Win rate / profit factor are tallied incrementally by the position ledger
+        stats.update(self.trade_manager.ledger.trade_stats())
+        stats["turnover"] = analytics.turnover(self.trade_manager.get_trade_records().amounts, values)
 
-        total_trades = win_count + loss_count
-        win_rate = (win_count / total_trades * 100) if total_trades > 0 else 0.0
-        profit_factor = (profit_sum / abs(loss_sum)) if loss_sum < 0 else (profit_sum if profit_sum > 0 else 0.0)
+        current_equity = values[-1]
+        stats["exposure"] = float((current_equity - self.cash) / current_equity) if current_equity > 0 else 0.0
+        stats["curve"] = curve
+        return stats
 
-        return {
-            "total_return": total_return,
-            "cagr": cagr,
-            "sharpe": sharpe,
-            "max_dd": max_dd,
-            "win_rate": win_rate,
-            "profit_factor": profit_factor,
-            "curve": curve
-        }
+    def _ensure_equity_chart(self):
+        """Create the equity curve figure on first use; returns False without matplotlib."""
+        if self.equity_canvas is not None:
+            return True
+        mpl = _load_matplotlib_tk()
+        if mpl is None:
+            return False
+        Figure, FigureCanvasTkAgg, _ = mpl
+        self.equity_fig = Figure(figsize=(3.6, 1.8), dpi=100)
+        self.equity_ax = self.equity_fig.add_subplot(111)
+        self.equity_ax.set_title("Equity Curve", fontsize=10)
+        self.equity_ax.grid(True, linestyle='--', alpha=0.3)
+        self.equity_ax.tick_params(axis='x', labelrotation=30, labelsize=8)
+        self.equity_ax.tick_params(axis='y', labelsize=8)
+
+        self.equity_canvas = FigureCanvasTkAgg(self.equity_fig, master=self.equity_container)
+        self.equity_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        return True
+
+    def _ensure_kline_chart(self):
+        """Create the K-line figure on first use; returns False without matplotlib."""
+        if self.kline_canvas is not None:
+            return True
+        mpl = _load_matplotlib_tk()
+        if mpl is None:
+            return False
+        Figure, FigureCanvasTkAgg, _ = mpl
+        # Initialize a figure with two subplots: upper for price K-line (higher), lower for volume bars (lower)
+        self.kline_figure = Figure(figsize=(6, 4), dpi=100)
+        # 使用 GridSpec 控制高度比例：价格图 : 成交量图 = 3 : 1
+        gs = self.kline_figure.add_gridspec(4, 1, hspace=0.05)
+        self.kline_ax = self.kline_figure.add_subplot(gs[:3, 0])
+        self.volume_ax = self.kline_figure.add_subplot(gs[3, 0], sharex=self.kline_ax)
+
+        self.kline_ax.set_ylabel("Price")
+        self.kline_ax.grid(True, linestyle='--', alpha=0.3)
+        # 只在底部子图显示日期刻度
+        self.kline_ax.tick_params(labelbottom=False)
+
+        self.volume_ax.set_ylabel("Volume")
+        self.volume_ax.grid(True, linestyle='--', alpha=0.3)
+
+        self.kline_canvas = FigureCanvasTkAgg(self.kline_figure, master=self.chart_container)
+        self.kline_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        return True
 
     def update_equity_metrics(self, latest_total_value):
         """Update equity metrics labels and plot."""
@@ -2277,19 +3503,25 @@ class StockTradeSimulator:
                 self.metric_total_return.config(text=msg)
                 self.metric_max_dd.config(text="Max Drawdown: --")
                 self.metric_sharpe.config(text="Sharpe (daily): --")
+                self.metric_sortino.config(text="Sortino / Calmar: --")
                 self.metric_win_rate.config(text="Win Rate / PF: --")
                 return
 
             self.metric_total_return.config(
                 text=f"Total Return: {stats['total_return']*100:.2f}% | CAGR: {stats['cagr']*100:.2f}%"
             )
-            self.metric_max_dd.config(text=f"Max Drawdown: {stats['max_dd']*100:.2f}%")
+            self.metric_max_dd.config(
+                text=f"Max Drawdown: {stats['max_dd']*100:.2f}% ({stats['max_dd_duration']}d)"
+            )
             self.metric_sharpe.config(text=f"Sharpe (daily): {stats['sharpe']:.2f}")
+            self.metric_sortino.config(
+                text=f"Sortino: {stats['sortino']:.2f} | Calmar: {stats['calmar']:.2f}"
+            )
             self.metric_win_rate.config(
                 text=f"Win Rate: {stats['win_rate']:.1f}% | PF: {stats['profit_factor']:.2f}"
             )
 
-            if MATPLOTLIB_AVAILABLE and self.equity_canvas is not None:
+            if MATPLOTLIB_AVAILABLE and self._ensure_equity_chart():
                 self.equity_ax.clear()
                 self.equity_ax.grid(True, linestyle='--', alpha=0.3)
                 dates = [d for d, _ in stats['curve']]
@@ -2304,11 +3536,55 @@ class StockTradeSimulator:
         except Exception as e:
             print(f"Failed to update equity metrics: {e}")
 
+    def run_monte_carlo(self, n_paths=10_000, horizon=60):
+        """Simulate future paths of the current portfolio under the auto-trading rules (monte_carlo.py)."""
+        if not any(p.get("shares", 0) > 0 for p in self.trade_manager.get_portfolio().values()):
+            messagebox.showinfo("Monte Carlo Outlook", "There are no open positions to simulate.")
+            return
+        self.show_loading(f"Simulating {n_paths:,} paths over {horizon} sessions...")
+        end_date = datetime.datetime.combine(self.current_date, datetime.time())
+
+        def worker():
+            try:
+                import multiprocessing
+                import monte_carlo
+                result = monte_carlo.simulate(
+                    self.data_manager, self.trade_manager, end_date, n_paths=n_paths, horizon=horizon,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                self.root.after(0, lambda: self._show_monte_carlo(result))
+            except Exception as e:
+                message = f"Monte Carlo simulation failed: {e}"
+                self.root.after(0, lambda: messagebox.showerror("Error", message))
+            finally:
+                self.root.after(0, self.hide_loading)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _show_monte_carlo(self, result):
+        quantiles = result.terminal_quantiles()
+        lines = [
+            f"{result.n_paths:,} paths, {result.horizon} trading sessions ahead",
+            f"Current equity: ${result.initial_equity:,.2f}",
+            "",
+            f"Stop-loss triggered: {result.stop_loss_probability * 100:.1f}% of paths",
+            f"Ends below current equity: {result.loss_probability * 100:.1f}%",
+            f"Expected max drawdown: {result.expected_max_drawdown * 100:.2f}%",
+            "",
+            "Terminal equity:",
+        ]
+        lines += [f"  {q}th percentile: ${v:,.2f}" for q, v in quantiles.items()]
+        messagebox.showinfo("Monte Carlo Outlook", "\n".join(lines))
+
+    @timed()
     def update_kline_chart(self, stock_code):
         """Update K-line chart for the selected stock."""
-        if not MATPLOTLIB_AVAILABLE or self.kline_canvas is None:
+        if not MATPLOTLIB_AVAILABLE or not self._ensure_kline_chart():
             return
+        self.kline_code = stock_code
         try:
+            import pandas as pd
+            from matplotlib.patches import Rectangle
             end_date = datetime.datetime.combine(self.current_date, datetime.time())
             history = self.data_manager.get_stock_history(stock_code, end_date, window_days=60)
             if history is None or history.empty:
@@ -2354,7 +3630,7 @@ class StockTradeSimulator:
                 lower = min(o, c)
                 height = abs(c - o) if abs(c - o) > 1e-6 else (h - l) * 0.1
                 self.kline_ax.add_patch(
-                    matplotlib.patches.Rectangle(
+                    Rectangle(
                         (i - width / 2, lower),
                         width,
                         height,
@@ -2367,6 +3643,8 @@ class StockTradeSimulator:
                 # Volume bars（使用同色系表示涨跌）
                 self.volume_ax.bar(i, volumes[i], color=color, width=width, alpha=0.7)
 
+            self._draw_kline_overlay(stock_code, end_date, list(history['date']))
+
             # X-axis labels: show sparse date ticks
             xticks = list(x)[::max(1, len(x)//8)]
             self.kline_ax.set_xticks(xticks)
@@ -2381,6 +3659,97 @@ class StockTradeSimulator:
         except Exception as e:
             print(f"Failed to update K-line chart for {stock_code}: {e}")
 
+    def _draw_kline_overlay(self, stock_code, end_date, chart_dates):
+        """Plot the selected indicator overlay on the price axis, aligned to the chart's candles."""
+        spec = KLINE_OVERLAYS.get(getattr(self, 'overlay_var', None) and self.overlay_var.get())
+        if spec is None:
+            return
+        try:
+            result = self.data_manager.indicators.series(stock_code, spec, end_date, window_days=60)
+            position = {d: i for i, d in enumerate(chart_dates)}
+            xs = [position[d] for d in result["date"] if d in position]
+            keep = [i for i, d in enumerate(result["date"]) if d in position]
+            styles = {"value": ('#2563EB', '-'), "mid": ('#2563EB', '-'), "upper": ('#6B7280', '--'), "lower": ('#6B7280', '--')}
+            for col, (color, style) in styles.items():
+                if col in result:
+                    self.kline_ax.plot(xs, result[col][keep], color=color, linestyle=style, linewidth=1.2)
+            self.kline_ax.set_title(f"{stock_code} - Recent 60-Day K-line + {self.overlay_var.get()}")
+        except Exception as e:
+            print(f"Failed to draw indicator overlay for {stock_code}: {e}")
+
+    # ----------------------- Operation log / undo -----------------------
+    def _record_op(self, op_type, engine=False, **fields):
+        """Append an action to the operation log (oplog.py) and refresh the Undo/Redo buttons."""
+        try:
+            self.oplog.record(op_type, engine=engine, **fields)
+        except Exception as e:
+            print(f"Failed to record {op_type} operation: {e}")
+        self._update_history_buttons()
+
+    def _execute_fill(self, code, name, side, shares, quote, exec_price, gross, fee, engine=False, save=True, **extra):
+        """Book a fill on the current date (trade log, position, cash) and log it for undo/replay."""
+        date_str = self.current_date.strftime('%Y-%m-%d')
+        self._mark_split_level(code)
+        before = self.trade_manager.execute_fill(date_str, code, name, side, shares, exec_price, gross, fee, save=save)
+        self._record_op(
+            "fill", engine=engine, date=date_str, code=code, name=name, side=side, shares=int(shares),
+            quote=float(quote), price=float(exec_price), amount=float(gross), fee=float(fee), before=before, **extra
+        )
+
+    def _fill_volumes(self, codes, prices):
+        """Bar volumes of ``codes`` on the current date for market impact (None when impact is off)."""
+        if self.trade_manager.impact_coef <= 0:
+            return None
+        return [self.data_manager.bar_volume(code, self.current_date, float(price))
+                for code, price in zip(codes, prices)]
+
+    def _update_history_buttons(self):
+        self.undo_button.config(state=tk.NORMAL if self.oplog.can_undo() else tk.DISABLED)
+        self.redo_button.config(state=tk.NORMAL if self.oplog.can_redo() else tk.DISABLED)
+
+    def undo(self):
+        """Undo the last action together with the automatic trades it triggered."""
+        import oplog
+        self._step_history(self.oplog.undo(), oplog.revert, "from")
+
+    def redo(self):
+        """Redo the last undone action (and its automatic trades, as recorded)."""
+        import oplog
+        self._step_history(self.oplog.redo(), oplog.apply, "to")
+
+    def _step_history(self, ops, action, date_key):
+        if not ops:
+            return
+        target = None
+        events_changed = False
+        try:
+            for op in ops:
+                if op["type"] == "date":
+                    target = op[date_key]
+                else:
+                    action(op, self.trade_manager, self.data_manager)
+                    events_changed = events_changed or op["type"] in ("add_event", "add_action")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to undo/redo: {e}")
+
+        tm = self.trade_manager
+        self.cash = tm.get_cash()
+        self.portfolio = tm.get_portfolio()
+        self.pending_orders = tm.get_pending_orders()
+        self.update_assets()
+        self.load_trade_records()
+        self.update_portfolio_table()
+        self.refresh_pending_orders_table()
+        if events_changed and self.screener is not None:
+            self.screener.invalidate()
+        if target is not None:
+            # Move the calendar without re-running rules or orders: their fills are in the log
+            self._navigate(datetime.datetime.strptime(target, "%Y-%m-%d"), record=False)
+        elif events_changed:
+            self.show_loading(self._loading_message("Loading"))
+            self.load_stocks(datetime.datetime.combine(self.current_date, datetime.time()), run_engine=False)
+        self._update_history_buttons()
+
     def reset_account(self):
         """Reset account: set a new initial cash amount and clear portfolio & trade records"""
         try:
@@ -2397,12 +3766,12 @@ class StockTradeSimulator:
                 messagebox.showerror("Error", "Initial cash must be non-negative.")
                 return
 
-            # Reset trade data
-            self.trade_manager.trade_records = []
-            self.trade_manager.portfolio = {}
-            self.trade_manager.initial_cash = float(value)
-            self.trade_manager.cash = float(value)
-            self.trade_manager.save_data()
+            # Reset trade data (the old log is kept in the operation log so the reset can be undone)
+            tm = self.trade_manager
+            before = {"trade_records": tm.trade_records.to_records(), "cash": tm.cash, "initial_cash": tm.initial_cash,
+                      "splits": [dict(split) for split in tm.splits]}
+            tm.reset(value)
+            self._record_op("reset", initial_cash=float(value), before=before)
 
             # Sync UI state
             self.cash = self.trade_manager.get_cash()
@@ -2423,38 +3792,25 @@ class StockTradeSimulator:
                 messagebox.showerror("Error", "Please enter a valid number of shares")
                 return
 
-            selected_index = self.stock_listbox.curselection()
-            if not selected_index:
+            stock_code = self.selected_code()
+            if not stock_code:
                 messagebox.showerror("Error", "Please select a stock to buy")
                 return
 
-            stock_code = self.stock_listbox.get(selected_index).split()[0]
             stock_name = self.stocks[stock_code]['name']
             price = self.stocks[stock_code]['price']
 
             # 计算实际成交价、成交金额和手续费
-            exec_price, total_amount, fee = self.trade_manager.calculate_trade_costs(price, shares, 'Buy')
+            volume = self._fill_volumes([stock_code], [price])
+            exec_price, total_amount, fee = self.trade_manager.calculate_trade_costs(
+                price, shares, 'Buy', volume[0] if volume else None)
             
             if total_amount + fee > self.cash:
                 messagebox.showerror("Error", "Insufficient cash (including fees)")
                 return
 
-            # Update trade record
-            self.trade_manager.add_trade_record(
-                self.current_date.strftime('%Y-%m-%d'),
-                stock_code,
-                stock_name,
-                'Buy',
-                shares,
-                exec_price,
-                total_amount
-            )
-            
-            # Update portfolio
-            self.trade_manager.update_portfolio(stock_code, shares, price, 'Buy')
-            
-            # Update cash
-            self.trade_manager.update_cash(total_amount, 'Buy', fee=fee)
+            # Update trade record, portfolio and cash
+            self._execute_fill(stock_code, stock_name, 'Buy', shares, price, exec_price, total_amount, fee)
             
             # Update display
             self.cash = self.trade_manager.get_cash()
@@ -2476,12 +3832,11 @@ class StockTradeSimulator:
                 messagebox.showerror("Error", "Please enter a valid number of shares")
                 return
 
-            selected_index = self.stock_listbox.curselection()
-            if not selected_index:
+            stock_code = self.selected_code()
+            if not stock_code:
                 messagebox.showerror("Error", "Please select a stock to sell")
                 return
 
-            stock_code = self.stock_listbox.get(selected_index).split()[0]
             stock_name = self.stocks[stock_code]['name']
 
             if stock_code not in self.portfolio:
@@ -2495,24 +3850,12 @@ class StockTradeSimulator:
             price = self.stocks[stock_code]['price']
 
             # 计算实际成交价、成交金额和手续费
-            exec_price, total_amount, fee = self.trade_manager.calculate_trade_costs(price, shares, 'Sell')
+            volume = self._fill_volumes([stock_code], [price])
+            exec_price, total_amount, fee = self.trade_manager.calculate_trade_costs(
+                price, shares, 'Sell', volume[0] if volume else None)
             
-            # Update trade record
-            self.trade_manager.add_trade_record(
-                self.current_date.strftime('%Y-%m-%d'),
-                stock_code,
-                stock_name,
-                'Sell',
-                shares,
-                exec_price,
-                total_amount
-            )
-            
-            # Update portfolio
-            self.trade_manager.update_portfolio(stock_code, shares, price, 'Sell')
-            
-            # Update cash
-            self.trade_manager.update_cash(total_amount, 'Sell', fee=fee)
+            # Update trade record, portfolio and cash
+            self._execute_fill(stock_code, stock_name, 'Sell', shares, price, exec_price, total_amount, fee)
             
             # Update display
             self.cash = self.trade_manager.get_cash()
@@ -2526,91 +3869,94 @@ class StockTradeSimulator:
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number of shares")
 
-    def update_date(self, event):
-        """Update date and reload data"""
-        # Save current selected stock index
-        current_selection = self.stock_listbox.curselection()
-        selected_index = current_selection[0] if current_selection else 0
-
-        selected_date = datetime.datetime.strptime(self.calendar.get_date(), "%Y-%m-%d")
-        self.current_date = selected_date.date()
+    def _navigate(self, target, record=True):
+        """Show trading day ``target`` (datetime); ``record=False`` is used by undo/redo and skips the rules."""
+        previous = self.current_date
+        self.calendar.selection_set(target.date())
+        self.current_date = target.date()
         self.date_label.config(text=f"Current Date: {self.current_date}")
-        self.show_loading(self._loading_message())
-        
+        if record and self.current_date != previous:
+            self._record_op("date", **{"from": previous.strftime("%Y-%m-%d"), "to": self.current_date.strftime("%Y-%m-%d")})
+        # Splits up to the new date convert positions and orders before any order is matched
+        self._sync_splits(record)
+        # 已被后台预取的日期直接加载，不弹出加载对话框
+        self.prefetcher.cancel()
+        if not self.prefetcher.record_lookup(target):
+            self.show_loading(self._loading_message())
+
         def after_load():
-            # Restore previous selection or select first item
-            self.stock_listbox.selection_clear(0, tk.END)
-            if selected_index < self.stock_listbox.size():
-                self.stock_listbox.selection_set(selected_index)
-                self.stock_listbox.see(selected_index)
-            else:
-                self.stock_listbox.selection_set(0)
-                self.stock_listbox.see(0)
+            # Keep the selected stock (by code) or select the first item
+            self._restore_selection()
             self.show_stock_details()
             # 应用自动交易规则
-            self.apply_auto_trading_rules()
+            if record:
+                self.apply_auto_trading_rules()
+            self._schedule_prefetch()
 
-        self.load_stocks(selected_date)
+        self.load_stocks(target, run_engine=record)
         self.root.after(100, after_load)  # Wait for data loading to complete before restoring selection
 
-    def previous_day(self):
-        """Navigate to previous day and reload data"""
-        # Save current selected stock index
-        current_selection = self.stock_listbox.curselection()
-        selected_index = current_selection[0] if current_selection else 0
+    def _sync_splits(self, record=True):
+        """Bring positions and pending orders to the share units of the current date.
 
-        current_date = datetime.datetime.strptime(self.calendar.get_date(), "%Y-%m-%d")
-        previous_date = current_date - datetime.timedelta(days=1)
-        self.calendar.selection_set(previous_date.date())
-        self.date_label.config(text=f"Current Date: {self.calendar.get_date()}")
-        self.show_loading(self._loading_message())
-        
-        def after_load():
-            # Restore previous selection or select first item
-            self.stock_listbox.selection_clear(0, tk.END)
-            if selected_index < self.stock_listbox.size():
-                self.stock_listbox.selection_set(selected_index)
-                self.stock_listbox.see(selected_index)
-            else:
-                self.stock_listbox.selection_set(0)
-                self.stock_listbox.see(0)
-            self.show_stock_details()
-            # 应用自动交易规则
-            self.apply_auto_trading_rules()
+        Held (or ordered) stocks are converted by the splits with an ex-date up
+        to the current date that the account has not seen yet (``record=False``:
+        undo/redo, whose log already holds the conversions). Other stocks only
+        have their level updated.
+        """
+        dm, tm = self.data_manager, self.trade_manager
+        codes = dm.actions.codes(splits=True) | set(tm.split_levels)
+        if not codes:
+            return
+        date_str = self.current_date.strftime('%Y-%m-%d')
+        ordered = {o.get('code') for o in tm.pending_orders}
+        for code in sorted(codes):
+            held = code in tm.portfolio or code in ordered
+            if held and not record:
+                continue
+            try:
+                # Fetching the raw price first lets real data update the code's actions
+                price = float(dm.get_stock_data(code, self.current_date)['price']) if held else 0.0
+                level = dm.actions.level(code, self.current_date, splits=True)
+                ratio = level / tm.split_levels.get(code, 1.0)
+                if abs(ratio - 1.0) < 1e-12:
+                    continue
+                if held:
+                    undo = tm.apply_split(date_str, code, ratio, price)
+                    self._record_op("split", engine=True, date=date_str, code=code, ratio=ratio, price=price, undo=undo)
+                else:
+                    tm.split_levels[code] = level
+            except Exception as e:
+                print(f"Failed to apply split of {code}: {e}")
+        self.cash = tm.get_cash()
+        self.pending_orders = tm.get_pending_orders()
 
-        self.load_stocks(previous_date)
-        self.root.after(100, after_load)  # Wait for data loading to complete before restoring selection
+    def _mark_split_level(self, code):
+        """A new position or first order of ``code`` starts in the current date's share units."""
+        tm = self.trade_manager
+        if code in tm.portfolio or any(o.get('code') == code for o in tm.pending_orders):
+            return
+        if code in tm.split_levels or code in self.data_manager.actions:
+            tm.split_levels[code] = self.data_manager.actions.level(code, self.current_date, splits=True)
 
-    def next_day(self):
-        """Navigate to next day and reload data"""
-        # Save current selected stock index
-        current_selection = self.stock_listbox.curselection()
-        selected_index = current_selection[0] if current_selection else 0
+    def update_date(self, event):
+        """Update date and reload data"""
+        self._navigate(datetime.datetime.strptime(self.calendar.get_date(), "%Y-%m-%d"))
 
+    def previous_day(self):
+        """Navigate to the previous trading day and reload data"""
         current_date = datetime.datetime.strptime(self.calendar.get_date(), "%Y-%m-%d")
-        next_date = current_date + datetime.timedelta(days=1)
-        self.calendar.selection_set(next_date.date())
-        self.date_label.config(text=f"Current Date: {self.calendar.get_date()}")
-        self.show_loading(self._loading_message())
-        
-        def after_load():
-            # Restore previous selection or select first item
-            self.stock_listbox.selection_clear(0, tk.END)
-            if selected_index < self.stock_listbox.size():
-                self.stock_listbox.selection_set(selected_index)
-                self.stock_listbox.see(selected_index)
-            else:
-                self.stock_listbox.selection_set(0)
-                self.stock_listbox.see(0)
-            self.show_stock_details()
-            # 应用自动交易规则
-            self.apply_auto_trading_rules()
-
-        self.load_stocks(next_date)
-        self.root.after(100, after_load)  # Wait for data loading to complete before restoring selection
+        # 跳过周末和节假日，直接到上一个交易日
+        self._navigate(datetime.datetime.combine(self.data_manager.calendar.previous_session(current_date), datetime.time()))
 
+    def next_day(self):
+        """Navigate to the next trading day and reload data"""
+        current_date = datetime.datetime.strptime(self.calendar.get_date(), "%Y-%m-%d")
+        # 跳过周末和节假日，直接到下一个交易日
+        self._navigate(datetime.datetime.combine(self.data_manager.calendar.next_session(current_date), datetime.time()))
 
 if __name__ == "__main__":
     root = tk.Tk()  # Create main window
     app = StockTradeSimulator(root)  # Instantiate stock trading simulator
-    root.mainloop()  # Enter main event loop
\ No newline at end of file
+    root.mainloop()  # Enter main event loop
+    app.prefetcher.shutdown()  # Stop background prefetching so the process can exit
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""Monte Carlo outcomes of the current portfolio under the auto-trading rules.
+
+``simulate`` draws thousands of future price paths for the held stocks and
+replays the account's stop-loss and scale-in/out rules along each of them:
+
+* Paths are correlated GBM. Drift and covariance of daily log returns are
+  estimated from the recent price history (``estimate_params``).
+* Paths are processed in chunks of ``chunk_paths``. Within a chunk every
+  array is (paths x codes) and one session is stepped at a time, with the
+  same ``StrategyEngine`` and fill/cost rules as ``accounts.AccountPool``.
+  Each path behaves like one account.
+* Chunks run on a process pool. Each worker folds its per-path results
+  into a ``MonteCarloResult``: exact counts and sums for the stop-loss
+  rate, loss rate and mean max drawdown, and a fixed-bin histogram of
+  log(terminal / initial equity) for the quantiles. Only these summaries
+  are merged, so memory is bounded by the chunk size, not by the total
+  number of paths.
+* Chunk seeds are spawned from one ``SeedSequence``. Results therefore
+  depend on the seed and chunk size, not on the number of workers.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import timed
+from strategies import StrategyContext, default_engine
+
+QUANTILES = (5, 25, 50, 75, 95)
+TRADING_DAYS = 252
+DEFAULT_DAILY_VOL = 0.02
+# Terminal equity histogram: log(terminal / initial) in [-5, 5] (0.7% .. 148x), 0.1% wide bins
+LOG_RANGE = 5.0
+HIST_BINS = 10_000
+
+
+def estimate_params(data_manager, codes, end_date, lookback=120):
+    """(mu, cov): mean and covariance of daily log returns over ``lookback`` sessions.
+
+    Codes without enough history get zero drift and DEFAULT_DAILY_VOL, uncorrelated.
+    """
+    n = len(codes)
+    mu = np.zeros(n)
+    cov = np.diag(np.full(n, DEFAULT_DAILY_VOL ** 2))
+    series = {}
+    for code in codes:
+        history = data_manager.get_stock_history(code, end_date, window_days=lookback + 1)
+        if history is not None and len(history) > 2:
+            series[code] = dict(zip(history["date"], history["close"].astype(float)))
+    if not series:
+        return mu, cov
+    dates = sorted(set().union(*(s.keys() for s in series.values())))
+    closes = np.full((len(dates), n), np.nan)
+    for j, code in enumerate(codes):
+        s = series.get(code)
+        if s is not None:
+            closes[:, j] = [s.get(d, np.nan) for d in dates]
+    rets = np.diff(np.log(closes), axis=0)
+    known = [j for j in range(n) if np.isfinite(rets[:, j]).sum() > 2]
+    if known:
+        block = rets[:, known]
+        rows = np.isfinite(block).all(axis=1)
+        if rows.sum() > 2:
+            mu[known] = block[rows].mean(axis=0)
+            cov[np.ix_(known, known)] = np.cov(block[rows], rowvar=False).reshape(len(known), len(known))
+    return mu, cov
+
+
+def _cholesky(cov):
+    """Cholesky factor, with a small ridge if ``cov`` is only positive semi-definite."""
+    ridge = 0.0
+    scale = max(float(np.trace(cov)) / max(len(cov), 1), 1e-12)
+    for _ in range(6):
+        try:
+            return np.linalg.cholesky(cov + ridge * np.eye(len(cov)))
+        except np.linalg.LinAlgError:
+            ridge = scale * 1e-8 if ridge == 0.0 else ridge * 100
+    return np.diag(np.sqrt(np.maximum(np.diag(cov), 0.0)))
+
+
+def _fill(orders, prices, positions, cost, cash, model):
+    """Fill signed share orders per path at per-path prices (AccountPool.execute rules, costs.CostModel)."""
+    sells = np.minimum(np.maximum(-orders, 0), positions)
+    buys = np.maximum(orders, 0)
+    _, sell_gross, sell_fee = model.price(prices, sells, -1)
+    _, buy_gross, buy_fee = model.price(prices, buys, 1)
+
+    cash_after_sells = cash + (sell_gross - sell_fee).sum(axis=1)
+    affordable = ((buy_gross + buy_fee).sum(axis=1) <= cash_after_sells)[:, None]
+    buys = np.where(affordable, buys, 0)
+    buy_gross = np.where(affordable, buy_gross, 0.0)
+    buy_fee = np.where(affordable, buy_fee, 0.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg = np.where(positions > 0, cost / positions, 0.0)
+    cost -= avg * sells
+    cost += buy_gross
+    positions += buys - sells
+    cost[positions == 0] = 0.0
+    return cash_after_sells - (buy_gross + buy_fee).sum(axis=1)
+
+
+def simulate_chunk(seed, n_paths, horizon, prices0, mu, chol, shares, cost, cash, rules, costs):
+    """Simulate ``n_paths`` paths; returns (terminal equity, max drawdown, stop-loss hit) arrays.
+
+    ``mu`` is the daily log drift and ``chol`` the Cholesky factor of the daily log-return covariance.
+    """
+    rng = np.random.default_rng(seed)
+    n_codes = len(prices0)
+    engine = default_engine(*rules)
+
+    prices = np.broadcast_to(prices0, (n_paths, n_codes)).copy()
+    positions = np.broadcast_to(shares, (n_paths, n_codes)).astype(np.int64)
+    basis = np.broadcast_to(cost, (n_paths, n_codes)).astype(float)
+    cash = np.full(n_paths, float(cash))
+    equity = cash + (positions * prices).sum(axis=1)
+    peak = equity.copy()
+    max_dd = np.zeros(n_paths)
+    stop_hit = np.zeros(n_paths, dtype=bool)
+
+    for t in range(horizon):
+        shocks = rng.standard_normal((n_paths, n_codes)) @ chol.T
+        prices *= np.exp(mu + shocks)
+        ctx = StrategyContext(t, None, prices, positions, basis, cash[:, None])
+        orders, source = engine.evaluate(ctx)
+        if orders.any():
+            stop_hit |= ((source == 0) & (orders != 0)).any(axis=1)
+            cash = _fill(orders, prices, positions, basis, cash, costs)
+        equity = cash + (positions * prices).sum(axis=1)
+        np.maximum(peak, equity, out=peak)
+        np.maximum(max_dd, 1.0 - equity / peak, out=max_dd)
+    return equity, max_dd, stop_hit
+
+
+class MonteCarloResult:
+    """Outcome distribution over all simulated paths.
+
+    Counts and sums are exact. Terminal equity is kept as a histogram of
+    log(terminal / initial equity) with HIST_BINS bins, so quantiles are
+    interpolated to within about 0.1% of equity (values beyond the range go
+    to the edge bins and are clipped to the observed min / max).
+    """
+
+    def __init__(self, initial_equity, horizon):
+        self.initial_equity = initial_equity
+        self.horizon = horizon
+        self.n_paths = 0
+        self.stop_hits = 0
+        self.losses = 0
+        self.max_dd_sum = 0.0
+        self.histogram = np.zeros(HIST_BINS, dtype=np.int64)
+        self.min_terminal = np.inf
+        self.max_terminal = -np.inf
+
+    def add(self, terminal, max_dd, stop_hit):
+        """Fold one chunk's per-path arrays into the totals."""
+        if not len(terminal):
+            return
+        self.n_paths += len(terminal)
+        self.stop_hits += int(stop_hit.sum())
+        self.losses += int((terminal < self.initial_equity).sum())
+        self.max_dd_sum += float(max_dd.sum())
+        if self.initial_equity > 0:
+            with np.errstate(divide="ignore"):
+                x = np.log(terminal / self.initial_equity)
+        else:
+            x = np.zeros(len(terminal))
+        bins = np.clip(((x + LOG_RANGE) / (2 * LOG_RANGE) * HIST_BINS).astype(np.int64), 0, HIST_BINS - 1)
+        self.histogram += np.bincount(bins, minlength=HIST_BINS)
+        self.min_terminal = min(self.min_terminal, float(terminal.min()))
+        self.max_terminal = max(self.max_terminal, float(terminal.max()))
+
+    def merge(self, other):
+        self.n_paths += other.n_paths
+        self.stop_hits += other.stop_hits
+        self.losses += other.losses
+        self.max_dd_sum += other.max_dd_sum
+        self.histogram += other.histogram
+        self.min_terminal = min(self.min_terminal, other.min_terminal)
+        self.max_terminal = max(self.max_terminal, other.max_terminal)
+
+    @property
+    def stop_loss_probability(self):
+        return self.stop_hits / self.n_paths if self.n_paths else 0.0
+
+    @property
+    def expected_max_drawdown(self):
+        return self.max_dd_sum / self.n_paths if self.n_paths else 0.0
+
+    @property
+    def loss_probability(self):
+        return self.losses / self.n_paths if self.n_paths else 0.0
+
+    def terminal_quantiles(self, quantiles=QUANTILES):
+        if not self.n_paths:
+            return {q: self.initial_equity for q in quantiles}
+        if self.initial_equity <= 0:
+            return {q: self.min_terminal for q in quantiles}
+        cum = np.cumsum(self.histogram)
+        width = 2 * LOG_RANGE / HIST_BINS
+        out = {}
+        for q in quantiles:
+            target = q / 100.0 * self.n_paths
+            i = min(int(np.searchsorted(cum, target)), HIST_BINS - 1)
+            before = cum[i - 1] if i else 0
+            frac = (target - before) / self.histogram[i] if self.histogram[i] else 0.0
+            value = self.initial_equity * np.exp(-LOG_RANGE + (i + frac) * width)
+            out[q] = float(min(max(value, self.min_terminal), self.max_terminal))
+        return out
+
+    def summary(self):
+        return {
+            "paths": self.n_paths,
+            "horizon_sessions": self.horizon,
+            "initial_equity": self.initial_equity,
+            "stop_loss_probability": self.stop_loss_probability,
+            "loss_probability": self.loss_probability,
+            "expected_max_drawdown": self.expected_max_drawdown,
+            "terminal_quantiles": self.terminal_quantiles(),
+        }
+
+
+def summarize_chunk(initial_equity, horizon, *job):
+    """Run ``simulate_chunk(*job)`` and return its paths folded into a MonteCarloResult."""
+    result = MonteCarloResult(initial_equity, horizon)
+    result.add(*simulate_chunk(*job))
+    return result
+
+
+@timed("monte_carlo.simulate")
+def simulate(data_manager, trade_manager, end_date, n_paths=10_000, horizon=60, lookback=120,
+             seed=0, chunk_paths=2_000, workers=None, annual_drift=None, mp_context=None):
+    """Monte Carlo outcomes of ``trade_manager``'s portfolio over ``horizon`` sessions after ``end_date``.
+
+    ``annual_drift``: expected yearly return used for every stock instead of
+    the (noisy) historical estimate. ``workers``: process count (None = CPU
+    count, 1 = run in this process); ``mp_context`` is passed to the pool.
+    """
+    held = {c: p for c, p in trade_manager.get_portfolio().items() if p.get("shares", 0) > 0}
+    codes = list(held)
+    prices0 = np.empty(len(codes))
+    for j, code in enumerate(codes):
+        quote = data_manager.get_stock_data(code, end_date)
+        prices0[j] = float(quote["price"]) if quote else held[code]["total_cost"] / held[code]["shares"]
+    shares = np.array([held[c]["shares"] for c in codes], dtype=np.int64)
+    cost = np.array([held[c]["total_cost"] for c in codes], dtype=float)
+    cash = float(trade_manager.get_cash())
+    initial_equity = cash + float((shares * prices0).sum())
+
+    mu, cov = estimate_params(data_manager, codes, end_date, lookback) if codes else (np.zeros(0), np.zeros((0, 0)))
+    chol = _cholesky(cov) if codes else np.zeros((0, 0))
+    if annual_drift is not None:
+        mu = np.log1p(annual_drift) / TRADING_DAYS - 0.5 * np.diag(cov)
+    tm = trade_manager
+    rules = (tm.stop_loss_pct, tm.scale_step_pct, tm.scale_fraction_pct)
+    costs = tm.cost_model
+
+    sizes = [min(chunk_paths, n_paths - start) for start in range(0, n_paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(initial_equity, horizon, s, size, horizon, prices0, mu, chol, shares, cost, cash, rules, costs)
+            for s, size in zip(seeds, sizes)]
+
+    result = MonteCarloResult(initial_equity, horizon)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            result.merge(summarize_chunk(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=mp_context) as pool:
+            for part in pool.map(summarize_chunk, *zip(*jobs)):
+                result.merge(part)
+    return result
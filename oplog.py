@@ -0,0 +1,495 @@
+"""Operation log: undo/redo of user actions and headless session replay.
+
+Usage:
+    python oplog.py trade_data_oplog.jsonl --fee-rate 0.0001 0.001 --slippage 0 0.02
+
+Every action that changes the account or the market is appended to
+``OperationLog`` as one plain dict: fills (manual buys and sells, executed
+pending orders, auto-trading rules), placed and cancelled orders, date
+changes, news events, splits and dividends (and the position conversions
+they cause), settings changes and account resets. Each op carries
+what is needed to revert it: a fill keeps its quote, execution price,
+amount, fee and the ledger snapshot of its stock (plus, for order fills, the
+order as it was, so a partial fill puts back the order's full size); a
+settings change keeps the old and new values. Ops made by the engine in response to a user action
+(``engine=True``) are undone and redone together with that action.
+
+The log is a JSONL file next to the trade data. Ops are appended and undo/redo
+only append a marker line (``{"undo": n}`` / ``{"redo": n}``), so undoing the
+tail is O(1) in the length of the session. A new op after an undo drops the
+redo tail, both in memory and when the file is read back.
+
+``replay`` re-runs the fills of a recorded session headless for many cost
+variants (fee_rate, min_fee, slippage_per_share, spread_bps) at once. Decisions are taken
+from the log, not re-evaluated, so a replay needs no prices and gives the
+same result every time. Fills are made at the recorded quote with the
+``AccountPool.execute`` rules: sells are clipped to the shares held, and a
+buy that a variant cannot afford is skipped for that variant. While no buy
+is skipped the shares held do not depend on costs, so all variants are
+computed together as (fills x variants) arrays with one cumulative sum for
+cash; only variants that run short of cash are replayed fill by fill.
+Commission tiers and market impact are not replayed: every variant pays its
+flat fee_rate, as AccountPool accounts do. Splits convert the shares held
+(fractions are dropped, without cash in lieu).
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+
+import numpy as np
+
+from accounts import AccountPool, SETTING_DEFAULTS
+from costs import CostModel
+from order_matching import after_fill
+
+COST_KEYS = ("fee_rate", "min_fee", "slippage_per_share", "spread_bps")
+# Op types; "session" and "reset" start the account state a replay begins from
+OP_TYPES = ("session", "fill", "place_order", "cancel_order", "date", "add_event", "add_action", "split",
+            "settings", "reset")
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class OperationLog:
+    def __init__(self, path=None):
+        self.path = path
+        self.ops = []
+        self.cursor = 0         # ops[:cursor] are applied, ops[cursor:] can be redone
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # torn last line after a crash
+                    if "op" in entry:
+                        del self.ops[self.cursor:]
+                        self.ops.append(entry["op"])
+                        self.cursor += 1
+                    elif "undo" in entry:
+                        self.cursor = max(0, self.cursor - int(entry["undo"]))
+                    elif "redo" in entry:
+                        self.cursor = min(len(self.ops), self.cursor + int(entry["redo"]))
+        except Exception as e:
+            print(f"Failed to load operation log: {e}")
+
+    def _write(self, entry):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except Exception as e:
+            print(f"Failed to write operation log: {e}")
+
+    def __len__(self):
+        return len(self.ops)
+
+    def record(self, op_type, engine=False, **fields):
+        """Append an op (dropping the redo tail) and return it."""
+        if op_type not in OP_TYPES:
+            raise ValueError(f"Unknown operation: {op_type}")
+        op = {"type": op_type}
+        op.update(fields)
+        if engine:
+            op["engine"] = True
+        del self.ops[self.cursor:]
+        self.ops.append(op)
+        self.cursor += 1
+        self._write({"op": op})
+        return op
+
+    def can_undo(self):
+        return self.cursor > 0 and self.ops[self.cursor - 1]["type"] != "session"
+
+    def can_redo(self):
+        return self.cursor < len(self.ops)
+
+    def undo(self):
+        """Step back over the newest user op and the engine ops after it; returns them newest first."""
+        start = self.cursor
+        while start > 0:
+            start -= 1
+            if not self.ops[start].get("engine"):
+                break
+        if self.ops and self.ops[start]["type"] == "session":
+            start += 1      # the session header itself cannot be undone
+        group = self.ops[start:self.cursor][::-1]
+        if group:
+            self._write({"undo": len(group)})
+            self.cursor = start
+        return group
+
+    def redo(self):
+        """Re-apply the next user op and its engine ops; returns them oldest first."""
+        end = self.cursor
+        if end < len(self.ops):
+            end += 1
+            while end < len(self.ops) and self.ops[end].get("engine"):
+                end += 1
+        group = self.ops[self.cursor:end]
+        if group:
+            self._write({"redo": len(group)})
+            self.cursor = end
+        return group
+
+    def history(self):
+        """Applied ops in order (what a replay re-runs)."""
+        return self.ops[:self.cursor]
+
+
+# ----------------------- Applying ops to an account -----------------------
+def _remove_order(trade_manager, order_id):
+    trade_manager.pending_orders = [o for o in trade_manager.pending_orders if o.get("id") != order_id]
+
+
+def _replace_order(trade_manager, order):
+    """Put ``order`` in place of the pending order with the same id (partial fills)."""
+    trade_manager.pending_orders = [dict(order) if o.get("id") == order["id"] else o
+                                    for o in trade_manager.pending_orders]
+
+
+def apply(op, trade_manager, data_manager=None):
+    """Redo ``op`` on the account (and the data manager for events). Date ops are left to the caller."""
+    tm = trade_manager
+    kind = op["type"]
+    if kind == "fill":
+        if op.get("partial"):
+            _replace_order(tm, after_fill(op["order"], op["shares"]))
+        elif op.get("order"):
+            _remove_order(tm, op["order"]["id"])
+        tm.execute_fill(op["date"], op["code"], op["name"], op["side"], op["shares"],
+                        op["price"], op["amount"], op["fee"])
+    elif kind == "place_order":
+        tm.add_pending_order(dict(op["order"]))
+    elif kind == "cancel_order":
+        tm.remove_pending_order(op["order"]["id"])
+    elif kind == "add_event":
+        event = op["event"]
+        data_manager.add_event(event["code"], _parse_date(event["start"]), event["days"], event["impact_pct"])
+    elif kind == "add_action":
+        data_manager.add_action(dict(op["action"]))
+    elif kind == "split":
+        tm.apply_split(op["date"], op["code"], op["ratio"], op["price"])
+    elif kind == "settings":
+        tm.apply_settings(op["after"])
+    elif kind == "reset":
+        tm.reset(op["initial_cash"])
+
+
+def revert(op, trade_manager, data_manager=None):
+    """Undo ``op`` (which must be the newest applied op). Date ops are left to the caller."""
+    tm = trade_manager
+    kind = op["type"]
+    if kind == "fill":
+        if op.get("partial"):
+            _replace_order(tm, op["order"])
+        elif op.get("order"):
+            tm.pending_orders.insert(op.get("order_index", len(tm.pending_orders)), dict(op["order"]))
+        tm.revert_fill(op["code"], op["side"], op["shares"], op["amount"], op["fee"], op.get("before"))
+    elif kind == "place_order":
+        tm.remove_pending_order(op["order"]["id"])
+    elif kind == "cancel_order":
+        tm.pending_orders.insert(op.get("index", len(tm.pending_orders)), dict(op["order"]))
+        tm.save_data()
+    elif kind == "add_event":
+        data_manager.remove_event(op["event"])
+    elif kind == "add_action":
+        data_manager.remove_action(op["action"])
+    elif kind == "split":
+        tm.revert_split(op["code"], op["undo"])
+    elif kind == "settings":
+        tm.apply_settings(op["before"])
+    elif kind == "reset":
+        tm.restore_account(**op["before"])
+
+
+# ----------------------- Headless replay -----------------------
+def load_ops(path):
+    """Applied ops of a log file."""
+    return OperationLog(path).history()
+
+
+class ReplayResult:
+    def __init__(self, variants, codes, dates, equity, cash, positions, cost, realized, fees, skipped):
+        self.variants = variants
+        self.codes = codes
+        self.dates = dates          # date marked at every date change and at the end
+        self.equity = equity        # (marks x variants)
+        self.cash = cash            # per variant, after the last fill
+        self.positions = positions  # (variants x codes) shares
+        self.cost = cost            # (variants x codes) average cost basis
+        self.realized = realized    # realized P&L before fees, per variant
+        self.fees = fees
+        self.skipped = skipped      # fills a variant could not make in full
+
+    def portfolio(self, k):
+        """Positions of variant ``k`` in the TradeManager layout."""
+        return {code: {'shares': int(self.positions[k, j]), 'total_cost': float(self.cost[k, j])}
+                for j, code in enumerate(self.codes) if self.positions[k, j] > 0}
+
+    def summary(self):
+        final = self.equity[-1] if len(self.equity) else self.cash
+        return [
+            dict(variant, final_equity=float(final[k]), cash=float(self.cash[k]), realized=float(self.realized[k]),
+                 fees=float(self.fees[k]), skipped=int(self.skipped[k]))
+            for k, variant in enumerate(self.variants)
+        ]
+
+
+class _Session:
+    """The replayed part of a log as arrays: one row per fill, cost settings per fill and variant."""
+
+    def __init__(self, ops, variants):
+        start = 0
+        for i, op in enumerate(ops):
+            if op["type"] in ("session", "reset"):
+                start = i
+        # Cost settings in force at the start (a reset keeps the settings)
+        settings = {key: SETTING_DEFAULTS[key] for key in COST_KEYS}
+        for op in ops[:start + 1]:
+            changed = op.get("settings") if op["type"] == "session" else op.get("after") \
+                if op["type"] == "settings" else None
+            settings.update({k: v for k, v in (changed or {}).items() if k in COST_KEYS})
+        ops = ops[start:]
+        head = ops[0] if ops and ops[0]["type"] in ("session", "reset") else {}
+        portfolio = head.get("portfolio", {})
+        self.cash = float(head.get("cash", head.get("initial_cash", 100000.0)))
+        self.codes = list(dict.fromkeys(list(portfolio) + [op["code"] for op in ops if op["type"] == "fill"]))
+        index = {code: j for j, code in enumerate(self.codes)}
+        self.shares0 = np.zeros(len(self.codes), dtype=np.int64)
+        self.cost0 = np.zeros(len(self.codes))
+        for code, info in portfolio.items():
+            self.shares0[index[code]] = int(info["shares"])
+            self.cost0[index[code]] = float(info["total_cost"])
+
+        current = {key: np.array([float(v.get(key, settings[key])) for v in variants]) for key in COST_KEYS}
+        overridden = {key: np.array([key in v for v in variants]) for key in COST_KEYS}
+        code_ix, qty, quote, rows = [], [], [], {key: [] for key in COST_KEYS}
+        self.marks = []             # (date, fills before the mark)
+        self.splits = []            # (fills before, marks before, code index, ratio, price)
+        last_date = None
+        for op in ops:
+            kind = op["type"]
+            if kind == "fill":
+                code_ix.append(index[op["code"]])
+                qty.append(op["shares"] if op["side"] == "Buy" else -op["shares"])
+                quote.append(op["quote"])
+                for key in COST_KEYS:
+                    rows[key].append(current[key])
+                last_date = op["date"]
+            elif kind == "settings":
+                for key in COST_KEYS:
+                    if key in op["after"]:
+                        current[key] = np.where(overridden[key], current[key], float(op["after"][key]))
+            elif kind == "date":
+                self.marks.append((op["from"], len(qty)))
+                last_date = op["to"]
+            elif kind == "split" and op["code"] in index:
+                self.splits.append((len(qty), len(self.marks), index[op["code"]], float(op["ratio"]), float(op["price"])))
+        if last_date is not None:
+            self.marks.append((last_date, len(qty)))
+        self.code_ix = np.array(code_ix, dtype=np.int64)
+        self.qty = np.array(qty, dtype=np.int64)
+        self.quote = np.array(quote, dtype=float)
+        shape = (len(qty), len(variants))
+        self.settings = {key: np.array(rows[key]).reshape(shape) for key in COST_KEYS}
+
+
+def _catch_up(s, k, m, sp, held, mark):
+    """Take the marks and apply the splits logged before fill ``k`` (in log order); returns the new (m, sp)."""
+    while True:
+        if sp < len(s.splits) and s.splits[sp][0] == k and s.splits[sp][1] == m:
+            _, _, j, ratio, _ = s.splits[sp]
+            held[j] = int(held[j] * ratio + 1e-9)
+            sp += 1
+        elif m < len(s.marks) and s.marks[m][1] == k:
+            mark(m)
+            m += 1
+        else:
+            return m, sp
+
+
+def _replay_all(s, mark_prices):
+    """All variants at once, assuming no variant ever lacks the cash for a buy.
+
+    Shares held then do not depend on costs, so the fills are the same for
+    every variant and cash is a cumulative sum. Returns the results and a
+    mask of the variants for which the assumption failed.
+    """
+    n, n_codes = len(s.qty), len(s.codes)
+    held = s.shares0.tolist()
+    filled = np.zeros(n, dtype=np.int64)
+    factor = np.ones(n)         # share of a position's cost kept by each sell
+    positions_at = []
+
+    def mark(m):
+        positions_at.append(list(held))
+
+    m = sp = 0
+    for k, (j, q) in enumerate(zip(s.code_ix.tolist(), s.qty.tolist())):
+        m, sp = _catch_up(s, k, m, sp, held, mark)
+        if q > 0:
+            held[j] += q
+            filled[k] = q
+        else:
+            sold = min(-q, held[j])
+            if held[j] > 0:
+                factor[k] = (held[j] - sold) / held[j]
+            held[j] -= sold
+            filled[k] = -sold
+    _catch_up(s, n, m, sp, held, mark)
+
+    buy = (filled > 0)[:, None]
+    _, gross, fee = CostModel(**s.settings).price(s.quote[:, None], np.abs(filled)[:, None], buy)
+    cash_path = s.cash + np.cumsum(np.where(buy, -(gross + fee), gross - fee), axis=0)
+    short = (np.where(buy, cash_path, np.inf) < 1e-9).any(axis=0) if n else np.zeros(gross.shape[1], dtype=bool)
+
+    # Average cost: a buy's amount survives every later sell of the code scaled by that sell's factor
+    keep = np.ones(n)
+    running = np.ones(n_codes)
+    for k in range(n - 1, -1, -1):
+        j = s.code_ix[k]
+        keep[k] = running[j]
+        running[j] *= factor[k]
+    buys = filled > 0
+    cost = np.zeros((n_codes, gross.shape[1]))
+    np.add.at(cost, s.code_ix[buys], gross[buys] * keep[buys, None])
+    cost += (s.cost0 * running)[:, None]
+    sell_gross = np.where(buy, 0.0, gross).sum(axis=0)
+    buy_gross = np.where(buy, gross, 0.0).sum(axis=0)
+    realized = sell_gross - (s.cost0.sum() + buy_gross - cost.sum(axis=0))
+
+    equity = np.empty((len(s.marks), gross.shape[1]))
+    for m, (_, count) in enumerate(s.marks):
+        cash = cash_path[count - 1] if count else np.full(gross.shape[1], s.cash)
+        equity[m] = cash + np.asarray(positions_at[m]) @ mark_prices[m]
+    final_cash = cash_path[-1] if n else np.full(gross.shape[1], s.cash)
+    positions = np.tile(np.array(held, dtype=np.int64), (gross.shape[1], 1))
+    skipped = np.full(gross.shape[1], int((filled != s.qty).sum()))
+    return (equity, final_cash, positions, cost.T, realized, fee.sum(axis=0), skipped), short
+
+
+def _replay_one(s, k, mark_prices):
+    """One variant fill by fill with AccountPool.execute rules (buys skipped when cash is short)."""
+    cash = s.cash
+    held = s.shares0.tolist()
+    cost = s.cost0.tolist()
+    realized = fees = 0.0
+    skipped = 0
+    equity = np.empty(len(s.marks))
+    rows = [dict(zip(COST_KEYS, row)) for row in zip(*(s.settings[key][:, k].tolist() for key in COST_KEYS))]
+
+    def mark(m):
+        equity[m] = cash + np.asarray(held) @ mark_prices[m]
+
+    m = sp = 0
+    for i, (j, q, quote) in enumerate(zip(s.code_ix.tolist(), s.qty.tolist(), s.quote.tolist())):
+        m, sp = _catch_up(s, i, m, sp, held, mark)
+        shares = q if q > 0 else min(-q, held[j])
+        _, gross, fee = CostModel(**rows[i]).fill(quote, shares, 'Buy' if q > 0 else 'Sell')
+        if q > 0:
+            if gross + fee > cash:
+                skipped += 1
+                continue
+            held[j] += shares
+            cost[j] += gross
+            cash -= gross + fee
+        else:
+            if shares < -q:
+                skipped += 1
+            if shares == 0:
+                continue
+            released = cost[j] * shares / held[j]
+            realized += gross - released
+            held[j] -= shares
+            cost[j] = cost[j] - released if held[j] > 0 else 0.0
+            cash += gross - fee
+        fees += fee
+    _catch_up(s, len(s.qty), m, sp, held, mark)
+    return equity, cash, np.array(held, dtype=np.int64), np.array(cost), realized, fees, skipped
+
+
+def replay(ops, variants=({},), data_manager=None):
+    """Re-run the fills of ``ops`` for every cost variant ({fee_rate, min_fee, slippage_per_share, spread_bps}).
+
+    The replay starts at the last "session" or "reset" op. Settings missing
+    from a variant follow the recorded settings changes. Equity is marked at
+    every date change and at the end, at the recorded quotes or at the data
+    manager's closes when one is given.
+    """
+    variants = [dict(v) for v in variants] or [{}]
+    for v in variants:
+        unknown = set(v) - set(COST_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown cost settings: {sorted(unknown)}")
+    s = _Session(ops, variants)
+
+    # Mark prices: closes if available, else the last recorded quote, else the seeded average cost
+    with np.errstate(invalid="ignore", divide="ignore"):
+        last = np.where(s.shares0 > 0, s.cost0 / s.shares0, 0.0)
+    pool = AccountPool(data_manager, codes=s.codes, capacity=1) if data_manager is not None else None
+    last_at = np.zeros(len(s.codes), dtype=np.int64)     # fills before the quote in ``last``
+    mark_prices = []
+    start = sp = 0
+    for m, (date, count) in enumerate(s.marks):
+        # Newest quote of every code traded since the previous mark
+        codes, first = np.unique(s.code_ix[start:count][::-1], return_index=True)
+        last[codes] = s.quote[start:count][::-1][first]
+        last_at[codes] = count - first
+        start = count
+        # A split since that quote: the ex-date price is in the new share units
+        while sp < len(s.splits) and s.splits[sp][1] <= m:
+            k, _, j, _, price = s.splits[sp]
+            if last_at[j] <= k:
+                last[j], last_at[j] = price, k
+            sp += 1
+        prices = last.copy()
+        if pool is not None:
+            closes = pool.price_vector(_parse_date(date))
+            prices = np.where(np.isnan(closes), prices, closes)
+        mark_prices.append(prices)
+
+    results, short = _replay_all(s, mark_prices)
+    equity, cash, positions, cost, realized, fees, skipped = results
+    for k in np.flatnonzero(short).tolist():
+        # Some buy did not fit this variant's cash: replay it fill by fill
+        equity[:, k], cash[k], positions[k], cost[k], realized[k], fees[k], skipped[k] = _replay_one(s, k, mark_prices)
+    dates = [_parse_date(d) for d, _ in s.marks]
+    return ReplayResult(variants, s.codes, dates, equity, cash, positions, cost, realized, fees, skipped)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="operation log (JSONL)")
+    parser.add_argument("--fee-rate", type=float, nargs="+", help="fee rates to try")
+    parser.add_argument("--min-fee", type=float, nargs="+", help="minimum fees to try")
+    parser.add_argument("--slippage", type=float, nargs="+", help="slippage per share values to try")
+    parser.add_argument("--spread-bps", type=float, nargs="+", help="bid/ask spreads (bps) to try")
+    args = parser.parse_args(argv)
+
+    axes = [(key, values) for key, values in
+            (("fee_rate", args.fee_rate), ("min_fee", args.min_fee), ("slippage_per_share", args.slippage),
+             ("spread_bps", args.spread_bps))
+            if values]
+    variants = [dict(zip([k for k, _ in axes], combo)) for combo in itertools.product(*(v for _, v in axes))]
+    result = replay(load_ops(args.path), variants)
+    for row in result.summary():
+        costs = ", ".join(f"{key}={row[key]:g}" for key in COST_KEYS if key in row) or "recorded costs"
+        print(f"{costs}: equity {row['final_equity']:,.2f}, cash {row['cash']:,.2f}, "
+              f"fees {row['fees']:,.2f}, {row['skipped']} fills skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Volume-constrained matching of resting limit / stop orders.
+
+Without a participation rate every triggered order fills in full at the
+day's price. With ``participation`` > 0 the account trades at most
+``participation * bar volume`` shares of a ticker per day. Triggered orders
+share that capacity in queue order, oldest first. The part that does not fit
+stays on the order (``shares`` is the remaining quantity, ``filled`` what has
+executed so far, ``status`` "partial") and is matched again on later days.
+
+Matching works on arrays. ``OrderBook`` encodes the resting orders once per
+pass (ticker index, side, type, limit price, remaining shares). Triggers are
+one comparison over all orders. Capacity is aggregated per ticker, not per
+order: bar volumes are looked up once per triggered ticker, and the shares
+already traded today come from one ``bincount`` over the trade log, so
+repeated passes on the same day (and undo) see the liquidity that is left.
+A stable sort by ticker and a cumulative sum split each ticker's capacity
+among its orders. ``allocate`` does not know the account's cash and
+holdings. When the simulator skips an allocated order for lack of either,
+it hands that order's share of the capacity back to the later orders on
+the same ticker.
+"""
+import numpy as np
+
+ORDER_TYPES = ("limit", "stop_loss", "take_profit")
+
+
+class OrderBook:
+    """Resting orders as parallel arrays, one row per order in queue order."""
+
+    def __init__(self, orders):
+        self.orders = orders
+        index = {}
+        self.code_ix = np.array([index.setdefault(o.get("code"), len(index)) for o in orders], dtype=np.intp)
+        self.codes = list(index)
+        self.buy = np.array([o.get("side", "Buy") == "Buy" for o in orders], dtype=bool)
+        self.kind = np.array([ORDER_TYPES.index(o.get("type", "limit")) if o.get("type", "limit") in ORDER_TYPES
+                              else -1 for o in orders], dtype=np.int8)
+        self.limit = np.array([float(o.get("price", 0)) for o in orders], dtype=float)
+        self.shares = np.array([int(o.get("shares", 0)) for o in orders], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.orders)
+
+    def triggered(self, quotes):
+        """Mask of orders whose condition holds at ``quotes`` (one price per ``codes`` entry, NaN = no quote).
+
+        Limit buys trigger at or below the limit, limit sells and take-profits at
+        or above it, stop-losses at or below the trigger price.
+        """
+        quote = np.asarray(quotes, dtype=float)[self.code_ix]
+        below = quote <= self.limit
+        above = quote >= self.limit
+        limit = self.kind == 0
+        stop = (self.kind == 1) & ~self.buy
+        take = (self.kind == 2) & ~self.buy
+        return (limit & np.where(self.buy, below, above)) | (stop & below) | (take & above)
+
+    def allocate(self, mask, capacity=None):
+        """Shares to fill now for each order: its remaining shares if ``mask``, within the ticker's ``capacity``.
+
+        ``capacity``: shares still tradable today per ``codes`` entry (None = unlimited).
+        """
+        want = np.where(mask, self.shares, 0)
+        if capacity is None or not len(want):
+            return want
+        order = np.argsort(self.code_ix, kind="stable")
+        code = self.code_ix[order]
+        qty = want[order]
+        ahead = np.cumsum(qty) - qty
+        starts = np.flatnonzero(np.r_[True, code[1:] != code[:-1]])
+        # Shares requested by earlier orders on the same ticker
+        ahead -= np.repeat(ahead[starts], np.diff(np.r_[starts, len(code)]))
+        fill = np.empty_like(want)
+        fill[order] = np.clip(np.asarray(capacity, dtype=float)[code] - ahead, 0, qty).astype(np.int64)
+        return fill
+
+
+def traded_shares(store, date, codes):
+    """Shares of each of ``codes`` traded on ``date`` according to a TradeStore."""
+    if not len(store):
+        return np.zeros(len(codes))
+    today = store.dates == date.toordinal()
+    per_id = np.bincount(store.code_ids[today], weights=store.shares[today], minlength=len(store.codes))
+    ids = [store.code_id(code) for code in codes]
+    return np.array([per_id[i] if i is not None else 0.0 for i in ids])
+
+
+def daily_capacity(volume, participation, traded=0.0):
+    """Shares still tradable today: ``participation`` of the bar volume minus what was already traded.
+
+    A NaN volume (unknown) leaves the ticker unconstrained.
+    """
+    volume = np.asarray(volume, dtype=float)
+    cap = np.floor(np.maximum(volume * participation - traded, 0.0))
+    return np.where(np.isnan(volume), np.inf, cap)
+
+
+def after_fill(order, shares):
+    """Copy of ``order`` after ``shares`` of it were filled and the rest stays open."""
+    return dict(order, shares=int(order.get("shares", 0)) - int(shares),
+                filled=int(order.get("filled", 0)) + int(shares), status="partial")
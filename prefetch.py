@@ -0,0 +1,87 @@
+"""Background warming of the trading sessions next to the current date.
+
+While the user stays on date D, ``Prefetcher`` loads the prices of the
+previous and next sessions, and their K-line windows, for the whole
+universe. It runs on a small worker pool. Each ``schedule`` or ``cancel``
+call bumps a generation counter. Workers check it between stocks and stop
+as soon as their generation is stale. Cache writes inside a job are
+batched into a single save with ``StockDataManager.deferred_saves``.
+"""
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count
+
+
+class Prefetcher:
+    def __init__(self, data_manager, max_workers=2, neighbors=(1, -1), history_days=60):
+        self.data_manager = data_manager
+        self.neighbors = neighbors
+        self.history_days = history_days
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def schedule(self, center_date, codes=None):
+        """Cancel earlier work and start warming the sessions around ``center_date``."""
+        calendar = self.data_manager.calendar
+        codes = list(codes if codes is not None else self.data_manager.get_stock_list())
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        for offset in self.neighbors:
+            try:
+                target = calendar.offset(center_date, offset)
+            except ValueError:
+                continue
+            if self.is_warm(target, codes):
+                continue
+            self._executor.submit(self._warm, generation, target, codes)
+
+    def cancel(self):
+        """Make all queued and running jobs stop at their next check."""
+        with self._lock:
+            self._generation += 1
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _stale(self, generation):
+        return generation != self._generation
+
+    def _warm(self, generation, target, codes):
+        dm = self.data_manager
+        end = datetime.datetime.combine(target, datetime.time())
+        try:
+            with dm.deferred_saves():
+                for code in codes:
+                    if self._stale(generation):
+                        return
+                    dm.get_stock_data(code, target)
+                    # K-line window shown when ``target`` becomes the current date
+                    dm.get_stock_history(code, end, window_days=self.history_days)
+                    # Let the UI and loader threads take the GIL between stocks
+                    time.sleep(0)
+            count("prefetch.warmed_date")
+        except Exception as e:
+            print(f"Failed to prefetch {target}: {e}")
+
+    def is_warm(self, date, codes=None):
+        """True if every code already has a cached price for ``date``'s session."""
+        dm = self.data_manager
+        date_str = dm.session_date(date).strftime("%Y-%m-%d")
+        day = dm.get_cached_day(date_str)
+        if not day:
+            return False
+        codes = codes if codes is not None else dm.get_stock_list()
+        return all(code in day for code in codes)
+
+    def record_lookup(self, date):
+        """Count a day-step against the prefetch hit rate; returns whether ``date`` was warm."""
+        warm = self.is_warm(date)
+        count("prefetch.hit" if warm else "prefetch.miss")
+        return warm
+
@@ -0,0 +1,244 @@
+"""Bulk import of historical daily bars from CSV or Parquet into the price cache.
+
+Usage:
+    python price_import.py prices.csv                     # columns: code, date, open, high, low, close, volume
+    python price_import.py AAPL.csv MSFT.csv --code-from-filename
+    python price_import.py bars.parquet --storage sqlite --chunk-rows 500000
+
+Files are streamed in chunks (``pandas.read_csv(chunksize=...)``, or
+pyarrow's ``iter_batches`` for Parquet), so memory use is bounded by the
+chunk size rather than the file size. Each chunk is:
+
+* normalized: column names are matched case-insensitively against common
+  aliases (``ticker``/``symbol`` -> code, ``Adj Close`` is ignored in
+  favour of ``close``), dates become ``YYYY-MM-DD`` strings, and missing
+  open/high/low default to the close;
+* validated: rows without a date, code or positive close, with high < low,
+  or repeated (code, date) pairs are dropped and counted;
+* given ``change_percent`` vectorized from the previous close of the same
+  code. The last close of every code is carried across chunks, so files
+  sorted by code and date get the same values as a single pass;
+* written in one batch with ``StockDataManager.cache_prices`` (closes) and
+  ``cache_bars`` (full OHLCV bars, see bars.py): one ``executemany``
+  transaction per chunk with the SQLite store, or a single save at the end
+  of the import otherwise.
+
+Only the imported codes get prices on those dates. The simulator treats
+such a day as partial: the rest of the universe is still fetched or
+generated when the date is loaded.
+
+Progress (rows, rows/s, dropped rows) is printed after every chunk.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from bars import bars_from_frame
+from instrumentation import count, timed
+
+DEFAULT_CHUNK_ROWS = 200_000
+
+COLUMN_ALIASES = {
+    "code": ("code", "ticker", "symbol", "stock_code"),
+    "date": ("date", "datetime", "timestamp", "trade_date", "day"),
+    "open": ("open", "open_price"),
+    "high": ("high", "high_price"),
+    "low": ("low", "low_price"),
+    "close": ("close", "close_price", "price"),
+    "volume": ("volume", "vol"),
+}
+BAR_COLUMNS = ("code", "date", "open", "high", "low", "close", "volume")
+
+
+def _column_map(columns):
+    """{source column: normalized name} for the columns present in a file."""
+    lookup = {str(c).strip().lower().replace(" ", "_"): c for c in columns}
+    mapping = {}
+    for name, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lookup:
+                mapping[lookup[alias]] = name
+                break
+    return mapping
+
+
+def normalize_chunk(chunk, code=None):
+    """Return (bars, dropped): a clean frame with BAR_COLUMNS and the number of rejected rows."""
+    mapping = _column_map(chunk.columns)
+    frame = chunk[list(mapping)].rename(columns=mapping).copy()
+    if code is not None:
+        frame["code"] = code
+    missing = [c for c in ("code", "date", "close") if c not in frame.columns]
+    if missing:
+        raise ValueError(f"missing required column(s): {', '.join(missing)}")
+
+    n = len(frame)
+    frame["code"] = frame["code"].astype(str).str.strip()
+    frame["date"] = pd.to_datetime(frame["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    close = pd.to_numeric(frame["close"], errors="coerce").astype(float)
+    frame["close"] = close
+    for col in ("open", "high", "low"):
+        frame[col] = pd.to_numeric(frame[col], errors="coerce").fillna(close) if col in frame else close
+    if "volume" in frame:
+        frame["volume"] = pd.to_numeric(frame["volume"], errors="coerce").fillna(0).astype(np.int64)
+    else:
+        frame["volume"] = np.zeros(n, dtype=np.int64)
+
+    valid = (
+        frame["date"].notna()
+        & (frame["code"] != "") & (frame["code"] != "nan")
+        & np.isfinite(close) & (close > 0)
+        & (frame["high"] >= frame["low"])
+    )
+    frame = frame[valid]
+    frame = frame.drop_duplicates(["code", "date"], keep="last")
+    return frame[list(BAR_COLUMNS)], n - len(frame)
+
+
+def add_change_percent(bars, last_close):
+    """Return ``bars`` sorted by code and date with change_percent vs. the previous close.
+
+    ``last_close`` maps code -> (date, close) of the last bar seen in earlier
+    chunks and is updated with this chunk's last bar per code. A code's first
+    bar with no earlier close gets 0.
+    """
+    bars = bars.sort_values(["code", "date"], kind="stable")
+    codes = bars["code"].to_numpy()
+    dates = bars["date"].to_numpy()
+    close = bars["close"].to_numpy(dtype=float)
+
+    prev = np.empty(len(close))
+    prev[1:] = close[:-1]
+    first = np.ones(len(close), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    # First bar of each code: continue from the previous chunk if it ended earlier
+    for i in np.flatnonzero(first):
+        carried = last_close.get(codes[i])
+        prev[i] = carried[1] if carried is not None and carried[0] < dates[i] else np.nan
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = (close - prev) / prev * 100
+    bars = bars.assign(change_percent=np.where(np.isfinite(change), change, 0.0))
+
+    last = np.ones(len(close), dtype=bool)
+    last[:-1] = codes[1:] != codes[:-1]
+    for i in np.flatnonzero(last):
+        carried = last_close.get(codes[i])
+        if carried is None or carried[0] < dates[i]:
+            last_close[codes[i]] = (dates[i], close[i])
+    return bars
+
+
+def read_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, fmt=None):
+    """Yield DataFrames of at most ``chunk_rows`` rows from a CSV or Parquet file."""
+    fmt = fmt or ("parquet" if path.lower().endswith((".parquet", ".pq")) else "csv")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("reading Parquet files requires pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+class ImportProgress:
+    """Row counters and throughput for one import run."""
+
+    def __init__(self, label, echo=print):
+        self.label = label
+        self.echo = echo
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.start = time.perf_counter()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.rows_read / elapsed if elapsed > 0 else 0.0
+
+    def update(self, read, written):
+        self.rows_read += read
+        self.rows_written += written
+        self.rows_dropped += read - written
+        count("import.rows_written", written)
+        count("import.rows_dropped", read - written)
+        if self.echo:
+            self.echo(f"{self.label}: {self.rows_read:,} rows read, {self.rows_written:,} written, "
+                      f"{self.rows_dropped:,} dropped ({self.rate():,.0f} rows/s)")
+
+    def summary(self):
+        return {
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "seconds": round(time.perf_counter() - self.start, 3),
+            "rows_per_sec": round(self.rate(), 1),
+        }
+
+
+@timed("import.file")
+def import_prices(path, data_manager, code=None, chunk_rows=DEFAULT_CHUNK_ROWS, fmt=None, echo=print):
+    """Stream one CSV/Parquet file into ``data_manager``'s price cache; returns a summary dict."""
+    progress = ImportProgress(os.path.basename(path), echo)
+    last_close = {}
+    with data_manager.deferred_saves():
+        for chunk in read_chunks(path, chunk_rows, fmt):
+            bars, _ = normalize_chunk(chunk, code)
+            bars = add_change_percent(bars, last_close)
+            rows = list(zip(
+                bars["code"].tolist(),
+                bars["date"].tolist(),
+                bars["close"].tolist(),
+                bars["change_percent"].tolist(),
+            ))
+            if rows:
+                data_manager.cache_prices(rows)
+                for bar_code, group in bars.groupby("code", sort=False):
+                    data_manager.cache_bars(bar_code, bars_from_frame(group))
+            progress.update(len(chunk), len(rows))
+    return progress.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="CSV or Parquet files")
+    parser.add_argument("--code", help="stock code for files without a code column")
+    parser.add_argument("--code-from-filename", action="store_true",
+                        help="use each file's name (without extension) as its stock code")
+    parser.add_argument("--format", choices=("csv", "parquet"), help="override detection by extension")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows per chunk/batch")
+    parser.add_argument("--storage", choices=("json", "sqlite"),
+                        help="price store (default: STOCK_SIM_STORAGE, else json)")
+    parser.add_argument("--data-file", default="stock_data.json", help="JSON price file (json storage)")
+    parser.add_argument("--quiet", action="store_true", help="only print the final summary")
+    args = parser.parse_args(argv)
+
+    from mock import StockDataManager
+    dm = StockDataManager(data_file=args.data_file, use_mock_data=True, storage=args.storage)
+    echo = None if args.quiet else print
+    totals = {"rows_read": 0, "rows_written": 0, "rows_dropped": 0}
+    start = time.perf_counter()
+    for path in args.paths:
+        code = args.code
+        if args.code_from_filename:
+            code = os.path.splitext(os.path.basename(path))[0].upper()
+        try:
+            summary = import_prices(path, dm, code=code, chunk_rows=args.chunk_rows, fmt=args.format, echo=echo)
+        except Exception as e:
+            print(f"Failed to import {path}: {e}")
+            continue
+        for key in totals:
+            totals[key] += summary[key]
+    elapsed = time.perf_counter() - start
+    rate = totals["rows_read"] / elapsed if elapsed > 0 else 0.0
+    print(f"Imported {totals['rows_written']:,} of {totals['rows_read']:,} rows "
+          f"({totals['rows_dropped']:,} dropped) in {elapsed:.1f}s, {rate:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Virtualized, searchable quote board for large stock universes.
+
+``QuoteIndex`` holds the universe in code-indexed arrays. It has codes,
+names, prices and change_percent (NumPy) and a sorted search key list. It
+answers "which rows, in which order" for a search query and sort order:
+
+* prefix matches on code or name come from ``bisect`` over the sorted keys,
+  and substring matches are listed after them;
+* a query that extends the previous one only filters the previous result;
+* sorting by change_percent is one ``argsort``.
+
+``QuoteBoard`` is the Tk widget: a search box, a sort selector and a
+Listbox that only ever holds the rows that fit on screen. Scrolling moves
+a window over the current view and rewrites those few rows, so filling or
+refreshing the board costs the same for 20 tickers or 20,000. Selection is
+tracked by stock code, not by row position.
+"""
+import bisect
+import tkinter as tk
+import tkinter.font as tkfont
+from tkinter import ttk
+
+import numpy as np
+
+SORT_ORDERS = {
+    "Universe order": None,
+    "Change % (high → low)": "change_desc",
+    "Change % (low → high)": "change_asc",
+    "Code (A → Z)": "code",
+}
+
+
+class QuoteIndex:
+    def __init__(self):
+        self.codes = []
+        self.names = []
+        self.row = {}
+        self.prices = np.zeros(0)
+        self.changes = np.zeros(0)
+        self._keys = []          # sorted (lowercase key, row) for prefix search
+        self._haystack = []      # "code name" per row, lowercase, for substring search
+        self._last_query = None
+        self._last_hits = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def set_universe(self, stocks):
+        """Rebuild from {code: {"name", "price", "change_percent"}} (dict order = universe order)."""
+        self.codes = list(stocks)
+        self.names = [str(stocks[c].get("name", c)) for c in self.codes]
+        self.row = {code: i for i, code in enumerate(self.codes)}
+        self.prices = np.array([float(stocks[c]["price"]) for c in self.codes])
+        self.changes = np.array([float(stocks[c]["change_percent"]) for c in self.codes])
+        keys = [(code.lower(), i) for i, code in enumerate(self.codes)]
+        keys += [(name.lower(), i) for i, name in enumerate(self.names)]
+        self._keys = sorted(keys)
+        self._haystack = [f"{code} {name}".lower() for code, name in zip(self.codes, self.names)]
+        self._last_query = None
+        self._last_hits = None
+
+    def update_quotes(self, stocks):
+        """Update prices in place; returns the rows whose quote changed (None if the universe changed)."""
+        if list(stocks) != self.codes:
+            self.set_universe(stocks)
+            return None
+        prices = np.array([float(stocks[c]["price"]) for c in self.codes])
+        changes = np.array([float(stocks[c]["change_percent"]) for c in self.codes])
+        changed = np.flatnonzero((prices != self.prices) | (changes != self.changes))
+        self.prices = prices
+        self.changes = changes
+        return changed
+
+    def search(self, query):
+        """Rows matching ``query``: prefix matches first (sorted key order), then substring matches."""
+        query = query.strip().lower()
+        if not query:
+            return np.arange(len(self.codes))
+        if self._last_query and query.startswith(self._last_query):
+            # Narrowing the previous query: only its hits can still match
+            candidates = self._last_hits
+        else:
+            candidates = range(len(self.codes))
+        lo = bisect.bisect_left(self._keys, (query,))
+        hi = bisect.bisect_left(self._keys, (query + "\uffff",))
+        prefix = list(dict.fromkeys(i for _, i in self._keys[lo:hi]))
+        seen = set(prefix)
+        hay = self._haystack
+        rest = [i for i in candidates if i not in seen and query in hay[i]]
+        hits = np.array(prefix + rest, dtype=np.int64)
+        self._last_query = query
+        self._last_hits = hits.tolist()
+        return hits
+
+    def view(self, query="", order=None):
+        """Row indices in display order for a search query and sort order."""
+        rows = self.search(query)
+        if order == "change_desc":
+            rows = rows[np.argsort(-self.changes[rows], kind="stable")]
+        elif order == "change_asc":
+            rows = rows[np.argsort(self.changes[rows], kind="stable")]
+        elif order == "code":
+            rows = rows[np.argsort(np.array(self.codes, dtype=object)[rows], kind="stable")]
+        return rows
+
+
+class QuoteBoard(tk.Frame):
+    """Search box + sort selector + virtualized quote list."""
+
+    def __init__(self, master, on_select=None, bg="white", fg="black", select_bg="#ddd",
+                 up_color="red", down_color="green", font=("Consolas", 11)):
+        super().__init__(master, bg=bg)
+        self.index = QuoteIndex()
+        self.on_select = on_select
+        self.up_color = up_color
+        self.down_color = down_color
+        self.fg = fg
+        self.selected = None
+        self.rows = np.zeros(0, dtype=np.int64)   # current view (row indices into the index)
+        self.offset = 0
+        self.visible = 20
+        self._font = tkfont.Font(font=font)
+
+        controls = tk.Frame(self, bg=bg)
+        controls.pack(fill=tk.X, padx=5)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *_: self.refresh_view())
+        search = tk.Entry(controls, textvariable=self.search_var, font=font, relief="flat")
+        search.pack(side=tk.LEFT, fill=tk.X, expand=True, pady=(0, 4))
+        self.sort_var = tk.StringVar(value=next(iter(SORT_ORDERS)))
+        sort_box = ttk.Combobox(controls, textvariable=self.sort_var, values=list(SORT_ORDERS),
+                                state="readonly", width=20)
+        sort_box.pack(side=tk.RIGHT, padx=(5, 0), pady=(0, 4))
+        sort_box.bind("<<ComboboxSelected>>", lambda e: self.refresh_view())
+
+        body = tk.Frame(self, bg=bg)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.listbox = tk.Listbox(
+            body, bg=bg, fg=fg, font=font, selectbackground=select_bg, selectforeground=fg,
+            activestyle="none", highlightthickness=0, relief="flat", borderwidth=0,
+            height=10, selectmode="single", exportselection=False
+        )
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=5)
+
+        self.listbox.bind("<<ListboxSelect>>", self._on_click)
+        self.listbox.bind("<Configure>", self._on_resize)
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-1))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(1))
+        self.listbox.bind("<Up>", lambda e: self._step_selection(-1))
+        self.listbox.bind("<Down>", lambda e: self._step_selection(1))
+        search.bind("<Down>", lambda e: self._step_selection(1))
+
+    # ----------------------- Data -----------------------
+    def set_quotes(self, stocks):
+        """Show {code: {"name", "price", "change_percent"}}; only visible rows are redrawn."""
+        changed = self.index.update_quotes(stocks)
+        if changed is None or SORT_ORDERS.get(self.sort_var.get()) is not None:
+            self.refresh_view()
+        elif len(changed):
+            self.render()
+
+    def refresh_view(self):
+        """Recompute the filtered/sorted view and redraw."""
+        self.rows = self.index.view(self.search_var.get(), SORT_ORDERS.get(self.sort_var.get()))
+        self.offset = min(self.offset, max(0, len(self.rows) - self.visible))
+        self.render()
+
+    # ----------------------- Selection -----------------------
+    def size(self):
+        return len(self.rows)
+
+    def selected_code(self):
+        return self.selected
+
+    def select_code(self, code, notify=False):
+        """Select ``code`` and scroll it into view; returns False if it is not in the current view."""
+        if code not in self.index.row:
+            return False
+        hits = np.flatnonzero(self.rows == self.index.row[code])
+        if not len(hits):
+            return False
+        self.selected = code
+        self.see(int(hits[0]))
+        if notify and self.on_select:
+            self.on_select()
+        return True
+
+    def select_index(self, position, notify=False):
+        """Select the ``position``-th row of the current view."""
+        if not len(self.rows):
+            self.selected = None
+            self.render()
+            return False
+        position = min(max(position, 0), len(self.rows) - 1)
+        return self.select_code(self.index.codes[self.rows[position]], notify)
+
+    def _step_selection(self, delta):
+        position = 0
+        if self.selected in self.index.row:
+            hits = np.flatnonzero(self.rows == self.index.row[self.selected])
+            position = int(hits[0]) + delta if len(hits) else 0
+        self.select_index(position, notify=True)
+        self.listbox.focus_set()
+        return "break"
+
+    def _on_click(self, event=None):
+        sel = self.listbox.curselection()
+        if not sel:
+            return
+        position = self.offset + sel[0]
+        if position < len(self.rows):
+            self.selected = self.index.codes[self.rows[position]]
+            if self.on_select:
+                self.on_select()
+
+    # ----------------------- Scrolling / rendering -----------------------
+    def see(self, position):
+        if position < self.offset:
+            self.offset = position
+        elif position >= self.offset + self.visible:
+            self.offset = position - self.visible + 1
+        self.render()
+
+    def scroll(self, rows):
+        self.offset = min(max(0, self.offset + rows), max(0, len(self.rows) - self.visible))
+        self.render()
+        return "break"
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.offset = int(float(value) * len(self.rows))
+            self.scroll(0)
+        elif action == "scroll":
+            self.scroll(int(value) * (self.visible if unit == "pages" else 1))
+
+    def _on_resize(self, event):
+        visible = max(1, event.height // max(1, self._font.metrics("linespace")))
+        if visible != self.visible:
+            self.visible = visible
+            self.scroll(0)
+
+    def _format(self, row):
+        code = self.index.codes[row]
+        name = self.index.names[row]
+        return f"{code:<6} {name[:18]:<18} {self.index.prices[row]:>9.2f} {self.index.changes[row]:>+7.2f}%"
+
+    def render(self):
+        """Rewrite the visible window of the view."""
+        window = self.rows[self.offset:self.offset + self.visible]
+        lb = self.listbox
+        lb.delete(0, tk.END)
+        for i, row in enumerate(window.tolist()):
+            lb.insert(tk.END, self._format(row))
+            lb.itemconfig(i, fg=self.up_color if self.index.changes[row] >= 0 else self.down_color)
+            if self.index.codes[row] == self.selected:
+                lb.selection_set(i)
+        total = max(1, len(self.rows))
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible) / total))
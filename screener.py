@@ -0,0 +1,410 @@
+"""Vectorized cross-sectional screener over the whole universe.
+
+A screen is a filter expression plus a ranking expression, for example::
+
+    screener.screen("change_percent > 2 and volume_ratio_20 > 1.5", date, rank_by="ret_5")
+
+Expressions are evaluated over a (sessions x codes) panel that ends on
+``date``. Every column is one NumPy pass over the panel, so a screen of
+5000 tickers takes milliseconds once the panel is warm:
+
+* Panel rows are cached per session (close, change %, volume for every
+  code). Moving to the next day builds one new row and reuses the rest.
+  Rows come from real bars where cached (bars.py), from the correlated mock
+  market in one block (market_sim.py), or from the price cache. Volume rows
+  are only built for screens that use volume. Without a real bar, volume is
+  the same synthetic volume the K-line chart shows.
+* Rows hold raw prices. A panel is adjusted for the splits and dividends up
+  to its end date (corporate_actions.py) with one multiply at read time, so
+  a window never straddles a split with mixed units.
+* Derived columns (returns, rolling highs, indicators, ...) are cached per
+  window. Screens that share a column compute it once.
+* Expressions are parsed with ``ast`` and only a whitelist of nodes is
+  evaluated (arithmetic, comparisons, and/or/not, abs/min/max, column
+  names, numbers), so nothing in an expression can run arbitrary code.
+
+Columns (``N`` = number of sessions; the default is used when omitted):
+
+========================  ==================================================
+close, volume             closing price, volume
+change_percent            daily change %
+ret_N                     N-session return % (default 20)
+high_N / low_N            highest / lowest close of the last N sessions
+from_high_N / from_low_N  % distance of the close from high_N / low_N
+avg_volume_N              mean volume of the N sessions before today
+volume_ratio_N            volume / avg_volume_N
+volatility_N              annualized volatility % of N daily log returns
+sma_N, ema_N, rsi_N       indicators (indicators.py)
+bb_upper_N, bb_mid_N,     Bollinger Bands (k = 2)
+bb_lower_N
+========================  ==================================================
+"""
+import ast
+import datetime
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from indicators import batch, warmup_bars
+from instrumentation import timed
+
+TRADING_DAYS = 252
+DEFAULT_LOOKBACK = 60
+_NAME = re.compile(r"^([a-z_]+?)(?:_(\d+))?$")
+
+
+def _shift(x, n):
+    """``x`` shifted down by ``n`` rows (NaN on top)."""
+    out = np.full(x.shape, np.nan)
+    if n < len(x):
+        out[n:] = x[:len(x) - n]
+    return out
+
+
+def _rolling(x, n, func):
+    """``func`` over trailing windows of ``n`` rows (NaN until the window is full)."""
+    out = np.full(x.shape, np.nan)
+    if n <= len(x):
+        windows = np.lib.stride_tricks.sliding_window_view(x, n, axis=0)
+        out[n - 1:] = func(windows, axis=-1)
+    return out
+
+
+def _ret(p, n):
+    return (p.close / _shift(p.close, n) - 1.0) * 100
+
+
+def _avg_volume(p, n):
+    return _shift(_rolling(p.volume, n, np.mean), 1)
+
+
+def _volatility(p, n):
+    log_ret = np.log(p.close / _shift(p.close, 1))
+    return _rolling(log_ret, n, np.std) * np.sqrt(TRADING_DAYS) * 100
+
+
+def _indicator(name, output):
+    return lambda p, n: batch((name, n), p.close)[output]
+
+
+# name: (function(panel, n), default n, sessions needed for n)
+COLUMNS = {
+    "close": (lambda p, n: p.close, None, lambda n: 1),
+    "volume": (lambda p, n: p.volume, None, lambda n: 1),
+    "change_percent": (lambda p, n: p.change, None, lambda n: 1),
+    "ret": (_ret, 20, lambda n: n + 1),
+    "high": (lambda p, n: _rolling(p.close, n, np.max), 60, lambda n: n),
+    "low": (lambda p, n: _rolling(p.close, n, np.min), 60, lambda n: n),
+    "from_high": (lambda p, n: (p.close / _rolling(p.close, n, np.max) - 1.0) * 100, 60, lambda n: n),
+    "from_low": (lambda p, n: (p.close / _rolling(p.close, n, np.min) - 1.0) * 100, 60, lambda n: n),
+    "avg_volume": (_avg_volume, 20, lambda n: n + 1),
+    "volume_ratio": (lambda p, n: p.volume / _avg_volume(p, n), 20, lambda n: n + 1),
+    "volatility": (_volatility, 20, lambda n: n + 1),
+    "sma": (_indicator("sma", "value"), 20, lambda n: warmup_bars(("sma", n))),
+    "ema": (_indicator("ema", "value"), 20, lambda n: warmup_bars(("ema", n))),
+    "rsi": (_indicator("rsi", "value"), 14, lambda n: warmup_bars(("rsi", n)) + 1),
+    "bb_upper": (_indicator("bollinger", "upper"), 20, lambda n: n),
+    "bb_mid": (_indicator("bollinger", "mid"), 20, lambda n: n),
+    "bb_lower": (_indicator("bollinger", "lower"), 20, lambda n: n),
+}
+
+VOLUME_COLUMNS = ("volume", "avg_volume", "volume_ratio")
+
+
+def parse_column(name):
+    """(base, n) of a column name such as ``ret_20``; raises ValueError for unknown columns."""
+    m = _NAME.match(name)
+    if m and m.group(1) in COLUMNS:
+        base, n = m.group(1), m.group(2)
+    elif name in COLUMNS:
+        base, n = name, None
+    else:
+        raise ValueError(f"Unknown screener column: {name}")
+    default = COLUMNS[base][1]
+    if n is not None and default is None:
+        raise ValueError(f"Column {base} takes no period: {name}")
+    n = int(n) if n is not None else default
+    if n is not None and n < 1:
+        raise ValueError(f"Period must be positive: {name}")
+    return base, n
+
+
+# ----------------------- Expressions -----------------------
+_BINOPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+_CMPOPS = {
+    ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less,
+    ast.LtE: np.less_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+_FUNCS = {"abs": np.abs, "min": np.minimum, "max": np.maximum}
+_ALLOWED = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant,
+    *_BINOPS, *_CMPOPS,
+)
+
+
+def compile_expression(expr):
+    """Parse ``expr`` and check it against the whitelist; returns (tree, column names)."""
+    try:
+        tree = ast.parse(expr.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid screener expression {expr!r}: {e.msg}")
+    columns = set()
+    called = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED):
+            raise ValueError(f"Unsupported syntax in screener expression: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"Only numbers are allowed as constants: {node.value!r}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCS or node.keywords:
+                raise ValueError("Only abs(), min() and max() can be called")
+        elif isinstance(node, ast.Name) and id(node) not in called:
+            parse_column(node.id)
+            columns.add(node.id)
+    return tree, columns
+
+
+def _truth(value):
+    value = np.asarray(value)
+    return value if value.dtype == bool else np.isfinite(value) & (value != 0)
+
+
+def _evaluate(node, column):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, column)
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, ast.Name):
+        return column(node.id)
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = _truth(_evaluate(node.values[0], column))
+        for value in node.values[1:]:
+            result = combine(result, _truth(_evaluate(value, column)))
+        return result
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate(node.operand, column)
+        if isinstance(node.op, ast.Not):
+            return ~_truth(operand)
+        return -operand if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp):
+        return _BINOPS[type(node.op)](_evaluate(node.left, column), _evaluate(node.right, column))
+    if isinstance(node, ast.Compare):
+        # Chained comparisons (1 < x < 5) are and-ed like in Python
+        left = _evaluate(node.left, column)
+        result = None
+        for op, right_node in zip(node.ops, node.comparators):
+            right = _evaluate(right_node, column)
+            part = _CMPOPS[type(op)](left, right)
+            result = part if result is None else result & part
+            left = right
+        return result
+    if isinstance(node, ast.Call):
+        return _FUNCS[node.func.id](*(_evaluate(arg, column) for arg in node.args))
+    raise ValueError(f"Unsupported syntax in screener expression: {type(node).__name__}")
+
+
+# ----------------------- Panel -----------------------
+class Panel:
+    """(sessions x codes) close, change % and volume (None if not loaded) ending on one session."""
+
+    def __init__(self, codes, dates, close, change, volume):
+        self.codes = codes
+        self.dates = dates
+        self.close = close
+        self.change = change
+        self.volume = volume
+
+
+class Screener:
+    def __init__(self, data_manager, codes=None, lookback=DEFAULT_LOOKBACK, max_windows=8):
+        """``codes`` defaults to the data manager's universe (followed when it changes).
+
+        ``lookback`` is the default length of ``panel()``; screens load as many
+        sessions as their columns need.
+        """
+        self.data_manager = data_manager
+        self.fixed_codes = list(codes) if codes is not None else None
+        self.lookback = lookback
+        self.max_windows = max_windows
+        self.codes = []
+        self._rows = {}                 # session ordinal -> (close, change) rows
+        self._volume = {}               # session ordinal -> volume row (built only for volume screens)
+        self._columns = OrderedDict()   # (end ordinal, sessions) -> {column name: panel}
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        """Drop cached rows and columns (call after prices change, e.g. a news event)."""
+        with self._lock:
+            self._rows.clear()
+            self._volume.clear()
+            self._columns.clear()
+
+    def _sync_codes(self):
+        codes = self.fixed_codes if self.fixed_codes is not None else list(self.data_manager.get_stock_list())
+        if codes != self.codes:
+            self.codes = codes
+            self.invalidate()
+
+    def _real_bars(self, code, ordinals):
+        """(found, bar rows, previous close) of ``code``'s cached real bars at ``ordinals``."""
+        bars = self.data_manager.bars.get(code)
+        if not len(bars):
+            return np.zeros(len(ordinals), dtype=bool), None, None
+        idx = np.minimum(np.searchsorted(bars["date"], ordinals), len(bars) - 1)
+        prev = np.where(idx > 0, bars["close"][np.maximum(idx - 1, 0)], np.nan)
+        if code in self.data_manager.actions:
+            # Previous close in the units of the day, so an ex-date shows no jump
+            prev = prev * self.data_manager.actions.factors(code, bars["date"][np.maximum(idx - 1, 0)], ordinals)
+        return bars["date"][idx] == ordinals, bars[idx], prev
+
+    @timed("screener.rows")
+    def _build_rows(self, sessions):
+        """Fill the close / change % row cache for ``sessions`` (dates)."""
+        dm = self.data_manager
+        ordinals = np.array([d.toordinal() for d in sessions], dtype=np.int64)
+        market = dm.market if dm.use_mock_data else None
+        if market is not None:
+            # Correlated mock market: the whole block in one vectorized lookup
+            close, change = market.quotes(sessions, self.codes)
+            if len(dm.actions):
+                # Raw mock prices, as get_stock_data gives them
+                close = np.round(close * dm.actions.panel(self.codes, ordinals), 2)
+        else:
+            close = np.full((len(sessions), len(self.codes)), np.nan)
+            change = np.full((len(sessions), len(self.codes)), np.nan)
+        days = {}
+        with dm.deferred_saves():
+            for j, code in enumerate(self.codes):
+                found, rows, prev = self._real_bars(code, ordinals)
+                if found.any():
+                    close[found, j] = rows["close"][found]
+                    change[found, j] = (rows["close"][found] / prev[found] - 1.0) * 100
+                # With a mock market only dates outside its range (NaN) still need a quote
+                missing = ~found & np.isnan(close[:, j]) if market is not None else ~found
+                for i in np.flatnonzero(missing).tolist():
+                    d = sessions[i]
+                    date_str = d.strftime("%Y-%m-%d")
+                    if date_str not in days:
+                        days[date_str] = dm.get_cached_day(date_str)
+                    quote = days[date_str].get(code) or dm.get_stock_data(code, d)
+                    if quote is not None:
+                        close[i, j] = float(quote["price"])
+                        change[i, j] = float(quote["change_percent"])
+        for i, o in enumerate(ordinals.tolist()):
+            self._rows[o] = (close[i], change[i])
+
+    @timed("screener.volume_rows")
+    def _build_volume(self, sessions):
+        """Fill the volume row cache: real bar volume, else the K-line chart's synthetic volume."""
+        dm = self.data_manager
+        ordinals = np.array([d.toordinal() for d in sessions], dtype=np.int64)
+        volume = np.full((len(sessions), len(self.codes)), np.nan)
+        close = np.vstack([self._rows[o][0] for o in ordinals.tolist()])
+        for j, code in enumerate(self.codes):
+            found, rows, _ = self._real_bars(code, ordinals)
+            if found.any():
+                volume[found, j] = rows["volume"][found]
+            for i in np.flatnonzero(~found & np.isfinite(close[:, j])).tolist():
+                volume[i, j] = dm.synthetic_bar(code, sessions[i], close[i, j])["volume"]
+        for i, o in enumerate(ordinals.tolist()):
+            self._volume[o] = volume[i]
+
+    def panel(self, end_date, sessions=None, with_volume=True):
+        """Panel of the ``sessions`` (default ``lookback``) sessions ending on ``end_date``'s session."""
+        with self._lock:
+            self._sync_codes()
+            return self._panel(end_date, sessions or self.lookback, with_volume)
+
+    def _panel(self, end_date, n, with_volume):
+        dm = self.data_manager
+        end = dm.session_date(end_date)
+        dates = dm.calendar.sessions_before(end + datetime.timedelta(days=1), n)
+        missing = [d for d in dates if d.toordinal() not in self._rows]
+        if missing:
+            self._build_rows(missing)
+        if with_volume:
+            missing = [d for d in dates if d.toordinal() not in self._volume]
+            if missing:
+                self._build_volume(missing)
+        if not dates:
+            empty = np.zeros((0, len(self.codes)))
+            return Panel(self.codes, dates, empty, empty, empty if with_volume else None)
+        close = np.vstack([self._rows[d.toordinal()][0] for d in dates])
+        change = np.vstack([self._rows[d.toordinal()][1] for d in dates])
+        volume = np.vstack([self._volume[d.toordinal()] for d in dates]) if with_volume else None
+        if len(dm.actions):
+            close = close * dm.actions.panel(self.codes, dates, as_of=end)
+            if volume is not None:
+                volume = volume * dm.actions.panel(self.codes, dates, as_of=end, splits=True)
+        return Panel(self.codes, dates, close, change, volume)
+
+    def _window(self, end_date, columns):
+        """(panel, column lookup) for a window long enough for every column in ``columns``."""
+        parsed = [parse_column(name) for name in columns]
+        need = max([COLUMNS[b][2](n) for b, n in parsed] + [1])
+        panel = self._panel(end_date, need, any(b in VOLUME_COLUMNS for b, _ in parsed))
+        key = (self.data_manager.session_date(end_date).toordinal(), need)
+        cache = self._columns.get(key)
+        if cache is None:
+            cache = self._columns[key] = {}
+            while len(self._columns) > self.max_windows:
+                self._columns.popitem(last=False)
+        else:
+            self._columns.move_to_end(key)
+
+        def column(name):
+            if name not in cache:
+                base, n = parse_column(name)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    cache[name] = COLUMNS[base][0](panel, n)
+            return cache[name]
+        return panel, column
+
+    def evaluate(self, expr, end_date):
+        """(dates, values): ``expr`` over the (sessions x codes) panel ending on ``end_date``."""
+        tree, columns = compile_expression(expr)
+        with self._lock:
+            self._sync_codes()
+            panel, column = self._window(end_date, columns)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = _evaluate(tree, column)
+        return panel.dates, np.broadcast_to(values, (len(panel.dates), len(panel.codes)))
+
+    @timed("screener.screen")
+    def screen(self, expr="", end_date=None, rank_by="change_percent", descending=True, limit=50):
+        """Codes passing ``expr`` on ``end_date``, ranked by ``rank_by``.
+
+        Returns [{"code", "name", "rank", <column>: value, ...}] with the last
+        session's value of every column used in either expression.
+        """
+        filter_tree, filter_cols = compile_expression(expr) if expr and expr.strip() else (None, set())
+        rank_tree, rank_cols = compile_expression(rank_by)
+        with self._lock:
+            self._sync_codes()
+            panel, column = self._window(end_date, filter_cols | rank_cols)
+            if not len(panel.dates):
+                return []
+            with np.errstate(divide="ignore", invalid="ignore"):
+                last = {name: column(name)[-1] for name in filter_cols | rank_cols}
+                mask = np.ones(len(panel.codes), dtype=bool)
+                if filter_tree is not None:
+                    mask = np.broadcast_to(_truth(_evaluate(filter_tree, lambda name: last[name])),
+                                           mask.shape)
+                rank = np.broadcast_to(np.asarray(_evaluate(rank_tree, lambda name: last[name]), dtype=float),
+                                       mask.shape)
+        hits = np.flatnonzero(mask & np.isfinite(rank))
+        keys = -rank[hits] if descending else rank[hits]
+        if limit and len(hits) > limit:
+            top = np.argpartition(keys, limit - 1)[:limit]
+            hits, keys = hits[top], keys[top]
+        hits = hits[np.argsort(keys, kind="stable")]
+        names = getattr(self.data_manager, "stock_list", {}) or {}
+        return [
+            dict({"code": panel.codes[j], "name": names.get(panel.codes[j], panel.codes[j]), "rank": float(rank[j])},
+                 **{name: float(values[j]) for name, values in last.items()})
+            for j in hits.tolist()
+        ]
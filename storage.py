@@ -0,0 +1,376 @@
+"""SQLite persistence (WAL mode) for prices, bars, trades, orders, events and universe.
+
+This is an opt-in alternative to the JSON files. Select it with
+``STOCK_SIM_STORAGE=sqlite``, or pass ``storage="sqlite"`` (or a
+``SQLiteStore``) to ``StockDataManager`` / ``TradeManager``. The database
+path defaults to ``stock_sim.db`` next to mock.py and can be changed with
+``STOCK_SIM_DB``.
+
+Every write touches only the rows that changed. Bulk writes go through
+``executemany`` with one prepared statement. Each thread gets its own
+connection (``threading.local``). WAL journaling lets readers run while a
+writer commits, and a busy timeout makes concurrent simulator processes
+wait for each other instead of overwriting each other's files.
+
+Writes from several processes on one account merge instead of clobbering
+each other. New trades are numbered from ``MAX(seq) + 1`` inside the write
+transaction. Undone trades are deleted by the seqs they were given. Cash is
+written as the change since the process last saved it. Events are added
+and removed one row at a time by id.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    code TEXT NOT NULL,
+    date TEXT NOT NULL,
+    price REAL NOT NULL,
+    change_percent REAL NOT NULL,
+    PRIMARY KEY (code, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS prices_by_date ON prices (date);
+
+-- Real OHLCV bars per code, as raw bars.BAR_DTYPE bytes
+CREATE TABLE IF NOT EXISTS bars (
+    code TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    account TEXT PRIMARY KEY,
+    cash REAL NOT NULL,
+    initial_cash REAL NOT NULL,
+    settings TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS trades (
+    account TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    stock_code TEXT NOT NULL,
+    stock_name TEXT NOT NULL,
+    trade_type TEXT NOT NULL,
+    shares INTEGER NOT NULL,
+    price REAL NOT NULL,
+    total_amount REAL NOT NULL,
+    PRIMARY KEY (account, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trades_by_code ON trades (account, stock_code);
+
+CREATE TABLE IF NOT EXISTS pending_orders (
+    account TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    code TEXT,
+    status TEXT,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (account, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL,
+    start TEXT NOT NULL,
+    days INTEGER NOT NULL,
+    impact_pct REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_code ON events (code);
+
+CREATE TABLE IF NOT EXISTS universe (
+    position INTEGER NOT NULL,
+    code TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+-- Format stamps, e.g. the price cache version (mock.PRICE_CACHE_VERSION)
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+DEFAULT_DB = "stock_sim.db"
+
+
+def storage_mode(explicit=None):
+    """'sqlite' or 'json' from an explicit choice or STOCK_SIM_STORAGE."""
+    if isinstance(explicit, SQLiteStore):
+        return "sqlite"
+    value = explicit if explicit is not None else os.environ.get("STOCK_SIM_STORAGE", "json")
+    return "sqlite" if str(value).strip().lower() in ("sqlite", "sqlite3", "db") else "json"
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(storage=None, base_dir="."):
+    """Resolve ``storage`` to a shared SQLiteStore (one per database path), or None for JSON."""
+    if isinstance(storage, SQLiteStore):
+        return storage
+    if storage_mode(storage) != "sqlite":
+        return None
+    path = os.path.join(base_dir, os.environ.get("STOCK_SIM_DB", DEFAULT_DB))
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SQLiteStore(path)
+        return store
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    # ----------------------- Connections -----------------------
+    def connection(self):
+        """This thread's connection (opened on first use)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def backup_table(self, table, suffix):
+        """Copy ``table`` into ``<table>_<suffix>`` unless that backup already exists."""
+        with self.transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_{suffix} AS SELECT * FROM {table}")
+
+    def is_empty(self, table):
+        return self.connection().execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+
+    # ----------------------- Prices -----------------------
+    def get_price(self, code, date_str):
+        row = self.connection().execute(
+            "SELECT price, change_percent FROM prices WHERE code = ? AND date = ?", (code, date_str)
+        ).fetchone()
+        return {"price": row[0], "change_percent": row[1]} if row else None
+
+    def get_day(self, date_str):
+        """{code: {"price", "change_percent"}} for one date."""
+        rows = self.connection().execute(
+            "SELECT code, price, change_percent FROM prices WHERE date = ?", (date_str,)
+        )
+        return {code: {"price": price, "change_percent": pct} for code, price, pct in rows}
+
+    def get_prices(self, code, start_str, end_str):
+        """[(date, price, change_percent)] for ``code`` with start <= date <= end, oldest first."""
+        return self.connection().execute(
+            "SELECT date, price, change_percent FROM prices WHERE code = ? AND date BETWEEN ? AND ? ORDER BY date",
+            (code, start_str, end_str)
+        ).fetchall()
+
+    def put_prices(self, rows):
+        """Upsert (code, date, price, change_percent) rows."""
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO prices (code, date, price, change_percent) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def delete_prices(self, code, date_strs):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM prices WHERE code = ? AND date = ?", [(code, d) for d in date_strs])
+
+    def delete_prices_from(self, code, start_str):
+        """Delete the cached prices of ``code`` on or after ``start_str``."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM prices WHERE code = ? AND date >= ?", (code, start_str))
+
+    def clear_prices(self):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM prices")
+
+    def price_count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+
+    def load_bars(self, code):
+        row = self.connection().execute("SELECT data FROM bars WHERE code = ?", (code,)).fetchone()
+        return row[0] if row else None
+
+    def put_bars(self, items):
+        """Replace the bar blobs of (code, bytes) items."""
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO bars (code, data) VALUES (?, ?)", items)
+
+    def bar_codes(self):
+        return [row[0] for row in self.connection().execute("SELECT code FROM bars")]
+
+    def clear_bars(self):
+        """Delete every bar blob together with the cached prices of those codes."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM prices WHERE code IN (SELECT code FROM bars)")
+            conn.execute("DELETE FROM bars")
+
+    # ----------------------- Accounts / trades / orders -----------------------
+    def load_account(self, account):
+        """(cash, initial_cash, settings dict) or None if the account was never saved."""
+        row = self.connection().execute(
+            "SELECT cash, initial_cash, settings FROM accounts WHERE account = ?", (account,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def load_trades(self, account):
+        """Trade records (JSON layout) in log order."""
+        return self.load_trade_rows(account)[1]
+
+    def load_trade_rows(self, account):
+        """(seqs, trade records) in log order."""
+        rows = self.connection().execute(
+            "SELECT seq, date, stock_code, stock_name, trade_type, shares, price, total_amount "
+            "FROM trades WHERE account = ? ORDER BY seq", (account,)
+        ).fetchall()
+        seqs = [row[0] for row in rows]
+        records = [
+            {"date": d, "stock_code": c, "stock_name": n, "trade_type": t,
+             "shares": q, "price": p, "total_amount": a}
+            for _, d, c, n, t, q, p, a in rows
+        ]
+        return seqs, records
+
+    def load_pending_orders(self, account):
+        rows = self.connection().execute(
+            "SELECT payload FROM pending_orders WHERE account = ? ORDER BY seq", (account,)
+        )
+        return [json.loads(payload) for (payload,) in rows]
+
+    def save_account(self, account, cash, initial_cash, settings, new_trades=(), drop_seqs=(),
+                     pending_orders=None, cash_base=None, clear=False):
+        """Write account state in one transaction; returns the seqs given to ``new_trades``.
+
+        ``drop_seqs`` trades (every trade of the account with ``clear``, after
+        a reset) are deleted first. ``new_trades`` rows (date,
+        code, name, type, shares, price, amount) are appended after the
+        newest stored trade of the account, whoever wrote it. With
+        ``cash_base`` (the cash this process last saved) the stored cash moves
+        by ``cash - cash_base``, so other processes' changes are kept;
+        without it ``cash`` is written as is. ``pending_orders`` (if given)
+        replaces the stored list.
+        """
+        with self.transaction() as conn:
+            updated = 0
+            if cash_base is not None:
+                updated = conn.execute(
+                    "UPDATE accounts SET cash = cash + ?, initial_cash = ?, settings = ? WHERE account = ?",
+                    (cash - cash_base, initial_cash, json.dumps(settings), account)
+                ).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT OR REPLACE INTO accounts (account, cash, initial_cash, settings) VALUES (?, ?, ?, ?)",
+                    (account, cash, initial_cash, json.dumps(settings))
+                )
+            if clear:
+                conn.execute("DELETE FROM trades WHERE account = ?", (account,))
+            elif drop_seqs:
+                conn.executemany("DELETE FROM trades WHERE account = ? AND seq = ?",
+                                 [(account, seq) for seq in drop_seqs])
+            seqs = []
+            if new_trades:
+                first = conn.execute(
+                    "SELECT COALESCE(MAX(seq), -1) + 1 FROM trades WHERE account = ?", (account,)
+                ).fetchone()[0]
+                seqs = list(range(first, first + len(new_trades)))
+                conn.executemany(
+                    "INSERT INTO trades (account, seq, date, stock_code, stock_name, trade_type, "
+                    "shares, price, total_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(account, seq) + tuple(row) for seq, row in zip(seqs, new_trades)]
+                )
+            if pending_orders is not None:
+                conn.execute("DELETE FROM pending_orders WHERE account = ?", (account,))
+                conn.executemany(
+                    "INSERT INTO pending_orders (account, seq, code, status, payload) VALUES (?, ?, ?, ?, ?)",
+                    [(account, i, o.get("code"), o.get("status"), json.dumps(o, ensure_ascii=False))
+                     for i, o in enumerate(pending_orders)]
+                )
+        return seqs
+
+    def trade_count(self, account):
+        return self.connection().execute("SELECT COUNT(*) FROM trades WHERE account = ?", (account,)).fetchone()[0]
+
+    # ----------------------- Meta -----------------------
+    def get_meta(self, key, default=None):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    # ----------------------- Events / universe -----------------------
+    def load_events(self):
+        return self.load_event_rows()[1]
+
+    def load_event_rows(self):
+        """(ids, events) in insertion order."""
+        rows = self.connection().execute("SELECT id, code, start, days, impact_pct FROM events ORDER BY id").fetchall()
+        return [row[0] for row in rows], [{"code": c, "start": s, "days": d, "impact_pct": i} for _, c, s, d, i in rows]
+
+    def add_event(self, event):
+        """Insert one event; returns its id."""
+        with self.transaction() as conn:
+            return conn.execute(
+                "INSERT INTO events (code, start, days, impact_pct) VALUES (?, ?, ?, ?)",
+                (event["code"], event["start"], int(event["days"]), float(event["impact_pct"]))
+            ).lastrowid
+
+    def delete_event(self, event_id):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+
+    def replace_events(self, events):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM events")
+            conn.executemany(
+                "INSERT INTO events (code, start, days, impact_pct) VALUES (?, ?, ?, ?)",
+                [(e.get("code"), e.get("start", ""), int(e.get("days", 0)), float(e.get("impact_pct", 0.0)))
+                 for e in events]
+            )
+
+    def load_universe(self):
+        rows = self.connection().execute("SELECT code, name FROM universe ORDER BY position")
+        return {code: name for code, name in rows}
+
+    def save_universe(self, stock_list):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM universe")
+            conn.executemany(
+                "INSERT INTO universe (position, code, name) VALUES (?, ?, ?)",
+                [(i, code, name) for i, (code, name) in enumerate(stock_list.items())]
+            )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error); nests as a no-op."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.outer = False
+
+    def __enter__(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.outer = True
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.outer:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
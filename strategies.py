@@ -0,0 +1,147 @@
+"""Vectorized auto-trading strategies.
+
+A strategy sees the whole universe at once: on every step it receives a
+``StrategyContext`` of NumPy arrays (prices, positions, cost basis and any
+indicator columns) and returns a signed share order per code (positive =
+buy, negative = sell, 0 = nothing). ``StrategyEngine`` runs a list of
+strategies in priority order; for each code the first strategy with a
+non-zero order wins.
+
+Arrays may be 1-D (one account, [code]) or 2-D ([account, code], as used by
+``accounts.AccountPool``); the built-in rules only use element-wise
+operations, and their parameters may be scalars or per-account column
+vectors.
+"""
+import numpy as np
+
+
+class StrategyContext:
+    """Per-step inputs handed to every strategy."""
+
+    __slots__ = ("date", "codes", "prices", "positions", "cost", "cash", "indicators", "_pnl_pct")
+
+    def __init__(self, date, codes, prices, positions, cost, cash=0.0, indicators=None):
+        self.date = date
+        self.codes = codes
+        self.prices = prices
+        self.positions = positions
+        self.cost = cost
+        self.cash = cash
+        self.indicators = indicators if indicators is not None else {}
+        self._pnl_pct = None
+
+    def pnl_pct(self):
+        """Unrealized P&L of each position as a % of its cost basis (NaN where nothing is held)."""
+        if self._pnl_pct is None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                pct = (self.prices * self.positions - self.cost) / self.cost * 100.0
+            self._pnl_pct = np.where(self.held(), pct, np.nan)
+        return self._pnl_pct
+
+    def held(self):
+        return (self.positions > 0) & (self.cost > 0) & np.isfinite(self.prices)
+
+
+class Strategy:
+    """Base class: override ``on_step`` to return an order array shaped like ``ctx.positions``.
+
+    ``indicators`` lists the indicator specs (see indicators.py) the strategy
+    reads from ``ctx.indicators``; each maps to {column: array over codes}.
+    """
+
+    name = "Strategy"
+    indicators = ()
+
+    def on_step(self, ctx):
+        raise NotImplementedError
+
+
+class StopLossStrategy(Strategy):
+    """Sell the whole position once its loss reaches ``stop_loss_pct`` percent."""
+
+    name = "Auto Stop-Loss"
+
+    def __init__(self, stop_loss_pct):
+        self.stop_loss_pct = stop_loss_pct
+
+    def on_step(self, ctx):
+        stop = self.stop_loss_pct
+        hit = (stop > 0) & (ctx.pnl_pct() <= -stop)
+        return np.where(hit, -ctx.positions, 0)
+
+
+class ScaleInOutStrategy(Strategy):
+    """Trim ``fraction_pct`` of a position after a gain of ``step_pct`` percent,
+    add the same fraction after a loss of ``step_pct`` percent."""
+
+    name = "Auto Scale"
+
+    def __init__(self, step_pct, fraction_pct):
+        self.step_pct = step_pct
+        self.fraction_pct = fraction_pct
+
+    def on_step(self, ctx):
+        step = self.step_pct
+        frac = self.fraction_pct / 100.0
+        pnl = ctx.pnl_pct()
+        active = (step > 0) & (frac > 0)
+        scale = np.maximum(1, (ctx.positions * frac).astype(np.int64))
+        scale_out = active & (pnl >= step) & (ctx.positions - scale > 0)
+        scale_in = active & ~scale_out & (pnl <= -step)
+        return np.where(scale_out, -scale, np.where(scale_in, scale, 0))
+
+
+class StrategyEngine:
+    """Runs strategies in priority order and merges their orders."""
+
+    def __init__(self, strategies=None):
+        self.strategies = list(strategies or [])
+
+    def add(self, strategy):
+        self.strategies.append(strategy)
+        return strategy
+
+    def evaluate(self, ctx):
+        """Return (orders, source): merged signed share orders and, per code, the
+        index of the strategy that produced the order (-1 for none)."""
+        shape = np.shape(ctx.positions)
+        orders = np.zeros(shape, dtype=np.int64)
+        source = np.full(shape, -1, dtype=np.int16)
+        for k, strategy in enumerate(self.strategies):
+            proposed = strategy.on_step(ctx)
+            if proposed is None:
+                continue
+            take = (np.asarray(proposed) != 0) & (source < 0)
+            orders = np.where(take, proposed, orders)
+            source[take] = k
+        return orders, source
+
+    def label(self, source_index):
+        return self.strategies[source_index].name
+
+    def as_pool_strategy(self, indicators=None):
+        """Adapt the engine to ``AccountPool.step``/``run``.
+
+        ``indicators(date, prices)`` may return a dict of indicator arrays.
+        """
+        def strategy(pool, date, prices):
+            ctx = StrategyContext(
+                date,
+                pool.codes,
+                prices[None, :],
+                pool.positions,
+                pool.cost,
+                pool.cash[:, None],
+                indicators(date, prices) if indicators is not None else None,
+            )
+            orders, _ = self.evaluate(ctx)
+            return orders
+        return strategy
+
+
+def default_engine(stop_loss_pct, scale_step_pct, scale_fraction_pct):
+    """The built-in rules in their historical order: stop-loss first, then scaling."""
+    return StrategyEngine([
+        StopLossStrategy(stop_loss_pct),
+        ScaleInOutStrategy(scale_step_pct, scale_fraction_pct),
+    ])
@@ -0,0 +1,294 @@
+"""Compact columnar storage for trade records.
+
+Trades are kept in a growable structured NumPy array (date as ordinal day,
+interned code/name ids, side as int8, shares, price, amount) instead of a
+list of dicts. ``TradeStore`` still behaves like the old list for the UI and
+JSON code: indexing and iteration yield read-only dict-like
+``TradeRecordView`` objects, ``append`` accepts a record dict, and
+``to_records``/``from_records`` convert to and from the JSON layout.
+"""
+import datetime
+from collections.abc import Mapping
+
+import numpy as np
+
+BUY = 1
+SELL = -1
+
+TRADE_DTYPE = np.dtype([
+    ("date", np.int32),      # date.toordinal(); negative = -(pool id + 1) of an unparseable date string
+    ("code", np.int32),
+    ("name", np.int32),
+    ("side", np.int8),
+    ("shares", np.int64),
+    ("price", np.float64),
+    ("amount", np.float64),
+])
+
+RECORD_FIELDS = ("date", "stock_code", "stock_name", "trade_type", "shares", "price", "total_amount")
+
+
+class StringPool:
+    """Interns strings to dense int ids."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = len(self.strings)
+            self.ids[value] = idx
+            self.strings.append(value)
+        return idx
+
+    def lookup(self, idx):
+        return self.strings[idx]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class TradeRecordView(Mapping):
+    """Read-only dict-like view of one row of a TradeStore."""
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._store.get_field(self._index, key)
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def __len__(self):
+        return len(RECORD_FIELDS)
+
+    def __repr__(self):
+        return f"TradeRecordView({dict(self)!r})"
+
+
+class TradeStore:
+    """Append-only columnar trade log with list-like access."""
+
+    def __init__(self, capacity=64):
+        self._array = np.zeros(max(1, capacity), dtype=TRADE_DTYPE)
+        self._size = 0
+        self.codes = StringPool()
+        self.names = StringPool()
+        self.bad_dates = StringPool()
+        self._date_cache = {}
+        # Sizes the log was cut back to (truncate/clear), so readers that
+        # index trades by position (checkpoints.py) know what to drop
+        self.truncations = []
+
+    # ----------------------- Construction / conversion -----------------------
+    @classmethod
+    def from_records(cls, records):
+        """Build a store from a list of record dicts (JSON layout)."""
+        store = cls(capacity=len(records))
+        n = len(records)
+        encode_date = store._encode_date
+        code_intern = store.codes.intern
+        name_intern = store.names.intern
+        arr = store._array
+        arr["date"][:n] = [encode_date(rec["date"]) for rec in records]
+        arr["code"][:n] = [code_intern(rec["stock_code"]) for rec in records]
+        arr["name"][:n] = [name_intern(rec.get("stock_name", rec["stock_code"])) for rec in records]
+        arr["side"][:n] = [BUY if rec["trade_type"] == "Buy" else SELL for rec in records]
+        arr["shares"][:n] = [int(rec["shares"]) for rec in records]
+        arr["price"][:n] = [float(rec["price"]) for rec in records]
+        arr["amount"][:n] = [float(rec["total_amount"]) for rec in records]
+        store._size = n
+        return store
+
+    @classmethod
+    def from_array(cls, rows, codes, names, bad_dates=()):
+        """Build a store from TRADE_DTYPE rows and the string pools they index."""
+        store = cls(capacity=len(rows))
+        store._array[:len(rows)] = rows
+        store._size = len(rows)
+        for pool, strings in ((store.codes, codes), (store.names, names), (store.bad_dates, bad_dates)):
+            for value in strings:
+                pool.intern(value)
+        return store
+
+    def to_records(self):
+        """Return all trades as a list of plain dicts (JSON layout)."""
+        arr = self._array[:self._size]
+        # Format each distinct date once
+        unique_dates, inverse = np.unique(arr["date"], return_inverse=True)
+        labels = [self._decode_date(d) for d in unique_dates.tolist()]
+        dates = [labels[i] for i in inverse.tolist()]
+        codes = self.codes.strings
+        names = self.names.strings
+        return [
+            {
+                "date": date,
+                "stock_code": codes[c],
+                "stock_name": names[nm],
+                "trade_type": "Buy" if s == BUY else "Sell",
+                "shares": q,
+                "price": p,
+                "total_amount": a
+            }
+            for date, c, nm, s, q, p, a in zip(
+                dates,
+                arr["code"].tolist(),
+                arr["name"].tolist(),
+                arr["side"].tolist(),
+                arr["shares"].tolist(),
+                arr["price"].tolist(),
+                arr["amount"].tolist()
+            )
+        ]
+
+    def _encode_date(self, value):
+        cached = self._date_cache.get(value)
+        if cached is not None:
+            return cached
+        try:
+            encoded = datetime.date.fromisoformat(value).toordinal()
+        except Exception:
+            encoded = -(self.bad_dates.intern(str(value)) + 1)
+        self._date_cache[value] = encoded
+        return encoded
+
+    def _decode_date(self, ordinal):
+        if ordinal > 0:
+            return datetime.date.fromordinal(ordinal).strftime("%Y-%m-%d")
+        return self.bad_dates.lookup(-ordinal - 1)
+
+    # ----------------------- Mutation -----------------------
+    def _grow(self, needed):
+        capacity = len(self._array)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        grown = np.zeros(capacity, dtype=TRADE_DTYPE)
+        grown[:self._size] = self._array[:self._size]
+        self._array = grown
+
+    def add(self, date, stock_code, stock_name, trade_type, shares, price, total_amount):
+        """Append one trade and return its index."""
+        self._grow(self._size + 1)
+        i = self._size
+        self._array[i] = (
+            self._encode_date(date),
+            self.codes.intern(stock_code),
+            self.names.intern(stock_name),
+            BUY if trade_type == "Buy" else SELL,
+            int(shares),
+            float(price),
+            float(total_amount),
+        )
+        self._size += 1
+        return i
+
+    def append(self, record):
+        """List-compatible append of a record dict."""
+        self.add(
+            record["date"],
+            record["stock_code"],
+            record.get("stock_name", record["stock_code"]),
+            record["trade_type"],
+            record["shares"],
+            record["price"],
+            record["total_amount"]
+        )
+
+    def extend(self, records):
+        for rec in records:
+            self.append(rec)
+
+    def truncate(self, size):
+        """Drop all trades from index ``size`` on."""
+        self._size = max(0, min(size, self._size))
+        self.truncations.append(self._size)
+
+    def clear(self):
+        self._size = 0
+        self.truncations.append(0)
+
+    # ----------------------- Access -----------------------
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TradeRecordView(self, i) for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("trade index out of range")
+        return TradeRecordView(self, index)
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield TradeRecordView(self, i)
+
+    def get_field(self, index, key):
+        row = self._array[index]
+        if key == "date":
+            return self._decode_date(int(row["date"]))
+        if key == "stock_code":
+            return self.codes.lookup(int(row["code"]))
+        if key == "stock_name":
+            return self.names.lookup(int(row["name"]))
+        if key == "trade_type":
+            return "Buy" if row["side"] == BUY else "Sell"
+        if key == "shares":
+            return int(row["shares"])
+        if key == "price":
+            return float(row["price"])
+        if key == "total_amount":
+            return float(row["amount"])
+        raise KeyError(key)
+
+    # Column views (length == len(self)); do not hold on to them across appends
+    @property
+    def array(self):
+        return self._array[:self._size]
+
+    @property
+    def dates(self):
+        return self._array["date"][:self._size]
+
+    @property
+    def code_ids(self):
+        return self._array["code"][:self._size]
+
+    @property
+    def sides(self):
+        return self._array["side"][:self._size]
+
+    @property
+    def shares(self):
+        return self._array["shares"][:self._size]
+
+    @property
+    def prices(self):
+        return self._array["price"][:self._size]
+
+    @property
+    def amounts(self):
+        return self._array["amount"][:self._size]
+
+    def code_of(self, code_id):
+        return self.codes.lookup(int(code_id))
+
+    def code_id(self, code):
+        """Interned id of ``code`` or None if it never traded."""
+        return self.codes.ids.get(code)
+
+    @property
+    def nbytes(self):
+        return self._array[:self._size].nbytes
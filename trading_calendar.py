@@ -0,0 +1,199 @@
+"""Trading-day calendar with O(1) session lookups.
+
+Sessions are precomputed once as a sorted int32 array of date ordinals
+(weekdays minus exchange holidays). A second array holds, for every
+calendar day in range, the number of sessions up to and including that day.
+With it, "is this a session", next/previous session, "roll back to the last
+session" and "n sessions later" are single array lookups. Vector queries use
+``np.searchsorted``.
+
+The default calendar follows NYSE rules (the simulator's universe is US
+stocks, fetched with akshare's ``stock_us_daily``). It covers fixed and
+floating holidays, Sat→Fri / Sun→Mon observance, Good Friday and the
+market's unscheduled closures.
+"""
+import datetime
+
+import numpy as np
+
+FIRST_YEAR = 1970
+LAST_YEAR = 2100
+
+# Unscheduled full-day NYSE closures (weather, national days of mourning, 9/11)
+NYSE_SPECIAL_CLOSURES = (
+    "1972-12-28", "1973-01-25", "1977-07-14", "1985-09-27", "1994-04-27",
+    "2001-09-11", "2001-09-12", "2001-09-13", "2001-09-14", "2004-06-11",
+    "2007-01-02", "2012-10-29", "2012-10-30", "2018-12-05", "2025-01-09",
+)
+
+
+def _easter(year):
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    """n-th (1-based) ``weekday`` of a month; n = -1 for the last one."""
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    """Saturday holidays close the Friday before, Sunday holidays the Monday after."""
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+def nyse_holidays(year):
+    """Full-day NYSE holidays of ``year`` (regular rules only)."""
+    days = []
+    new_year = datetime.date(year, 1, 1)
+    # A Saturday New Year's Day is not observed on the Friday before (end of the prior year)
+    if new_year.weekday() != 5:
+        days.append(_observed(new_year))
+    if year >= 1998:
+        days.append(_nth_weekday(year, 1, 0, 3))            # Martin Luther King Jr. Day
+    days.append(_nth_weekday(year, 2, 0, 3))                # Washington's Birthday
+    days.append(_easter(year) - datetime.timedelta(days=2))  # Good Friday
+    days.append(_nth_weekday(year, 5, 0, -1))               # Memorial Day
+    if year >= 2022:
+        days.append(_observed(datetime.date(year, 6, 19)))  # Juneteenth
+    days.append(_observed(datetime.date(year, 7, 4)))       # Independence Day
+    days.append(_nth_weekday(year, 9, 0, 1))                # Labor Day
+    days.append(_nth_weekday(year, 11, 3, 4))               # Thanksgiving
+    days.append(_observed(datetime.date(year, 12, 25)))     # Christmas
+    return days
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+class TradingCalendar:
+    def __init__(self, holidays=None, first_year=FIRST_YEAR, last_year=LAST_YEAR):
+        """``holidays``: extra non-trading dates; None uses the NYSE rules."""
+        self.first = datetime.date(first_year, 1, 1).toordinal()
+        self.last = datetime.date(last_year, 12, 31).toordinal()
+        ordinals = np.arange(self.first, self.last + 1, dtype=np.int32)
+        # date.toordinal() is 1 for Monday 0001-01-01, so weekday = (ordinal - 1) % 7
+        is_session = (ordinals - 1) % 7 < 5
+        if holidays is None:
+            holidays = [d for y in range(first_year, last_year + 1) for d in nyse_holidays(y)]
+            holidays += [datetime.date.fromisoformat(d) for d in NYSE_SPECIAL_CLOSURES]
+        closed = np.array([_as_date(d).toordinal() for d in holidays], dtype=np.int64) - self.first
+        closed = closed[(closed >= 0) & (closed < len(ordinals))]
+        is_session[closed] = False
+        self._is_session = is_session
+        self.sessions = ordinals[is_session]
+        # Number of sessions on or before each calendar day
+        self._count = np.cumsum(is_session, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _offset(self, day):
+        ordinal = _as_date(day).toordinal()
+        if not self.first <= ordinal <= self.last:
+            raise ValueError(f"{day} is outside the trading calendar range")
+        return ordinal - self.first
+
+    def _session(self, index):
+        if not 0 <= index < len(self.sessions):
+            raise ValueError("session index outside the trading calendar range")
+        return datetime.date.fromordinal(int(self.sessions[index]))
+
+    # ----------------------- Scalar lookups (O(1)) -----------------------
+    def is_session(self, day):
+        return bool(self._is_session[self._offset(day)])
+
+    def index_on_or_before(self, day):
+        """Index into ``sessions`` of the last session on or before ``day`` (-1 if none)."""
+        return int(self._count[self._offset(day)]) - 1
+
+    def rollback(self, day):
+        """``day`` if it is a session, otherwise the previous session."""
+        return self._session(self.index_on_or_before(day))
+
+    def rollforward(self, day):
+        """``day`` if it is a session, otherwise the next session."""
+        i = self.index_on_or_before(day)
+        return self._session(i if self.is_session(day) else i + 1)
+
+    def next_session(self, day):
+        return self._session(self.index_on_or_before(day) + 1)
+
+    def previous_session(self, day):
+        i = self.index_on_or_before(day)
+        return self._session(i - 1 if self.is_session(day) else i)
+
+    def offset(self, day, n):
+        """The session ``n`` sessions after ``day`` rolled back (n may be negative)."""
+        return self._session(self.index_on_or_before(day) + n)
+
+    def _index_before(self, day):
+        """Number of sessions strictly before ``day``."""
+        return self.index_on_or_before(day) + (0 if self.is_session(day) else 1)
+
+    def session_before(self, day, n):
+        """The ``n``-th session strictly before ``day`` (n >= 1)."""
+        return self._session(self._index_before(day) - n)
+
+    def sessions_before(self, day, n):
+        """The ``n`` sessions strictly before ``day``, oldest first."""
+        end = self._index_before(day)
+        start = max(0, end - n)
+        return [datetime.date.fromordinal(int(o)) for o in self.sessions[start:end]]
+
+    def sessions_between(self, start, end):
+        """Sessions with start <= date <= end, oldest first."""
+        lo = self._index_before(start)
+        hi = self.index_on_or_before(end) + 1
+        return [datetime.date.fromordinal(int(o)) for o in self.sessions[lo:hi]]
+
+    def count_in(self, start, end):
+        """Number of sessions with start <= date < end."""
+        return max(0, self._index_before(end) - self._index_before(start))
+
+    # ----------------------- Vector lookups -----------------------
+    def is_session_array(self, ordinals):
+        idx = np.asarray(ordinals, dtype=np.int64) - self.first
+        inside = (idx >= 0) & (idx < len(self._is_session))
+        out = np.zeros(idx.shape, dtype=bool)
+        out[inside] = self._is_session[idx[inside]]
+        return out
+
+    def rollback_array(self, ordinals):
+        """Last session on or before each ordinal (as ordinals)."""
+        idx = np.searchsorted(self.sessions, np.asarray(ordinals), side="right") - 1
+        return self.sessions[np.clip(idx, 0, len(self.sessions) - 1)]
+
+
+_default = None
+
+
+def default_calendar():
+    """Shared NYSE calendar, built on first use."""
+    global _default
+    if _default is None:
+        _default = TradingCalendar()
+    return _default
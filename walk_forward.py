@@ -0,0 +1,205 @@
+"""Walk-forward optimization of the auto-trading rule parameters.
+
+The session range is split into rolling folds. Each fold has an in-sample
+(IS) window followed by an out-of-sample (OOS) window. With ``anchored=True``
+the IS windows instead all start at the first session. For every fold:
+
+1. every parameter combination of the grid (any ``accounts.SETTING_DEFAULTS``
+   key: stop_loss_pct, scale_step_pct, scale_fraction_pct, fee_rate, ...)
+   becomes one account of an ``AccountPool``, so the whole grid is
+   backtested in a single vectorized pass over the IS window;
+2. the combination with the best IS ``objective`` (any key of
+   ``analytics.performance_summary``; Sharpe by default) is selected;
+3. that combination is backtested on the OOS window.
+
+Every window starts from cash, buys the universe equal-weighted on its first
+session, and then lets the rules manage the positions.
+
+The price panel (sessions x codes) and any indicator panels are built once
+for the whole range and sliced per fold, so folds never re-read the price
+cache. Folds run in parallel on a process pool; workers receive only these
+arrays, not the data manager.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analytics
+from accounts import AccountPool, SETTING_DEFAULTS
+from indicators import batch
+from strategies import default_engine
+
+
+def param_grid(grid):
+    """Every combination of ``{setting: [values]}`` as a list of dicts."""
+    unknown = set(grid) - set(SETTING_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown rule settings: {sorted(unknown)}")
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def make_folds(n_sessions, in_sample, out_of_sample, step=None, anchored=False):
+    """[(is_start, is_end, oos_end)] session index ranges; IS is [is_start, is_end), OOS [is_end, oos_end)."""
+    step = step or out_of_sample
+    folds = []
+    is_end = in_sample
+    while is_end + out_of_sample <= n_sessions:
+        folds.append((0 if anchored else is_end - in_sample, is_end, is_end + out_of_sample))
+        is_end += step
+    return folds
+
+
+def build_price_panel(data_manager, codes, dates):
+    """(sessions x codes) closes, read once through an AccountPool (last price carried forward)."""
+    pool = AccountPool(data_manager, codes=codes, capacity=1)
+    with data_manager.deferred_saves():
+        return np.vstack([pool.price_vector(d) for d in dates]) if dates else np.zeros((0, len(codes)))
+
+
+def rule_engine(pool):
+    """The built-in rules with per-account parameters taken from the pool's settings."""
+    return default_engine(
+        pool.setting("stop_loss_pct")[:, None],
+        pool.setting("scale_step_pct")[:, None],
+        pool.setting("scale_fraction_pct")[:, None],
+    )
+
+
+def equal_weight_orders(pool, prices, invest_pct):
+    """Share orders that put ``invest_pct`` of each account's cash into every priced code equally."""
+    valid = np.isfinite(prices) & (prices > 0)
+    if not valid.any():
+        return None
+    budget = pool.cash * invest_pct / 100.0 / valid.sum()
+    unit = (np.where(valid, prices, np.inf)[None, :] + pool.setting("slippage_per_share")[:, None]) \
+        * (1.0 + pool.setting("fee_rate")[:, None])
+    return np.floor(budget[:, None] / unit).astype(np.int64)
+
+
+def backtest_window(codes, dates, prices, combos, initial_cash=100000.0, invest_pct=95.0,
+                    engine_factory=rule_engine, indicators=None):
+    """Equity matrix (sessions x combos) of every parameter combination over one window.
+
+    ``indicators``: {spec: {column: (sessions x codes) array}} aligned with ``dates``.
+    """
+    cache = {d.strftime("%Y-%m-%d"): prices[i] for i, d in enumerate(dates)}
+    pool = AccountPool(None, codes=codes, capacity=len(combos), price_cache=cache)
+    for k, combo in enumerate(combos):
+        pool.add_account(f"p{k}", initial_cash, **combo)
+
+    strategy = engine_factory(pool).as_pool_strategy(_indicator_lookup(dates, indicators) if indicators else None)
+    pool.step(dates[0], lambda p, d, px: equal_weight_orders(p, px, invest_pct))
+    return pool.run(dates[1:], strategy)
+
+
+def _indicator_lookup(dates, indicators):
+    """``indicators(date, prices)`` callback reading row ``date`` of precomputed indicator panels."""
+    row = {d: i for i, d in enumerate(dates)}
+
+    def lookup(date, _prices):
+        i = row[date]
+        return {spec: {col: values[i] for col, values in columns.items()} for spec, columns in indicators.items()}
+    return lookup
+
+
+def _scores(ordinals, equity, objective):
+    return np.array([analytics.performance_summary(ordinals, equity[:, k]).get(objective, 0.0)
+                     for k in range(equity.shape[1])])
+
+
+def run_fold(fold, codes, dates, prices, combos, objective, initial_cash, invest_pct, engine_factory, indicators):
+    """Optimize on the IS window and evaluate the winner out of sample; returns a result dict."""
+    is_start, is_end, oos_end = fold
+
+    def window(lo, hi):
+        ind = {spec: {col: v[lo:hi] for col, v in cols.items()} for spec, cols in (indicators or {}).items()}
+        return dates[lo:hi], prices[lo:hi], ind
+
+    is_dates, is_prices, is_ind = window(is_start, is_end)
+    is_equity = backtest_window(codes, is_dates, is_prices, combos, initial_cash, invest_pct,
+                                engine_factory, is_ind)
+    is_scores = _scores([d.toordinal() for d in is_dates], is_equity, objective)
+    best = int(np.nanargmax(np.nan_to_num(is_scores, nan=-np.inf)))
+
+    oos_dates, oos_prices, oos_ind = window(is_end, oos_end)
+    oos_equity = backtest_window(codes, oos_dates, oos_prices, [combos[best]], initial_cash, invest_pct,
+                                 engine_factory, oos_ind)[:, 0]
+    return {
+        "in_sample": (is_dates[0], is_dates[-1]),
+        "out_of_sample": (oos_dates[0], oos_dates[-1]),
+        "params": combos[best],
+        "in_sample_score": float(is_scores[best]),
+        "in_sample_scores": is_scores,
+        "oos_dates": oos_dates,
+        "oos_equity": oos_equity,
+        "oos_metrics": analytics.performance_summary([d.toordinal() for d in oos_dates], oos_equity),
+    }
+
+
+class WalkForwardResult:
+    def __init__(self, folds, objective, initial_cash):
+        self.folds = folds
+        self.objective = objective
+        self.initial_cash = initial_cash
+
+    def oos_curve(self):
+        """(dates, equity): the OOS windows chained into one curve starting at ``initial_cash``."""
+        dates, values = [], []
+        level = self.initial_cash
+        for fold in self.folds:
+            equity = fold["oos_equity"]
+            if not len(equity) or equity[0] <= 0:
+                continue
+            curve = level * equity / equity[0]
+            dates.extend(fold["oos_dates"])
+            values.extend(curve.tolist())
+            level = curve[-1]
+        return dates, np.array(values)
+
+    def summary(self):
+        dates, values = self.oos_curve()
+        overall = analytics.performance_summary([d.toordinal() for d in dates], values) if len(values) else {}
+        scores = [f["oos_metrics"].get(self.objective, 0.0) for f in self.folds]
+        in_sample = [f["in_sample_score"] for f in self.folds]
+        return {
+            "folds": len(self.folds),
+            "objective": self.objective,
+            "mean_in_sample": float(np.mean(in_sample)) if in_sample else 0.0,
+            "mean_out_of_sample": float(np.mean(scores)) if scores else 0.0,
+            "out_of_sample": overall,
+            "params": [f["params"] for f in self.folds],
+        }
+
+
+def walk_forward(data_manager, grid, start, end, codes=None, in_sample=252, out_of_sample=63, step=None,
+                 anchored=False, objective="sharpe", initial_cash=100000.0, invest_pct=95.0,
+                 engine_factory=rule_engine, indicator_specs=(), workers=None, mp_context=None):
+    """Run a walk-forward optimization of ``grid`` over the sessions from ``start`` to ``end``.
+
+    ``engine_factory(pool)`` builds the StrategyEngine (must be a module-level
+    function when running on several processes). ``indicator_specs`` are
+    computed once over the whole panel and handed to the strategies.
+    ``workers``: process count (None = CPU count, 1 = run in this process).
+    """
+    codes = list(codes if codes is not None else data_manager.get_stock_list())
+    dates = data_manager.calendar.sessions_between(start, end)
+    folds = make_folds(len(dates), in_sample, out_of_sample, step, anchored)
+    if not folds:
+        raise ValueError("Date range is shorter than one in-sample + out-of-sample window")
+    combos = param_grid(grid)
+    prices = build_price_panel(data_manager, codes, dates)
+    indicators = {tuple(spec): batch(tuple(spec), prices) for spec in indicator_specs}
+
+    args = (codes, dates, prices, combos, objective, initial_cash, invest_pct, engine_factory, indicators)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(folds) <= 1:
+        results = [run_fold(fold, *args) for fold in folds]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(folds)), mp_context=mp_context) as pool:
+            futures = [pool.submit(run_fold, fold, *args) for fold in folds]
+            results = [f.result() for f in futures]
+    return WalkForwardResult(results, objective, initial_cash)
+